@@ -4,7 +4,13 @@ from supervision.detection.core import Detections
 from time import time
 import torch
 from mmdet.apis import inference_detector, init_detector, async_inference_detector
+from mmdet.core import multiclass_nms
+from mmdet.datasets import replace_ImageToTensor
+from mmdet.datasets.pipelines import Compose
+from mmcv.ops import RoIPool
+from mmcv.parallel import collate, scatter
 import cv2
+import mmcv
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.interpolate import splprep, splev
@@ -13,12 +19,227 @@ import random
 from ultralytics.yolo.utils.ops import Profile, non_max_suppression, scale_boxes, process_mask, process_mask_native
 import skimage.measure
 
+from labelme.utils.polygonize import mask_to_polygon, masks_to_polygons
+from labelme.utils.mask_fusion import MaskFusion
+from labelme.utils.detection_cache import RawDetections
+from labelme.utils.tiling import merge_tiles
+
 warnings.filterwarnings("ignore")
 
 
+def get_test_pipeline(model, array_input):
+
+    """
+    Summary:
+        Get the test pipeline of an mmdet model, built once and cached on the model.
+        The cache is rebuilt if the test pipeline of the model config changes.
+
+    Args:
+        model: the mmdet model
+        array_input: True if the images are numpy arrays (loaded with LoadImageFromWebcam), False if they are paths
+
+    Returns:
+        test_pipeline: the Compose of the test pipeline
+    """
+
+    fingerprint = str(model.cfg.data.test.pipeline)
+    cache = getattr(model, "cached_test_pipelines", None)
+    if cache is None or cache["fingerprint"] != fingerprint:
+        cache = {"fingerprint": fingerprint}
+        model.cached_test_pipelines = cache
+    if array_input not in cache:
+        cfg = model.cfg.copy()
+        cfg.data.test.pipeline = copy.deepcopy(cfg.data.test.pipeline)
+        if array_input:
+            # set loading pipeline type
+            cfg.data.test.pipeline[0].type = 'LoadImageFromWebcam'
+        cfg.data.test.pipeline = replace_ImageToTensor(cfg.data.test.pipeline)
+        cache[array_input] = Compose(cfg.data.test.pipeline)
+    return cache[array_input]
+
+
+@torch.no_grad()
+def inference_detector_cached(model, imgs):
+
+    """
+    Summary:
+        mmdet's inference_detector without rebuilding the test pipeline on every call (see get_test_pipeline).
+        numpy images are fed to the pipeline as they are (no copy).
+
+    Args:
+        model: the mmdet model
+        imgs: an image or a list of images (paths or numpy arrays, BGR)
+
+    Returns:
+        results: the result of the image, or a list of results if imgs is a list
+    """
+
+    is_batch = isinstance(imgs, (list, tuple))
+    if not is_batch:
+        imgs = [imgs]
+
+    device = next(model.parameters()).device
+    test_pipeline = get_test_pipeline(model, isinstance(imgs[0], np.ndarray))
+    datas = []
+    for img in imgs:
+        if isinstance(img, np.ndarray):
+            data = dict(img=img)
+        else:
+            data = dict(img_info=dict(filename=img), img_prefix=None)
+        datas.append(test_pipeline(data))
+
+    data = collate(datas, samples_per_gpu=len(imgs))
+    # just get the actual data from DataContainer
+    data['img_metas'] = [img_metas.data[0] for img_metas in data['img_metas']]
+    data['img'] = [img.data[0] for img in data['img']]
+    if device.type == "cuda":
+        data = scatter(data, [device])[0]
+    elif not getattr(model, "roi_pool_checked", False):
+        for m in model.modules():
+            assert not isinstance(
+                m, RoIPool
+            ), 'CPU inference with RoIPool is not supported currently.'
+        model.roi_pool_checked = True
+
+    results = model(return_loss=False, rescale=True, **data)
+    return results if is_batch else results[0]
+
+
+def model_test_cfgs(model):
+
+    """
+    Summary:
+        Get the test configs of an mmdet model that have a score threshold (the detector, its roi head, bbox head and mask head).
+
+    Args:
+        model: the mmdet model
+
+    Returns:
+        test_cfgs: a list of ConfigDict (each config once)
+    """
+
+    test_cfgs = []
+    for module in [model, getattr(model, "roi_head", None), getattr(model, "bbox_head", None), getattr(model, "mask_head", None)]:
+        test_cfg = getattr(module, "test_cfg", None)
+        if test_cfg is None:
+            continue
+        # the test config of a two stage detector has the configs of its rpn and rcnn
+        if "rcnn" in test_cfg:
+            test_cfg = test_cfg.rcnn
+        if "score_thr" in test_cfg and all(test_cfg is not other for other in test_cfgs):
+            test_cfgs.append(test_cfg)
+    return test_cfgs
+
+
+def mask_class_scores(bbox_head):
+
+    """
+    Summary:
+        Wrap the get_bboxes of an roi bbox head so the scores of the classes that are not selected are zeroed before the NMS
+        (their boxes are dropped by the score threshold, so no mask is pasted for them).
+        The scores are zeroed after the softmax (or sigmoid) over all the classes, so the selected classes keep the scores
+        the model gives them when all the classes are selected.
+        The selected classes are read from bbox_head.selected_classes (None -> all), see set_test_cfg.
+
+    Args:
+        bbox_head: the bbox head of an roi head
+
+    Returns:
+        None
+    """
+
+    if getattr(bbox_head, "class_scores_masked", False):
+        return
+    get_bboxes = bbox_head.get_bboxes
+
+    def get_bboxes_of_selected_classes(rois, cls_score, bbox_pred, img_shape, scale_factor, rescale=False, cfg=None):
+        selected_classes = getattr(bbox_head, "selected_classes", None)
+        if selected_classes is None or cfg is None or not isinstance(cls_score, torch.Tensor):
+            return get_bboxes(rois, cls_score, bbox_pred, img_shape, scale_factor, rescale=rescale, cfg=cfg)
+        # without a config, get_bboxes returns the boxes and the activated scores of all the classes before the NMS
+        bboxes, scores = get_bboxes(rois, cls_score, bbox_pred, img_shape, scale_factor, rescale=rescale, cfg=None)
+        selected = torch.zeros(scores.size(-1), dtype=torch.bool, device=scores.device)
+        selected[[class_id for class_id in selected_classes if class_id < scores.size(-1)]] = True
+        if scores.size(-1) == bbox_head.num_classes + 1:
+            # the background score of a softmax classifier (dropped by the NMS)
+            selected[-1] = True
+        scores = scores.masked_fill(~selected, 0)
+        return multiclass_nms(bboxes, scores, cfg.score_thr, cfg.nms, cfg.max_per_img)
+
+    bbox_head.get_bboxes = get_bboxes_of_selected_classes
+    bbox_head.class_scores_masked = True
+
+
+def set_test_cfg(model, score_thr=None, class_ids=None, max_per_img=None):
+
+    """
+    Summary:
+        Push the confidence threshold and the selected classes into the post-processing of an mmdet model,
+        so the detections that would be filtered out are dropped before their masks are pasted.
+        The score threshold of the model config is kept as a floor, and restored when score_thr is None.
+        The classes are only masked in the roi bbox heads (two stage and cascade models), the other models filter them afterwards.
+
+    Args:
+        model: the mmdet model
+        score_thr: the confidence threshold (default: None -> the threshold of the model config)
+        class_ids: the selected class ids (default: None -> all the classes)
+        max_per_img: the maximum number of detections per image (default: None -> the value of the model config)
+
+    Returns:
+        None
+    """
+
+    state = (score_thr, None if class_ids is None else tuple(sorted(class_ids)), max_per_img)
+    if getattr(model, "injected_test_cfg", None) == state:
+        return
+    test_cfgs = model_test_cfgs(model)
+    if not hasattr(model, "default_test_cfgs"):
+        model.default_test_cfgs = [(test_cfg.score_thr, test_cfg.get("max_per_img")) for test_cfg in test_cfgs]
+    for test_cfg, (default_score_thr, default_max_per_img) in zip(test_cfgs, model.default_test_cfgs):
+        test_cfg.score_thr = default_score_thr if score_thr is None else max(float(score_thr), default_score_thr)
+        if default_max_per_img is not None:
+            test_cfg.max_per_img = default_max_per_img if max_per_img is None else max_per_img
+
+    bbox_heads = getattr(getattr(model, "roi_head", None), "bbox_head", None)
+    if bbox_heads is not None:
+        for bbox_head in (bbox_heads if isinstance(bbox_heads, torch.nn.ModuleList) else [bbox_heads]):
+            mask_class_scores(bbox_head)
+            bbox_head.selected_classes = None if class_ids is None else list(class_ids)
+    model.injected_test_cfg = state
+
+
+def yolo_args(classdict=None):
+    # the arguments of a YOLO model call (classdict None -> all the classes)
+    return dict(imgsz=640, conf=0.25, iou=0.45, classes=None if classdict is None else list(classdict.keys()), verbose=False)
+
+
+def letterbox_transform(input_shape, image_shape):
+
+    """
+    Summary:
+        Get the transform of the letterbox of a YOLO model (the image is scaled with its aspect ratio kept, then padded),
+        the same as ultralytics scale_boxes.
+
+    Args:
+        input_shape: the (height, width) of the letterboxed input of the model
+        image_shape: the (height, width) of the image
+
+    Returns:
+        gain, (pad_x, pad_y): input = image * gain + pad
+    """
+
+    gain = min(input_shape[0] / image_shape[0], input_shape[1] / image_shape[1])
+    pad_x = round((input_shape[1] - image_shape[1] * gain) / 2 - 0.1)
+    pad_y = round((input_shape[0] - image_shape[0] * gain) / 2 - 0.1)
+    return gain, (pad_x, pad_y)
+
+
 class models_inference():
-    def __init__(self):
+    def __init__(self, fusion_strategy="union", fusion_iou_threshold=0.5):
         self.annotating_models = {}
+        # how the detections of the merged models are fused (see utils.mask_fusion)
+        self.fusion_strategy = fusion_strategy
+        self.fusion_iou_threshold = fusion_iou_threshold
 
     def get_bbox(self, segmentation):
         x = []
@@ -146,24 +367,8 @@ class models_inference():
         return np.linalg.norm(contour_end - contour_start, axis=1).sum()
 
     def mask_to_polygons(self, mask, n_points=25, resize_factors=[1.0, 1.0]):
-        mask = mask > 0.0
-        contours = skimage.measure.find_contours(mask)
-        if len(contours) == 0:
-            return []
-        contour = max(contours, key=self.get_contour_length)
-        coords = skimage.measure.approximate_polygon(
-            coords=contour,
-            tolerance=np.ptp(contour, axis=0).max() / 100,
-        )
-
-        coords = coords * resize_factors
-        # convert coords from x y to y x
-        coords = np.fliplr(coords)
-
-        # segment_points are a list of coords
-        segment_points = coords.astype(int)
-        polygon = segment_points
-        return polygon
+        # only the crop of the mask is traced (see polygonize)
+        return mask_to_polygon(mask, resize_factors=resize_factors)
 
     def full_points(bbox):
         return np.array([[bbox[0], bbox[1]], [bbox[0], bbox[3]], [bbox[2], bbox[3]], [bbox[2], bbox[1]]])
@@ -172,103 +377,185 @@ class models_inference():
     def decode_file(self, img, model, classdict, threshold=0.3, img_array_flag=False):
 
         #print(f"from inside inference: with threshold : {threshold}")
-        if model.__class__.__name__ == "YOLO":  
+        return self.filter_raw(self.decode_file_raw(img, model, classdict, threshold), model, classdict, threshold)
+
+    @torch.no_grad()
+    def decode_batch(self, imgs, model, classdict, threshold=0.3):
+
+        """
+        Summary:
+            Run a model on a batch of images with one forward pass (same outputs as decode_file for each image).
+
+        Args:
+            imgs: a list of images (paths or numpy arrays)
+            model: a YOLO or mmdet model
+            classdict: a dictionary of the selected classes (class id -> class name)
+            threshold: the confidence threshold
+
+        Returns:
+            results: a list with the output of decode_file for each image
+        """
+
+        return [self.filter_raw(raw, model, classdict, threshold)
+                for raw in self.decode_batch_raw(imgs, model, classdict, threshold)]
+
+    def filter_raw(self, raw, model, classdict, threshold):
+        # YOLO results are polygons, mmdet results are the masks of each class
+        if model.__class__.__name__ == "YOLO":
+            return {"results": raw.results(classdict, threshold)}
+        return raw.class_masks(classdict, threshold)
+
+    @torch.no_grad()
+    def decode_file_raw(self, img, model, classdict=None, threshold=None):
+
+        """
+        Summary:
+            Run a model on an image and keep its detections before the class and confidence filters.
+            The selected classes (and the confidence threshold for mmdet models) are pushed into the post-processing of the model
+            if they are given, so the raw detections only cover them (see RawDetections.covers).
+
+        Args:
+            img: a path or a numpy array
+            model: a YOLO or mmdet model
+            classdict: a dictionary of the selected classes (class id -> class name) (default: None -> all the classes)
+            threshold: the confidence threshold (default: None -> the threshold of the model)
+
+        Returns:
+            raw: the RawDetections of the image
+        """
+
+        if model.__class__.__name__ == "YOLO":
             if isinstance(img, str):
                 img = cv2.imread(img)
 
-            # get image size
-            img_resized = cv2.resize (img , (640, 640))
+            # the image is letterboxed by the model (aspect ratio kept, no resize here)
             # default yolo arguments from yolov8 tracking repo
                 # imgsz=(640, 640),  # inference size (height, width)
                 # conf_thres=0.25,  # confidence threshold
                 # iou_thres=0.45,  # NMS IOU threshold
                 # max_det=1000,  # maximum detections per image
-            results = model(img_resized , conf = 0.25 , iou=  0.45 , verbose = False)
-            results = results[0]
-            # if len results is 0 then return empty dict
-            if results.masks is None:
-                return {"results": {}}
-
-            masks = results.masks.cpu().numpy().masks
-            masks = masks > 0.0
-            org_size = img.shape[:2]
-            out_size = masks.shape[1:]
-
-            # print(f'org_size : {org_size} , out_size : {out_size}')
-
-            # convert boxes to original image size same as the masks (coords = coords * org_size / out_size)
-            boxes = results.boxes.xyxy.cpu().numpy()
-            boxes = boxes * np.array([org_size[1] / out_size[1], org_size[0] /
-                                     out_size[0], org_size[1] / out_size[1], org_size[0] / out_size[0]])
-
-            detections = Detections(
-                xyxy=boxes,
-                confidence=results.boxes.conf.cpu().numpy(),
-                class_id=results.boxes.cls.cpu().numpy().astype(int)
-            )
-
-            polygons = []
-            result_dict = {}
-
-            resize_factors = [org_size[0] / out_size[0] , org_size[1] / out_size[1]]
-            if len(masks) == 0:
-                return {"results":{}}
-            for mask in masks:
-                polygon = self.mask_to_polygons(
-                    mask, resize_factors=resize_factors)
-                polygons.append(polygon)
-
-            # detection is a tuple of  (box, confidence, class_id, tracker_id)
-            ind = 0
-            res_list = []
-            for detection in detections:
-                if round(detection[1], 2) < float(threshold):
-                    continue
-                result = {}
-                result["class"] = classdict.get(int(detection[2]))
-                result["confidence"] = str(round(detection[1], 2))
-                result["bbox"] = detection[0].astype(int)
-                result["seg"] = polygons[ind]
-                ind += 1
-                if result["class"] == None:
-                    continue
-                if len(result["seg"]) < 3:
-                    continue
+            results = model(img, **yolo_args(classdict))
+            return self.yolo_raw(results[0], img).restricted_to(classdict, None)
 
-                res_list.append(result)
-            result_dict["results"] = res_list
-            return result_dict
-
-        if img_array_flag:
-            results = inference_detector(model, img)
-        else:
-            results = inference_detector(model, plt.imread(img))
+        set_test_cfg(model, threshold, None if classdict is None else list(classdict.keys()))
+        # the images are fed as they are: numpy frames without a copy, paths loaded by the test pipeline
+        results = inference_detector_cached(model, img)
         # results = async_inference_detector(model, plt.imread(img_path))
-        torch.cuda.empty_cache()
-
-        results0 = []
-        results1 = []
-        for i in classdict.keys():
-            mask = results[0][i][:, 4] >= float(threshold)
-            results0.append(results[0][i][mask])
-            results1.append(list(np.array(results[1][i])[mask]))
-
-        # for i in classdict.keys():
-        #     results0.append(results[0][i])
-        #     results1.append(results[1][i])
 
-        # self.annotating_models[model.__class__.__name__] = [results0 , results1]
-        # print(self.annotating_models.keys())
+        return self.mm_raw(results).restricted_to(classdict, threshold)
 
-        # # if the length of the annotating_models is greater than 1 we need to merge the masks
-        # if len(self.annotating_models.keys()) > 1:
-        #     print("merging masks")
-        #     results0,results1 =  self.merge_masks()
-
-        #     assert len(results0) == len(results1)
-        #     for i in range(len(results0)):
-        #         assert len(results0[i]) == len(results1[i])
-        return results0, results1
+    @torch.no_grad()
+    def decode_batch_raw(self, imgs, model, classdict=None, threshold=None):
+
+        """
+        Summary:
+            Run a model on a batch of images with one forward pass (same outputs as decode_file_raw for each image).
+
+        Args:
+            imgs: a list of images (paths or numpy arrays)
+            model: a YOLO or mmdet model
+            classdict: a dictionary of the selected classes (class id -> class name) (default: None -> all the classes)
+            threshold: the confidence threshold (default: None -> the threshold of the model)
+
+        Returns:
+            raws: a list with the RawDetections of each image
+        """
+
+        if model.__class__.__name__ == "YOLO":
+            imgs = [cv2.imread(img) if isinstance(img, str) else img for img in imgs]
+            results = model(imgs, **yolo_args(classdict))
+            return [self.yolo_raw(result, img).restricted_to(classdict, None) for result, img in zip(results, imgs)]
+
+        # a batch is either all paths or all numpy arrays (the test pipeline depends on the input type)
+        if any(isinstance(img, np.ndarray) for img in imgs):
+            imgs = [mmcv.imread(img) for img in imgs]
+        set_test_cfg(model, threshold, None if classdict is None else list(classdict.keys()))
+        results = inference_detector_cached(model, imgs)
+        return [self.mm_raw(result).restricted_to(classdict, threshold) for result in results]
+
+    def decode_tiled_raw(self, img, model, windows, classdict=None, threshold=None, batch_size=8, iou_threshold=0.5):
+
+        """
+        Summary:
+            Run a model on the tiles of a large image in batches and merge the detections of the tiles (see utils.tiling).
+
+        Args:
+            img: a path or a numpy array
+            model: a YOLO or mmdet model
+            windows: the windows of the tiles (see tile_windows)
+            classdict: a dictionary of the selected classes (class id -> class name) (default: None -> all the classes)
+            threshold: the confidence threshold (default: None -> the threshold of the model)
+            batch_size: the number of tiles per forward pass (default: 8)
+            iou_threshold: the IoU inside the overlap of two tiles above which their detections are merged (default: 0.5)
+
+        Returns:
+            raw: the RawDetections of the image
+        """
+
+        if isinstance(img, str):
+            img = cv2.imread(img)
+        tile_raws = []
+        for start in range(0, len(windows), batch_size):
+            tiles = [np.ascontiguousarray(img[y0:y1, x0:x1]) for x0, y0, x1, y1 in windows[start:start + batch_size]]
+            tile_raws += self.decode_batch_raw(tiles, model, classdict, threshold)
+        raw = merge_tiles(tile_raws, windows, img.shape[:2], iou_threshold)
+        return raw.restricted_to(classdict, None if model.__class__.__name__ == "YOLO" else threshold)
+
+    def yolo_raw(self, results, img):
+
+        """
+        Summary:
+            Convert the output of a YOLO model on an image to raw detections with polygons.
+            The masks are at the resolution of the letterboxed input of the model, each mask is only traced inside its box
+            and the polygons are mapped back to the image, so the work and the memory depend on the detections, not the frame size.
+
+        Args:
+            results: the YOLO results of the image
+            img: the original image (the model ran on a letterboxed copy)
+
+        Returns:
+            raw: the RawDetections of the image
+        """
+
+        org_size = img.shape[:2]
+        # if len results is 0 then return empty detections
+        if results.masks is None or len(results.masks) == 0:
+            return RawDetections(np.zeros((0, 4)), [], [], org_size, polygons=[], round_scores=True)
+
+        masks = results.masks.cpu().numpy().masks
+        masks = masks > 0.0
+        input_size = masks.shape[1:]
+
+        # the boxes are in the image, the masks in the letterboxed input
+        boxes = results.boxes.xyxy.cpu().numpy()
+        gain, (pad_x, pad_y) = letterbox_transform(input_size, org_size)
+        input_boxes = boxes * gain + np.array([pad_x, pad_y, pad_x, pad_y])
+
+        # (row, col) in the input -> ((row - pad_y) / gain, (col - pad_x) / gain) in the image
+        polygons = masks_to_polygons(masks, input_boxes, resize_factors=[1 / gain, 1 / gain], offset=(-pad_y, -pad_x))
+
+        return RawDetections(boxes, results.boxes.conf.cpu().numpy(), results.boxes.cls.cpu().numpy().astype(int),
+                             org_size, polygons=polygons, round_scores=True)
+
+    def mm_raw(self, results):
+
+        """
+        Summary:
+            Convert the output of an mmdet model on an image to raw detections with compact masks.
+
+        Args:
+            results: the mmdet result of an image (bbox_results, segm_results)
+
+        Returns:
+            raw: the RawDetections of the image
+        """
+
+        bbox_results, segm_results = results[0], results[1]
+        boxes = np.concatenate([np.asarray(b).reshape(-1, 5) for b in bbox_results], axis=0)
+        class_ids = np.concatenate([np.full(len(b), i, dtype=int) for i, b in enumerate(bbox_results)])
+        masks = [mask for class_masks in segm_results for mask in class_masks]
+        image_shape = masks[0].shape if len(masks) > 0 else (0, 0)
+        return RawDetections(boxes[:, :4], boxes[:, 4], class_ids, image_shape, masks=masks)
 
     def polegonise(self, results0, results1, classdict, show_bbox_flag=False):
         result_dict = {}
@@ -277,6 +564,8 @@ class models_inference():
         self.classes_numbering = [keyno for keyno in classdict.keys()]
         # print(self.classes_numbering)
         for classno in range(len(results0)):
+            # the masks are cropped to their boxes before tracing their contours
+            polygons = masks_to_polygons(results1[classno], results0[classno])
             for instance in range(len(results0[classno])):
                 # if float(results0[classno][instance][-1]) < float(threshold):
                 #     continue
@@ -286,12 +575,7 @@ class models_inference():
                 # Confidence
                 result["confidence"] = str(
                     round(results0[classno][instance][-1], 2))
-                if classno == 0:
-                    result["seg"] = self.mask_to_polygons(
-                        results1[classno][instance].astype(np.uint8), 10)
-                else:
-                    result["seg"] = self.mask_to_polygons(
-                        results1[classno][instance].astype(np.uint8), 25)
+                result["seg"] = polygons[instance]
 
                 # result["bbox"] = self.get_bbox(result["seg"])
                 if show_bbox_flag:
@@ -316,105 +600,36 @@ class models_inference():
         result_dict["results"] = res_list
         return result_dict
 
-    def merge_masks(self):
-        tic = time()
-        result0 = []
-        result1 = []
+    def merge_masks(self, annotating_models=None):
+
+        """
+        Summary:
+            Fuse the detections of the annotating models (see utils.mask_fusion).
+
+        Args:
+            annotating_models: a dictionary of model name -> (results0, results1)
+                (default: None -> self.annotating_models, cleared after the fusion)
 
-        # Counting for debugging purposes
+        Returns:
+            results0, results1: the fused boxes and masks of each class
+        """
+
+        tic = time()
+        if annotating_models is None:
+            annotating_models = self.annotating_models
+            self.annotating_models = {}
         # count the number of instances in each model
-        counts = count_instances(self.annotating_models)
-        # print the counts of each model
+        counts = count_instances(annotating_models)
         for model in counts.keys():
             print("model {} has {} instances".format(model, counts[model]))
 
-        # the following lines can be used if we use models with different number of classes
-        # classnos = []
-        # for model in self.annotating_models.keys():
-        #     classnos.append(len(self.annotating_models[model][1]))
-        # print(classnos)
-
-        # instead the following line of code will be used if we use models with the same number of classes
-        classnos = len(self.annotating_models[list(
-            self.annotating_models.keys())[0]][1])
-
-        merged_counts = 0
-        # initialize the result list with the same number of classes as the model with the most classes
-        for i in range(classnos):
-            result1.append([])
-            result0.append([])
-
-        # deep copy the annotating_models dict to pop all the masks we have merged (try delete it for future optimisation)
-        annotating_models_copy = copy.deepcopy(self.annotating_models)
-        # merge masks of the same class
-        for idx1, model in enumerate(self.annotating_models.keys()):
-            for classno in range(len(self.annotating_models[model][1])):
-                # check if an instance exists in the model in this class
-                if len(self.annotating_models[model][1][classno]) > 0:
-                    for instance in range(len(self.annotating_models[model][1][classno])):
-                        for idx2, model2 in enumerate(self.annotating_models.keys()):
-                            if model != model2 and idx2 > idx1:
-                                # print(type(annotating_models_copy[model][0][classno]),type(annotating_models_copy[model2][0][classno]))
-                                # check if the class exists in the other model
-                                if classno in range(len(self.annotating_models[model2][1])):
-                                    # check if an instance exists in the other model
-                                    if len(self.annotating_models[model2][1][classno]) > 0:
-                                        for instance2 in range(len(self.annotating_models[model2][1][classno])):
-                                            dirty = False
-                                            # print('checking class ' + str(classno)  ' of models ' + model + str(idx1) +  ' and ' + model2 + str(idx2))
-                                            # get the intersection percentage of the two masks
-                                            intersection = np.logical_and(
-                                                self.annotating_models[model][1][classno][instance], self.annotating_models[model2][1][classno][instance2])
-                                            intersection = np.sum(intersection)
-                                            union = np.logical_or(
-                                                self.annotating_models[model][1][classno][instance], self.annotating_models[model2][1][classno][instance2])
-                                            union = np.sum(union)
-                                            iou = intersection / union
-                                            # print('iou of class ' + str(classno) + ' instance ' + str(instance) + ' and instance ' + str(instance2) + ' is ' + str(iou))
-                                            if iou > 0.5:
-                                                if (annotating_models_copy[model][1][classno][instance] is None) or (annotating_models_copy[model2][1][classno][instance2] is None):
-                                                    dirty = True
-                                                if dirty == False:
-                                                    # merge their bboxes and store the result in result0
-                                                    bbox1 = self.annotating_models[model][0][classno][instance]
-                                                    bbox2 = self.annotating_models[model2][0][classno][instance2]
-                                                    bbox = [min(bbox1[0], bbox2[0]), min(bbox1[1], bbox2[1]), max(
-                                                        bbox1[2], bbox2[2]), max(bbox1[3], bbox2[3]), max(bbox1[4], bbox2[4])]
-                                                    result0[classno].append(
-                                                        bbox)
-                                                    # store the merged mask in result1
-                                                    result1[classno].append(np.logical_or(
-                                                        self.annotating_models[model][1][classno][instance], self.annotating_models[model2][1][classno][instance2]))
-                                                    # print('merging masks of class ' + str(classno) + ' instance ' + str(instance) + ' and instance ' + str(instance2) + ' of models ' + model + ' and ' + model2)
-                                                    merged_counts += 1
-                                                # remove the mask from both models
-                                                annotating_models_copy[model][1][classno][instance] = None
-                                                annotating_models_copy[model2][1][classno][instance2] = None
-                                                annotating_models_copy[model][0][classno][instance] = None
-                                                annotating_models_copy[model2][0][classno][instance2] = None
-                                                # continue to the next instance of the first model
-                                                break
-
-        counts_here = {}
-        # add the remaining masks to the result
-        for model in annotating_models_copy.keys():
-            counts_here[model] = 0
-            for classno in range(len(annotating_models_copy[model][1])):
-                for instance in range(len(annotating_models_copy[model][1][classno])):
-                    if annotating_models_copy[model][1][classno][instance] is not None:
-                        counts_here[model] += 1
-                        # print('adding mask of class ' + str(classno) + ' instance ' + str(instance) + ' of model ' + model)
-                        result1[classno].append(
-                            annotating_models_copy[model][1][classno][instance])
-                        result0[classno].append(
-                            annotating_models_copy[model][0][classno][instance])
-        # clear the annotating_models and add the result to it
-        self.annotating_models = {}
-        # self.annotating_models["merged"] = [result0 , result1]
-        for model in counts_here.keys():
-            print("model {} has {} instances".format(
-                model, counts_here[model]))
-        print("merged {} instances".format(merged_counts))
+        fusion = MaskFusion(self.fusion_iou_threshold, self.fusion_strategy)
+        result0, result1 = fusion.fuse(annotating_models)
+
+        print("merged {} instances ({} of {} pairs compared)".format(
+            fusion.counts["merged"], fusion.counts["candidates"], fusion.counts["pairs"]))
+        print("merging stages: " + ", ".join(
+            "{} {:.1f} ms".format(stage, ms) for stage, ms in fusion.timings.items()))
         tac = time()
         print("merging took {} ms".format((tac - tic) * 1000))
         return result0, result1
@@ -10,12 +10,13 @@ import re
 import traceback
 import webbrowser
 import copy
-from shapely.geometry import Polygon
+import threading
 
 # import asyncio
 # import PyQt5
 # from qtpy.QtCore import Signal, Slot
 import imgviz
+import PIL.Image
 from matplotlib import pyplot as plt
 from qtpy import QtCore
 from qtpy.QtCore import Qt, QThread
@@ -39,16 +40,19 @@ from .label_file import LabelFile
 from .label_file import LabelFileError
 from .logger import logger
 from .shape import Shape
-from .widgets import BrightnessContrastDialog, Canvas, LabelDialog, LabelListWidget, LabelListWidgetItem, ToolBar, UniqueLabelQListWidget, ZoomWidget
+from .widgets import BrightnessContrastDialog, Canvas, FileListModel, LabelDialog, LabelListWidget, LabelListWidgetItem, ToolBar, UniqueLabelQListWidget, ZoomWidget
 from .intelligence import Intelligence
 from .intelligence import convert_shapes_to_qt_shapes
 from .intelligence import coco_classes, color_palette
+from .tracking import TrackingWorker
 from .utils.sam import Sam_Predictor
 from .utils import helpers
+from .utils.frame_buffer import FrameBuffer
+from .utils.image_prefetch import ImagePrefetcher, load_frame
+from .utils.dir_index import DirectoryIndex, count_shapes
 
 from onemetric.cv.utils.iou import box_iou_batch
 from dataclasses import dataclass
-from supervision.detection.core import Detections
 from trackers.multi_tracker_zoo import create_tracker
 # from ultralytics.yolo.utils.torch_utils import select_device
 # non_max_suppression, scale_boxes, process_mask, process_mask_native
@@ -71,13 +75,6 @@ from .utils.custom_exports import custom_exports_list
 warnings.filterwarnings("ignore")
 
 
-class TrackingThread(QThread):
-    def __init__(self, parent=None):
-        super(TrackingThread, self).__init__(parent)
-        self.parent = parent
-
-    def run(self):
-        self.parent.track_buttonClicked()
 # os.environ["OMP_NUM_THREADS"] = "1"
 # os.environ["OPENBLAS_NUM_THREADS"] = "1"
 # os.environ["MKL_NUM_THREADS"] = "1"
@@ -203,6 +200,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.flag_widget.itemChanged.connect(self.setDirty)
 
         self.labelList.itemSelectionChanged.connect(self.labelSelectionChanged)
+        self.labelList.itemSelectionChanged.connect(self.follow_selected_tracks)
         self.labelList.itemDoubleClicked.connect(self.editLabel)
         self.labelList.itemChanged.connect(self.labelItemChanged)
         self.labelList.itemDropped.connect(self.labelOrderChanged)
@@ -232,10 +230,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.fileSearch = QtWidgets.QLineEdit()
         self.fileSearch.setPlaceholderText(self.tr("Search Filename"))
         self.fileSearch.textChanged.connect(self.fileSearchChanged)
-        self.fileListWidget = QtWidgets.QListWidget()
-        self.fileListWidget.itemSelectionChanged.connect(
+        # a virtual list: only the shown rows are asked to the model
+        self.fileListModel = FileListModel(self)
+        self.fileListWidget = QtWidgets.QListView()
+        self.fileListWidget.setUniformItemSizes(True)
+        self.fileListWidget.setModel(self.fileListModel)
+        self.fileListWidget.selectionModel().selectionChanged.connect(
             self.fileSelectionChanged
         )
+        self.directoryIndex = None
         fileListLayout = QtWidgets.QVBoxLayout()
         fileListLayout.setContentsMargins(0, 0, 0, 0)
         fileListLayout.setSpacing(0)
@@ -294,7 +297,19 @@ class MainWindow(QtWidgets.QMainWindow):
         # for Export
         self.target_directory = ""
         self.save_path = ""
-        self.global_listObj = []
+
+        # compact the video annotations journal into the frame store when the user is idle
+        self.journal_compaction_timer = QtCore.QTimer(self)
+        self.journal_compaction_timer.setSingleShot(True)
+        self.journal_compaction_timer.setInterval(5000)
+        self.journal_compaction_timer.timeout.connect(self.compact_frame_journal)
+        # the id index sidecar is saved when the journal is compacted and the index changed
+        self.id_index_dirty = False
+        # decoded frames cache of the current video
+        self.frame_provider = None
+        self.tracking_worker = None
+        # the image whose shapes are the untouched output of the model (re-derived when the thresholds or classes change)
+        self.model_annotated_image = None
 
         # for merge 
         self.multi_model_flag = False
@@ -823,6 +838,15 @@ class MainWindow(QtWidgets.QMainWindow):
             "iou",
             self.tr("IOU Threshold (Non Maximum Suppression)")
         )
+        tiled_inference = action(
+            self.tr("Tiled Inference (Large Images)"),
+            self.setTiledInference,
+            None,
+            "fit-window",
+            self.tr("Run the model on overlapping tiles of the images larger than the tile size"),
+            checkable=True,
+            checked=self._config["tiled_inference"],
+        )
         select_classes = action(
             self.tr("Select Classes"),
             self.selectClasses,
@@ -1119,6 +1143,7 @@ class MainWindow(QtWidgets.QMainWindow):
             (
                 set_conf_threshold,
                 set_iou_threshold,
+                tiled_inference,
                 None,
                 select_classes,
 
@@ -1189,6 +1214,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # Application state.
         self.image = QtGui.QImage()
+        self.frameBuffer = None
+        # the neighbours of the current image are loaded in the background (image directory mode)
+        self.imagePrefetcher = ImagePrefetcher(max_entries=2 * self._config["prefetch_images"] + 2)
 
         self.imagePath = None
         self.recentFiles = []
@@ -1285,6 +1313,7 @@ class MainWindow(QtWidgets.QMainWindow):
         utils.addActions(self.menus.edit, actions + self.actions.editMenu)
 
     def setDirty(self):
+        self.model_annotated_image = None
         # Even if we autosave the file, we keep the ability to undo
         self.actions.undo.setEnabled(self.canvas.isShapeRestorable)
 
@@ -1306,6 +1335,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setWindowTitle(title)
 
     def setClean(self):
+        self.model_annotated_image = None
         self.dirty = False
         self.actions.save.setEnabled(False)
         self.actions.createMode.setEnabled(True)
@@ -1347,6 +1377,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.filename = None
         self.imagePath = None
         self.imageData = None
+        self.frameBuffer = None
         self.CURRENT_FRAME_IMAGE = None
         # self.CURRENT_SHAPES_IN_IMG = []
         # self.SAM_SHAPES_IN_IMAGE = []
@@ -1379,6 +1410,8 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         
         self.interrupted = True
+        if self.tracking_worker is not None:
+            self.tracking_worker.cancel()
         self.sam_reset_button_clicked()
         if self.canvas.tracking_area == "drawing":
             self.area_dropdown_activated(1)
@@ -1686,6 +1719,10 @@ class MainWindow(QtWidgets.QMainWindow):
             
             self.minID = min(self.minID, new_group_id - 1)
 
+            # the frames that may change are the frames of the old id (they become frames of the new id)
+            changed_frames = set(self.id_frames_rec.get('id_' + str(old_group_id), set()))
+            changed_frames.add(self.INDEX_OF_CURRENT_FRAME)
+
             self.id_frames_rec, self.CURRENT_ANNOATAION_TRAJECTORIES, listObj = helpers.handle_id_editLabel(
                                         currFrame = self.INDEX_OF_CURRENT_FRAME,
                                         listObj = listObj,
@@ -1697,7 +1734,7 @@ class MainWindow(QtWidgets.QMainWindow):
                                         old_group_id = old_group_id,
                                         new_group_id = new_group_id,)
             
-            self.load_objects_to_json__orjson(listObj)
+            self.load_objects_to_json__orjson(listObj, changed_frames)
             self.main_video_frames_slider_changed()
 
     def interpolateMENU(self, item=None):
@@ -1839,8 +1876,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.waitWindow(
             visible=True, text=f'Please Wait.\nID {id} is being interpolated...')
 
-        listObj = self.load_objects_from_json__orjson()
-
         if only_edited:
             try:
                 FRAMES = list(self.key_frames['id_' + str(id)])
@@ -1855,10 +1890,13 @@ class MainWindow(QtWidgets.QMainWindow):
         if (first_frame_idx >= last_frame_idx):
             return
 
+        # only the frames of the interpolated range are decoded (frame index -> frame_data)
+        listObj = dict(self.iter_frames(range(first_frame_idx, last_frame_idx + 1)))
+
         records = [None for i in range(first_frame_idx - 1, last_frame_idx, 1)]
         for frame in range(first_frame_idx, last_frame_idx + 1, 1):
-            listobjframe = listObj[frame - 1]['frame_idx']
-            frameobjects = listObj[frame - 1]['frame_data']
+            listobjframe = frame
+            frameobjects = listObj[frame]
             for object_ in frameobjects:
                 if (object_['tracker_id'] == id):
                     if ((not only_edited) or (listobjframe in FRAMES)):
@@ -1876,8 +1914,8 @@ class MainWindow(QtWidgets.QMainWindow):
             if self.interrupted:
                 break
             
-            listobjframe = listObj[frame - 1]['frame_idx']
-            frameobjects = listObj[frame - 1]['frame_data']
+            listobjframe = frame
+            frameobjects = listObj[frame]
             
             # if object is present in this frame, then it is base object and we calculate next object
             if(records[frame -first_frame_idx] is not None):
@@ -1900,7 +1938,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if (only_edited and (frame not in FRAMES)):
                 for object_ in frameobjects:
                     if (object_['tracker_id'] == id):
-                        listObj[frame - 1]['frame_data'].remove(object_)
+                        listObj[frame].remove(object_)
                         break
             
             # if object is not present in this frame, then we calculate the object for this frame
@@ -1909,11 +1947,11 @@ class MainWindow(QtWidgets.QMainWindow):
                                           nextObject=nextObject,
                                           nextObjectFrame=nextObjectFrame,
                                           curFrame=frame,)
-            listObj[frame - 1]['frame_data'].append(cur)
+            listObj[frame].append(cur)
             self.rec_frame_for_id(id, frame)
             
         
-        self.load_objects_to_json__orjson(listObj)
+        self.set_frame_objects(listObj)
         frames = range(first_frame_idx - 1, last_frame_idx, 1)
         self.calculate_trajectories(frames)
         self.main_video_frames_slider_changed()
@@ -1962,22 +2000,23 @@ class MainWindow(QtWidgets.QMainWindow):
         
         overwrite = self.config['interpolationOverwrite']
 
-        listObj = self.load_objects_from_json__orjson()
-        listObjNEW = copy.deepcopy(listObj)
+        # only the frames of the interpolated range are decoded (frame index -> frame_data)
+        listObj = dict(self.iter_frames(range(min(first_frame_idxLIST), max(last_frame_idxLIST) + 1)))
+        listObjNEW = {}
 
         recordsLIST = [[None for ii in range(
             first_frame_idxLIST[i], last_frame_idxLIST[i] + 1)] for i in range(len(idsLIST))]
         
         for i in range(min(first_frame_idxLIST) - 1, max(last_frame_idxLIST), 1):
             self.waitWindow(visible=True)
-            listobjframe = listObj[i]['frame_idx']
-            frameobjects = listObj[i]['frame_data'].copy()
+            listobjframe = i + 1
+            frameobjects = listObj[i + 1].copy()
             for object_ in frameobjects:
                 if (object_['tracker_id'] in idsLIST):
                     index = idsLIST.index(object_['tracker_id'])
                     recordsLIST[index][listobjframe -
                                        first_frame_idxLIST[index]] = copy.deepcopy(object_)
-                    listObj[i]['frame_data'].remove(object_)
+                    listObj[i + 1].remove(object_)
 
         for frameIDX in range(min(first_frame_idxLIST), max(last_frame_idxLIST) + 1):
             QtWidgets.QApplication.processEvents()
@@ -2000,7 +2039,7 @@ class MainWindow(QtWidgets.QMainWindow):
                     current = copy.deepcopy(records[i])
                     cur_bbox = current['bbox']
                     if not overwrite:
-                        listObj[frameIDX - 1]['frame_data'].append(current)
+                        listObj[frameIDX].append(current)
                         continue
                 else:
                     prev_idx = i - 1
@@ -2032,13 +2071,13 @@ class MainWindow(QtWidgets.QMainWindow):
                 current['segment'] = copy.deepcopy(cur_segment)
                 
                 # append the shape frame by frame (cause we already removed it in the prev. for loop)
-                listObj[frameIDX - 1]['frame_data'].append(current)
+                listObj[frameIDX].append(current)
                 self.rec_frame_for_id(idsLIST[ididx], frameIDX)
                 
             # update frame by frame to the to-be-uploaded listObj
-            listObjNEW[frameIDX - 1] = copy.deepcopy(listObj[frameIDX - 1])
+            listObjNEW[frameIDX] = copy.deepcopy(listObj[frameIDX])
         
-        self.load_objects_to_json__orjson(listObjNEW)
+        self.set_frame_objects(listObjNEW)
         self.calculate_trajectories(range(min(first_frame_idxLIST) - 1, max(last_frame_idxLIST), 1))
         self.main_video_frames_slider_changed()
 
@@ -2049,9 +2088,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 helpers.notification("SAM Interpolation Completed")
 
     def get_frame_by_idx(self, frameIDX):
-        self.CAP.set(cv2.CAP_PROP_POS_FRAMES, frameIDX - 1)
-        success, img = self.CAP.read()
-        return img
+        return self.frame_provider.get_frame(frameIDX)
 
     def sam_enhanced_bbox_segment(self, frameIMAGE, cur_bbox, thresh, max_itr=5, forSHAPE=False):
         oldAREA = abs(cur_bbox[2] - cur_bbox[0]) * \
@@ -2173,27 +2210,36 @@ class MainWindow(QtWidgets.QMainWindow):
         return helpers.getIDfromUser_GUI(self, group_id, text)
 
     def fileSearchChanged(self):
-        self.importDirImages(
-            self.lastOpenDir,
-            pattern=self.fileSearch.text(),
-            load=False,
-        )
+        # the files are filtered in memory, the directory is not read again
+        self.fileListModel.set_filter(self.fileSearch.text())
+        self.selectFileRow(self.fileListModel.row_of(self.filename))
 
-    def fileSelectionChanged(self):
-        items = self.fileListWidget.selectedItems()
-        if not items:
+    def selectFileRow(self, row):
+        # select a row of the file list without loading its file
+        if row is None:
+            return
+        selectionModel = self.fileListWidget.selectionModel()
+        selectionModel.blockSignals(True)
+        self.fileListWidget.setCurrentIndex(self.fileListModel.index(row))
+        selectionModel.blockSignals(False)
+        self.fileListWidget.scrollTo(self.fileListModel.index(row))
+
+    def currentFileRow(self):
+        index = self.fileListWidget.currentIndex()
+        return index.row() if index.isValid() else -1
+
+    def fileSelectionChanged(self, *args):
+        rows = self.fileListWidget.selectionModel().selectedRows()
+        if not rows:
             return
-        item = items[0]
 
         if not self.mayContinue():
             return
 
-        currIndex = self.imageList.index(str(item.text()))
-        if currIndex < len(self.imageList):
-            filename = self.imageList[currIndex]
-            if filename:
-                self.loadFile(filename)
-                self.refresh_image_MODE()
+        filename = self.fileListModel.filename(rows[0].row())
+        if filename:
+            self.loadFile(filename)
+            self.refresh_image_MODE()
 
     # React to canvas signals.
     def shapeSelectionChanged(self, selected_shapes):
@@ -2370,7 +2416,7 @@ class MainWindow(QtWidgets.QMainWindow):
             flags[key] = flag
         try:
             imagePath = osp.relpath(self.imagePath, osp.dirname(filename))
-            imageData = self.imageData if self._config["store_data"] else None
+            imageData = self.getImageData() if self._config["store_data"] else None
             if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
                 os.makedirs(osp.dirname(filename))
             lf.save(
@@ -2384,13 +2430,10 @@ class MainWindow(QtWidgets.QMainWindow):
                 flags=flags,
             )
             self.labelFile = lf
-            items = self.fileListWidget.findItems(
-                self.imagePath, Qt.MatchExactly
-            )
-            if len(items) > 0:
-                if len(items) != 1:
-                    raise RuntimeError("There are duplicate files.")
-                items[0].setCheckState(Qt.Checked)
+            self.imagePrefetcher.invalidate(self.filename)
+            self.fileListModel.set_checked(self.imagePath, True, len(shapes))
+            if self.directoryIndex is not None:
+                self.directoryIndex.update_label(filename, len(shapes))
             # disable allows next and previous image to proceed
             # self.filename = filename
             return True
@@ -2574,7 +2617,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def brightnessContrast(self, value):
         dialog = BrightnessContrastDialog(
-            utils.img_data_to_pil(self.imageData),
+            utils.img_data_to_pil(self.getImageData()),
             self.onNewBrightnessContrast,
             parent=self,
         )
@@ -2595,13 +2638,21 @@ class MainWindow(QtWidgets.QMainWindow):
         for item in self.labelList:
             item.setCheckState(Qt.Checked if value else Qt.Unchecked)
 
+    def getImageData(self, filename=None):
+        # the encoded image of the current file, read on first use
+        if self.imageData is None:
+            if self.labelFile is not None:
+                self.imageData = self.labelFile.imageData
+            else:
+                self.imageData = LabelFile.load_image_file(filename or self.filename)
+        return self.imageData
+
     def loadFile(self, filename=None):
         """Load the specified file, or the last opened file if None."""
         # changing fileListWidget loads file
-        if filename in self.imageList and (
-            self.fileListWidget.currentRow() != self.imageList.index(filename)
-        ):
-            self.fileListWidget.setCurrentRow(self.imageList.index(filename))
+        row = self.fileListModel.row_of(filename)
+        if row is not None and self.currentFileRow() != row:
+            self.fileListWidget.setCurrentIndex(self.fileListModel.index(row))
             self.fileListWidget.repaint()
             return
 
@@ -2618,15 +2669,17 @@ class MainWindow(QtWidgets.QMainWindow):
             return False
         # assumes same name, but json extension
         self.status(self.tr("Loading %s...") % osp.basename(str(filename)))
-        label_file = osp.splitext(filename)[0] + ".json"
-        if self.output_dir:
-            label_file_without_path = osp.basename(label_file)
-            label_file = osp.join(self.output_dir, label_file_without_path)
+        label_file = self.labelFileOf(filename)
+        # the image and its label file may have been loaded in the background already
+        prefetched = self.imagePrefetcher.get(filename, label_file)
         if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
             label_file
         ):
             try:
-                self.labelFile = LabelFile(label_file)
+                if prefetched is not None:
+                    self.labelFile = prefetched[0]
+                else:
+                    self.labelFile = LabelFile(label_file)
             except LabelFileError as e:
                 self.errorMessage(
                     self.tr("Error opening file"),
@@ -2638,18 +2691,22 @@ class MainWindow(QtWidgets.QMainWindow):
                 )
                 self.status(self.tr("Error reading %s") % label_file)
                 return False
-            self.imageData = self.labelFile.imageData
             self.imagePath = osp.join(
                 osp.dirname(label_file),
                 self.labelFile.imagePath,
             )
             self.otherData = self.labelFile.otherData
         else:
-            self.imageData = LabelFile.load_image_file(filename)
-            if self.imageData:
-                self.imagePath = filename
+            self.imagePath = filename
             self.labelFile = None
-        image = QtGui.QImage.fromData(self.imageData)
+        # the image is decoded once into the frame buffer, Qt and OpenCV share its memory
+        # (the encoded image is only read again when it is saved in the label file)
+        self.imageData = None
+        if prefetched is not None:
+            self.frameBuffer = prefetched[1]
+        else:
+            self.frameBuffer = load_frame(filename, self.labelFile)
+        image = self.frameBuffer.qimage() if self.frameBuffer is not None else QtGui.QImage()
 
         if image.isNull():
             formats = [
@@ -2666,7 +2723,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.status(self.tr("Error reading %s") % filename)
             return False
         self.image = image
-        self.CURRENT_FRAME_IMAGE = cv2.imread(filename)
+        self.CURRENT_FRAME_IMAGE = self.frameBuffer.array
         self.filename = filename
         if self._config["keep_prev"]:
             prev_shapes = self.canvas.shapes
@@ -2709,7 +2766,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.canvas.SAM_coordinates = []
         # set brightness constrast values
         dialog = BrightnessContrastDialog(
-            utils.img_data_to_pil(self.imageData),
+            PIL.Image.fromarray(self.frameBuffer.array[:, :, ::-1]),
             self.onNewBrightnessContrast,
             parent=self,
         )
@@ -2736,8 +2793,32 @@ class MainWindow(QtWidgets.QMainWindow):
         self.toggleActions(True)
         self.canvas.setFocus()
         self.status(self.tr("Loaded %s") % osp.basename(str(filename)))
+        self.prefetchNeighbours()
         return True
 
+    def labelFileOf(self, filename):
+        label_file = osp.splitext(filename)[0] + ".json"
+        if self.output_dir:
+            label_file_without_path = osp.basename(label_file)
+            label_file = osp.join(self.output_dir, label_file_without_path)
+        return label_file
+
+    def prefetchNeighbours(self):
+        # load the next and the previous images of the file list in the background (the next ones first)
+        nImages = self._config["prefetch_images"]
+        row = self.currentFileRow()
+        if nImages <= 0 or row < 0:
+            return
+        rows = []
+        for offset in range(1, nImages + 1):
+            rows += [row + offset, row - offset]
+        files = []
+        for i in rows:
+            if 0 <= i < self.fileListModel.rowCount():
+                filename = self.fileListModel.filename(i)
+                files.append((filename, self.labelFileOf(filename)))
+        self.imagePrefetcher.prefetch(files)
+
     def resizeEvent(self, event):
         if (
             self.canvas
@@ -2785,6 +2866,15 @@ class MainWindow(QtWidgets.QMainWindow):
             event.ignore()
         else:
             self.Escape_clicked()
+            self.journal_compaction_timer.stop()
+            self.stop_tracking()
+            self.flush_video_annotations()
+            helpers.close_all_frame_stores()
+            if self.frame_provider is not None:
+                self.frame_provider.release()
+            self.imagePrefetcher.shutdown()
+            if self.directoryIndex is not None:
+                self.directoryIndex.save()
         self.settings.setValue(
             "filename", self.filename if self.filename else ""
         )
@@ -2877,15 +2967,15 @@ class MainWindow(QtWidgets.QMainWindow):
         if not self.mayContinue():
             return
 
-        if len(self.imageList) <= 0:
+        if self.fileListModel.rowCount() <= 0:
             return
 
         if self.filename is None:
             return
 
-        currIndex = self.imageList.index(self.filename)
-        if currIndex - 1 >= 0:
-            filename = self.imageList[currIndex - 1]
+        currIndex = self.fileListModel.row_of(self.filename)
+        if currIndex is not None and currIndex - 1 >= 0:
+            filename = self.fileListModel.filename(currIndex - 1)
             if filename:
                 self.loadFile(filename)
 
@@ -2901,18 +2991,18 @@ class MainWindow(QtWidgets.QMainWindow):
         if not self.mayContinue():
             return
 
-        if len(self.imageList) <= 0:
+        nFiles = self.fileListModel.rowCount()
+        if nFiles <= 0:
             return
 
         filename = None
-        if self.filename is None:
-            filename = self.imageList[0]
+        currIndex = self.fileListModel.row_of(self.filename) if self.filename is not None else None
+        if currIndex is None:
+            filename = self.fileListModel.filename(0)
+        elif currIndex + 1 < nFiles:
+            filename = self.fileListModel.filename(currIndex + 1)
         else:
-            currIndex = self.imageList.index(self.filename)
-            if currIndex + 1 < len(self.imageList):
-                filename = self.imageList[currIndex + 1]
-            else:
-                filename = self.imageList[-1]
+            filename = self.fileListModel.filename(nFiles - 1)
         self.filename = filename
 
         if self.filename and load:
@@ -2958,7 +3048,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.filename = filename
         # clear the file list widget
-        self.fileListWidget.clear()
+        self.fileListModel.clear()
         self.uniqLabelList.clear()
         # enable Visualization Options
         for option in self.vis_options:
@@ -2997,10 +3087,10 @@ class MainWindow(QtWidgets.QMainWindow):
         current_filename = self.filename
         self.importDirImages(self.lastOpenDir, load=False)
 
-        if current_filename in self.imageList:
+        if self.fileListModel.row_of(current_filename) is not None:
             # retain currently selected file
-            self.fileListWidget.setCurrentRow(
-                self.imageList.index(current_filename)
+            self.fileListWidget.setCurrentIndex(
+                self.fileListModel.index(self.fileListModel.row_of(current_filename))
             )
             self.fileListWidget.repaint()
 
@@ -3041,6 +3131,8 @@ class MainWindow(QtWidgets.QMainWindow):
                     return
 
                 json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+                # the exporters read the json results file, so write it from the frame store first
+                helpers.export_frame_store_to_json(json_file_name, self.TOTAL_VIDEO_FRAMES)
 
                 pth = ""
                 # Check which radio button is checked and export accordingly
@@ -3198,7 +3290,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.actions.saveAs.setEnabled(False)
 
         # clear the file list widget
-        self.fileListWidget.clear()
+        self.fileListModel.clear()
         self.uniqLabelList.clear()
 
         self.current_annotation_mode = ""
@@ -3228,10 +3320,12 @@ class MainWindow(QtWidgets.QMainWindow):
         label_file = self.getLabelFile()
         if osp.exists(label_file):
             os.remove(label_file)
+            self.imagePrefetcher.invalidate(self.filename)
+            if self.directoryIndex is not None:
+                self.directoryIndex.update_label(label_file)
             logger.info("Label file is removed: {}".format(label_file))
 
-            item = self.fileListWidget.currentItem()
-            item.setCheckState(Qt.Unchecked)
+            self.fileListModel.set_checked(self.filename, False)
 
             self.resetState()
 
@@ -3347,19 +3441,20 @@ class MainWindow(QtWidgets.QMainWindow):
         
         from_frame, to_frame = np.min(
             [from_frame, to_frame]), np.max([from_frame, to_frame])
-        listObj = self.load_objects_from_json__orjson()
+        listObj = dict(self.iter_frames(range(from_frame, to_frame + 1)))
 
-        for i in range(from_frame - 1, to_frame, 1):
-            frame_idx = listObj[i]['frame_idx']
-            for object_ in listObj[i]['frame_data']:
+        for frame_idx in range(from_frame, to_frame + 1, 1):
+            for object_ in listObj[frame_idx]:
                 id = object_['tracker_id']
                 if id in deleted_ids:
-                    listObj[i]['frame_data'].remove(object_)
-                    self.CURRENT_ANNOATAION_TRAJECTORIES['id_' +
-                                                         str(id)][frame_idx - 1] = (-1, -1)
+                    listObj[frame_idx].remove(object_)
                     self.rec_frame_for_id(id, frame_idx, type_='remove')
 
-        self.load_objects_to_json__orjson(listObj)
+        for id in deleted_ids:
+            if 'id_' + str(id) in self.CURRENT_ANNOATAION_TRAJECTORIES:
+                self.CURRENT_ANNOATAION_TRAJECTORIES['id_' + str(id)].remove(range(from_frame, to_frame + 1))
+
+        self.set_frame_objects(listObj)
 
     def copyShape(self):
         
@@ -3462,11 +3557,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     @property
     def imageList(self):
-        lst = []
-        for i in range(self.fileListWidget.count()):
-            item = self.fileListWidget.item(i)
-            lst.append(item.text())
-        return lst
+        return self.fileListModel.filenames()
 
     def importDroppedImageFiles(self, imageFiles):
         extensions = [
@@ -3475,26 +3566,20 @@ class MainWindow(QtWidgets.QMainWindow):
         ]
 
         self.filename = None
+        entries = []
         for file in imageFiles:
-            if file in self.imageList or not file.lower().endswith(
-                tuple(extensions)
-            ):
+            if not file.lower().endswith(tuple(extensions)):
                 continue
-            label_file = osp.splitext(file)[0] + ".json"
-            if self.output_dir:
-                label_file_without_path = osp.basename(label_file)
-                label_file = osp.join(self.output_dir, label_file_without_path)
-            item = QtWidgets.QListWidgetItem(file)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+            label_file = self.labelFileOf(file)
             if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
                 label_file
             ):
-                item.setCheckState(Qt.Checked)
+                entries.append((file, True, count_shapes(label_file)))
             else:
-                item.setCheckState(Qt.Unchecked)
-            self.fileListWidget.addItem(item)
+                entries.append((file, False, 0))
+        self.fileListModel.add_files(entries)
 
-        if len(self.imageList) > 1:
+        if self.fileListModel.rowCount() > 1:
             self.actions.openNextImg.setEnabled(True)
             self.actions.openPrevImg.setEnabled(True)
 
@@ -3512,44 +3597,39 @@ class MainWindow(QtWidgets.QMainWindow):
         # self.right_click_menu()
         self.lastOpenDir = dirpath
         self.filename = None
-        self.fileListWidget.clear()
+        self.imagePrefetcher.clear()
         self.uniqLabelList.clear()
-        for filename in self.scanAllImages(dirpath):
-            if pattern and pattern not in filename:
-                continue
-            label_file = osp.splitext(filename)[0] + ".json"
-            if self.output_dir:
-                label_file_without_path = osp.basename(label_file)
-                label_file = osp.join(self.output_dir, label_file_without_path)
-            item = QtWidgets.QListWidgetItem(filename)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
-                label_file
-            ):
-                item.setCheckState(Qt.Checked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.fileListWidget.addItem(item)
+        # the directory index is refreshed incrementally (only the changed subdirectories are listed again)
+        if self.directoryIndex is not None:
+            # keep the label files saved since it was opened
+            self.directoryIndex.save()
+        self.directoryIndex = DirectoryIndex(dirpath, self.imageExtensions(), label_dir=self.output_dir)
+        self.directoryIndex.refresh()
+        self.directoryIndex.save()
+        self.fileListModel.set_files(
+            [(filename, has_label, nShapes) for filename, _, has_label, nShapes in self.directoryIndex.entries()],
+            root=self.directoryIndex.folder,
+        )
+        if pattern is not None:
+            self.fileSearch.blockSignals(True)
+            self.fileSearch.setText(pattern)
+            self.fileSearch.blockSignals(False)
+        self.fileListModel.set_filter(self.fileSearch.text())
         self.openNextImg(load=load)
         self.fileListWidget.horizontalScrollBar().setValue(
             self.fileListWidget.horizontalScrollBar().maximum()
         )
         
 
-    def scanAllImages(self, folderPath):
-        extensions = [
+    def imageExtensions(self):
+        return [
             ".%s" % fmt.data().decode().lower()
             for fmt in QtGui.QImageReader.supportedImageFormats()
         ]
 
-        images = []
-        for root, dirs, files in os.walk(folderPath):
-            for file in files:
-                if file.lower().endswith(tuple(extensions)):
-                    relativePath = osp.join(root, file)
-                    images.append(relativePath)
-        images.sort(key=lambda x: x.lower())
-        return images
+    def scanAllImages(self, folderPath):
+        index = DirectoryIndex(folderPath, self.imageExtensions()).refresh()
+        return [filename for filename, _, _, _ in index.entries()]
 
     def annotate_one(self,called_from_tracking=False):
         # self.waitWindow(visible=True, text="Please Wait.\nModel is Working...")
@@ -3607,7 +3687,7 @@ class MainWindow(QtWidgets.QMainWindow):
             return
             
         imageX = helpers.draw_bb_on_image_MODE(self.CURRENT_ANNOATAION_FLAGS,
-                                                    self.image, 
+                                                    self.frameBuffer, 
                                                     shapes)
 
         # for shape in shapes:
@@ -3628,7 +3708,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.actions.undoLastPoint.setEnabled(False)
         self.actions.undo.setEnabled(True)
         self.setDirty()
+        self.model_annotated_image = self.CURRENT_FRAME_IMAGE
         # self.waitWindow()
+
+    def refresh_model_annotation(self):
+        # the thresholds or the classes changed: if the shapes are still the output of the model,
+        # re-derive them from the cached detections of the image (the model does not run again)
+        if self.model_annotated_image is None or self.model_annotated_image is not self.CURRENT_FRAME_IMAGE:
+            return
+        self.annotate_one()
         
     def refresh_image_MODE(self, fromSignal=False):
         try:
@@ -3636,7 +3724,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 return
             self.CURRENT_SHAPES_IN_IMG = self.convert_qt_shapes_to_shapes(self.canvas.shapes)
             imageX = helpers.draw_bb_on_image_MODE(self.CURRENT_ANNOATAION_FLAGS,
-                                                            self.image, 
+                                                            self.frameBuffer, 
                                                             self.CURRENT_SHAPES_IN_IMG)
             # self.canvas.setEnabled(False)
             self.labelList.clear()
@@ -3649,14 +3737,17 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def annotate_batch(self):
         images = []
+        # the "Save With Image Data" option is only in the current config, not in the config file
+        store_data = self._config["store_data"]
         self._config = get_config()
+        self._config["store_data"] = store_data
         notif = [self._config["mute"], self, helpers.notification]
         for filename in self.imageList:
             images.append(filename)
         if self.multi_model_flag:
-            self.intelligenceHelper.get_shapes_of_batch(images, multi_model_flag=True, notif = notif)
+            self.intelligenceHelper.get_shapes_of_batch(images, multi_model_flag=True, notif = notif, store_data=store_data)
         else:
-            self.intelligenceHelper.get_shapes_of_batch(images, notif = notif)
+            self.intelligenceHelper.get_shapes_of_batch(images, notif = notif, store_data=store_data)
 
     def setConfThreshold(self):
         if self.intelligenceHelper.conf_threshold:
@@ -3664,6 +3755,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.intelligenceHelper.conf_threshold)
         else:
             self.intelligenceHelper.conf_threshold = self.intelligenceHelper.setConfThreshold()
+        self.refresh_model_annotation()
 
     def setIOUThreshold(self):
         if self.intelligenceHelper.iou_threshold:
@@ -3671,9 +3763,15 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.intelligenceHelper.iou_threshold)
         else:
             self.intelligenceHelper.iou_threshold = self.intelligenceHelper.setIOUThreshold()
+        self.refresh_model_annotation()
+
+    def setTiledInference(self, enabled):
+        self._config["tiled_inference"] = enabled
+        self.intelligenceHelper.tiled_inference = enabled
 
     def selectClasses(self):
         self.intelligenceHelper.selectedclasses = self.intelligenceHelper.selectClasses()
+        self.refresh_model_annotation()
 
     def mergeSegModels(self):
         self.intelligenceHelper.selectedmodels = self.intelligenceHelper.mergeSegModels()
@@ -3709,15 +3807,14 @@ class MainWindow(QtWidgets.QMainWindow):
             frames (list): list of frames to calculate trajectories for (default: None -> all frames)
         """
         
-        listObj = self.load_objects_from_json__orjson()
-        if len(listObj) == 0:
+        if self.TOTAL_VIDEO_FRAMES == 0:
             return
         
-        frames = frames if frames else range(len(listObj))
+        frames = frames if frames else range(self.TOTAL_VIDEO_FRAMES)
         
-        for i in frames:
-            listobjframe = listObj[i]['frame_idx']
-            for object in listObj[i]['frame_data']:
+        # only the requested frames are decoded
+        for listobjframe, frame_data in self.iter_frames([i + 1 for i in frames]):
+            for object in frame_data:
                 id = object['tracker_id']
                 self.minID = min(self.minID, id - 1)
                 self.rec_frame_for_id(id, listobjframe)
@@ -3729,33 +3826,17 @@ class MainWindow(QtWidgets.QMainWindow):
                 idx = label_ascii % len(color_palette)
                 color = color_palette[idx]
                 center = self.centerOFmass(object['segment'])
-                try:
-                    centers_rec = self.CURRENT_ANNOATAION_TRAJECTORIES['id_' + str(
-                        id)]
-
-                    try:
-                        (xp, yp) = centers_rec[listobjframe - 2]
-                        (xn, yn) = center
-                        if (xp == -1 or xn == -1):
-                            c = 5 / 0
-                        r = 0.5
-                        x = r * xn + (1 - r) * xp
-                        y = r * yn + (1 - r) * yp
-                        center = (int(x), int(y))
-                    except:
-                        pass
-                    centers_rec[listobjframe - 1] = center
-                    self.CURRENT_ANNOATAION_TRAJECTORIES['id_' +
-                                                         str(id)] = centers_rec
-                    self.CURRENT_ANNOATAION_TRAJECTORIES['id_color_' + str(
-                        id)] = color
-                except:
-                    centers_rec = [(-1, - 1)] * int(self.TOTAL_VIDEO_FRAMES)
-                    centers_rec[listobjframe - 1] = center
-                    self.CURRENT_ANNOATAION_TRAJECTORIES['id_' +
-                                                         str(id)] = centers_rec
-                    self.CURRENT_ANNOATAION_TRAJECTORIES['id_color_' + str(
-                        id)] = color
+                if 'id_' + str(id) not in self.CURRENT_ANNOATAION_TRAJECTORIES:
+                    self.CURRENT_ANNOATAION_TRAJECTORIES['id_' + str(id)] = utils.Trajectory()
+                centers_rec = self.CURRENT_ANNOATAION_TRAJECTORIES['id_' + str(id)]
+                # smooth the center with the center of the previous frame
+                previous = centers_rec.get(listobjframe - 1)
+                if previous is not None:
+                    r = 0.5
+                    center = (int(r * center[0] + (1 - r) * previous[0]),
+                              int(r * center[1] + (1 - r) * previous[1]))
+                centers_rec.set(listobjframe, center)
+                self.CURRENT_ANNOATAION_TRAJECTORIES['id_color_' + str(id)] = color
 
     def right_click_menu(self):
         
@@ -3807,6 +3888,11 @@ class MainWindow(QtWidgets.QMainWindow):
             utils.addActions(self.menus.edit, (self.actions.menu[i] for i in image_menu_list))
 
     def reset_for_new_mode(self, mode):
+        self.stop_tracking()
+        self.flush_video_annotations()
+        if self.frame_provider is not None:
+            self.frame_provider.release()
+            self.frame_provider = None
         length_Value = self.CURRENT_ANNOATAION_TRAJECTORIES['length']
         alpha_Value = self.CURRENT_ANNOATAION_TRAJECTORIES['alpha']
         self.CURRENT_ANNOATAION_TRAJECTORIES.clear()
@@ -3827,7 +3913,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.current_annotation_mode = mode
         self.canvas.current_annotation_mode = mode
         self.right_click_menu()
-        self.global_listObj = []
         self.minID = -2
         self.maxID = 0
 
@@ -3848,7 +3933,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if videoFile[0]:
             # clear the file list widget
-            self.fileListWidget.clear()
+            self.fileListModel.clear()
             self.uniqLabelList.clear()
             self.reset_for_new_mode("video")
             
@@ -3858,7 +3943,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 videoFile[0].split(".")[-2].split("/")[:-1])
             
             json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
-            if os.path.exists(json_file_name):
+            if os.path.exists(json_file_name) or os.path.exists(helpers.store_path_from_json(json_file_name)):
                 self.actions.export.setEnabled(True)
             else:
                 self.actions.export.setEnabled(False)
@@ -3869,6 +3954,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.CURRENT_VIDEO_HEIGHT = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             self.CURRENT_VIDEO_WIDTH = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             self.CAP = cap
+            self.frame_provider = utils.VideoFrameProvider(videoFile[0])
             # # making the total video frames equal to the total frames in the video file - 1 as the indexing starts from 0
             # self.TOTAL_VIDEO_FRAMES = int(
             #     self.CAP.get(cv2.CAP_PROP_FRAME_COUNT - 1) )
@@ -3876,6 +3962,10 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.CAP.get(cv2.CAP_PROP_FRAME_COUNT))
             self.CURRENT_VIDEO_FPS = self.CAP.get(cv2.CAP_PROP_FPS)
             print("Total Frames : ", self.TOTAL_VIDEO_FRAMES)
+            # replay the journal of the video (changes that were not compacted, e.g. after a crash)
+            if os.path.exists(helpers.journal_path_from_json(json_file_name)):
+                helpers.get_frame_journal(json_file_name, self.TOTAL_VIDEO_FRAMES)
+                self.actions.export.setEnabled(True)
             self.main_video_frames_slider.setMaximum(self.TOTAL_VIDEO_FRAMES)
             self.frames_to_track_slider.setMaximum(self.TOTAL_VIDEO_FRAMES - self.INDEX_OF_CURRENT_FRAME)
             self.main_video_frames_slider.setValue(2)
@@ -3887,7 +3977,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
             self.update_tracking_method()
 
-            self.calculate_trajectories()
+            self.load_id_index()
             keys = list(self.id_frames_rec.keys())
             idsORG = [int(keys[i][3:]) for i in range(len(keys))]
             if len(idsORG) > 0:
@@ -3936,33 +4026,8 @@ class MainWindow(QtWidgets.QMainWindow):
         # we need to parse from it data for the current frame
 
         target_frame_idx = index
-        listObj = self.load_objects_from_json__orjson()
-
-        listObj = np.array(listObj)
-
-        shapes = []
-        # for i in range(len(listObj)):
-        i = target_frame_idx - 1
-        # frame_idx = listObj[i]['frame_idx']
-        # if frame_idx == target_frame_idx:
-        # print (listObj[i])
-        # print(i)
-        frame_objects = listObj[i]['frame_data']
-        for object_ in frame_objects:
-            shape = {}
-            shape["label"] = object_["class_name"]
-            shape["group_id"] = (object_['tracker_id'])
-            shape["content"] = (object_['confidence'])
-            shape["bbox"] = object_['bbox']
-            points = object_['segment']
-            points = np.array(points, np.int16).flatten().tolist()
-            shape["points"] = points
-            shape["shape_type"] = "polygon"
-            shape["other_data"] = {}
-            shape["flags"] = {}
-            shapes.append(shape)
-
-        self.CURRENT_SHAPES_IN_IMG = shapes
+        # only the current frame is decoded
+        self.CURRENT_SHAPES_IN_IMG = helpers.frame_objects_to_shapes(self.get_frame_objects(target_frame_idx))
 
     def loadFramefromVideo(self, frame_array, index=1):
         # filename = str(index) + ".jpg"
@@ -3970,11 +4035,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.resetState()
         self.canvas.setEnabled(False)
 
-        self.imageData = frame_array.data
+        self.frameBuffer = FrameBuffer(frame_array)
+        self.imageData = self.frameBuffer.array.data
 
-        self.CURRENT_FRAME_IMAGE = frame_array
-        image = QtGui.QImage(self.imageData, self.imageData.shape[1], self.imageData.shape[0],
-                             QtGui.QImage.Format_BGR888)
+        self.CURRENT_FRAME_IMAGE = self.frameBuffer.array
+        image = self.frameBuffer.qimage()
         self.image = image
         if self._config["keep_prev"]:
             prev_shapes = self.canvas.shapes
@@ -3986,7 +4051,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if self.TrackingMode:
             # print("Tracking Mode", len(self.CURRENT_SHAPES_IN_IMG))
-            image = self.draw_bb_on_image(image, self.CURRENT_SHAPES_IN_IMG)
+            image = self.draw_bb_on_image(self.frameBuffer, self.CURRENT_SHAPES_IN_IMG)
             self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
             if len(self.CURRENT_SHAPES_IN_IMG) > 0:
                 self.loadLabels(self.CURRENT_SHAPES_IN_IMG)
@@ -3994,7 +4059,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if self.labelFile:
                 self.CURRENT_SHAPES_IN_IMG = self.labelFile.shapes
                 image = self.draw_bb_on_image(
-                    image, self.CURRENT_SHAPES_IN_IMG)
+                    self.frameBuffer, self.CURRENT_SHAPES_IN_IMG)
                 self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
                 self.loadLabels(self.labelFile.shapes)
                 if self.labelFile.flags is not None:
@@ -4002,11 +4067,11 @@ class MainWindow(QtWidgets.QMainWindow):
 
             else:
                 json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
-                if os.path.exists(json_file_name):
+                if os.path.exists(json_file_name) or os.path.exists(helpers.store_path_from_json(json_file_name)):
                     # print('json file exists , loading shapes')
                     self.load_shapes_for_video_frame(json_file_name, index)
                     image = self.draw_bb_on_image(
-                        image, self.CURRENT_SHAPES_IN_IMG)
+                        self.frameBuffer, self.CURRENT_SHAPES_IN_IMG)
                     self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
                     if len(self.CURRENT_SHAPES_IN_IMG) > 0:
                         self.loadLabels(self.CURRENT_SHAPES_IN_IMG)
@@ -4118,7 +4183,6 @@ class MainWindow(QtWidgets.QMainWindow):
         frame_idx = self.main_video_frames_slider.value()
 
         self.INDEX_OF_CURRENT_FRAME = frame_idx
-        self.CAP.set(cv2.CAP_PROP_POS_FRAMES, frame_idx - 1)
 
         # setting text of labels
         zeros = (int(np.log10(self.TOTAL_VIDEO_FRAMES + 0.9)) -
@@ -4134,10 +4198,10 @@ class MainWindow(QtWidgets.QMainWindow):
         final_text = frame_text + " / " + video_duration_text
         self.main_video_frames_label_2.setText(f'time {final_text}')
 
-        # reading the current frame from the video and loading it into the canvas
-        success, img = self.CAP.read()
-        if success:
-            frame_array = np.array(img)
+        # reading the current frame from the video (or the decoded frames cache) and loading it into the canvas
+        img = self.frame_provider.get_frame(frame_idx)
+        if img is not None:
+            frame_array = img
             self.loadFramefromVideo(frame_array, frame_idx)
         else:
             pass
@@ -4206,9 +4270,8 @@ class MainWindow(QtWidgets.QMainWindow):
         # Disable the track button
         # self.actions.track.setEnabled(False)
 
-        # Create a thread to run the tracking process
-        self.thread = TrackingThread(parent=self)
-        self.thread.start()
+        # the tracking runs in a TrackingWorker thread
+        self.track_buttonClicked()
 
     def get_boxes_conf_classids_segments(self, shapes):
         return helpers.get_boxes_conf_classids_segments(shapes)
@@ -4247,200 +4310,185 @@ class MainWindow(QtWidgets.QMainWindow):
             
     def track_buttonClicked(self):
 
-        # Disable Exports & Change button text
-        # self.export_as_video_button.setEnabled(False)
-        self.actions.export.setEnabled(False)
-
-        # dt = (Profile(), Profile(), Profile(), Profile())
-    
-        self.tracking_progress_bar.setVisible(True)
-        # self.track_stop_button.setVisible(True)
-        # self.track_stop_button.setEnabled(True)
-        frame_shape = self.CURRENT_FRAME_IMAGE.shape
-        # print(frame_shape)
-
-        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        """
+        Summary:
+            Track the objects from the current frame over the next FRAMES_TO_TRACK frames.
+            The tracking runs in a TrackingWorker (decode, detect, polygonize, track and persist stages off the GUI thread),
+            the GUI follows the tracked frames through its signals.
+        """
 
-        # first we need to check there is a json file with the same name as the video
-        listObj = self.load_objects_from_json__orjson()
+        if self.tracking_worker is not None and self.tracking_worker.isRunning():
+            return
 
-        existing_annotation = False
-        shapes = self.canvas.shapes
         tracks_to_follow = None
+        first_frame_shapes = None
+        shapes = self.canvas.shapes
         if len(shapes) > 0:
-            existing_annotation = True
-            # print(f'FRAME{self.INDEX_OF_CURRENT_FRAME}', len(shapes))
-            tracks_to_follow = []
-            for shape in shapes:
-                # print(shape.label)
-                if shape.group_id != None:
-                    tracks_to_follow.append(int(shape.group_id))
+            first_frame_shapes = self.convert_qt_shapes_to_shapes(shapes)
+            tracks_to_follow = [int(shape.group_id) for shape in shapes if shape.group_id != None]
 
-        # print(f'track_ids_to_follow = {tracks_to_follow}')
+        if self.TRACK_ASSIGNED_OBJECTS_ONLY and tracks_to_follow is not None:
+            try:
+                if len(self.labelList.selectedItems()) != 0:
+                    tracks_to_follow = self.selected_track_ids()
+            except:
+                # this happens when the user selects a label that is not a tracked object so there is error in extracting the tracker id
+                # show a message box to the user (hinting to use the tracker on the image first so that the label has a tracker id to be selected)
+                self.errorMessage(
+                    'Error', 'Please use the tracker on the image first so that you can select labels with IDs to track')
+                return
+        elif not self.TRACK_ASSIGNED_OBJECTS_ONLY:
+            tracks_to_follow = None
 
-        self.TrackingMode = True
-        bs = 1
-        curr_frame, prev_frame = None, None
+        area_polygon = None
+        if self.area_dropdown.currentIndex() == 1 and len(self.canvas.tracking_area_polygon) > 2:
+            area_polygon = [(int(x[0]), int(x[1])) for x in self.canvas.tracking_area_polygon]
 
         if self.FRAMES_TO_TRACK + self.INDEX_OF_CURRENT_FRAME <= self.TOTAL_VIDEO_FRAMES:
             number_of_frames_to_track = self.FRAMES_TO_TRACK
         else:
             number_of_frames_to_track = self.TOTAL_VIDEO_FRAMES - self.INDEX_OF_CURRENT_FRAME
+        if number_of_frames_to_track <= 0:
+            return
+
+        # Disable Exports
+        self.actions.export.setEnabled(False)
+        self.tracking_progress_bar.setVisible(True)
+        self.tracking_progress_bar.setValue(0)
 
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        keyframe_index = self.frame_provider.keyframe_index
+
+        self.TrackingMode = True
         self.interrupted = False
-        for i in range(number_of_frames_to_track):
-            QtWidgets.QApplication.processEvents()
-            if self.interrupted:
-                self.interrupted = False
-                break
-            if i % 100 == 0:
-                self.load_objects_to_json__orjson(listObj)
-            self.tracking_progress_bar.setValue(
-                int((i + 1) / number_of_frames_to_track * 100))
+        self.tracking_start_frame = self.INDEX_OF_CURRENT_FRAME
+        self.tracking_worker = TrackingWorker(self, self.frame_provider.video_path, json_file_name, self.TOTAL_VIDEO_FRAMES,
+                                              self.INDEX_OF_CURRENT_FRAME, number_of_frames_to_track,
+                                              self.intelligenceHelper.snapshot(), self.tracker,
+                                              multi_model_flag=self.multi_model_flag,
+                                              first_frame_shapes=first_frame_shapes,
+                                              tracks_to_follow=tracks_to_follow,
+                                              area_polygon=area_polygon,
+                                              id_offset=self.maxID,
+                                              keyframe_index=keyframe_index)
+        self.tracking_worker.frameTracked.connect(self.on_frame_tracked)
+        self.tracking_worker.progress.connect(self.on_tracking_progress)
+        self.tracking_worker.trackingError.connect(
+            lambda error: helpers.OKmsgBox("Error", f"Tracking stopped: {error}", "critical"))
+        self.tracking_worker.trackingFinished.connect(self.on_tracking_finished)
+        self.track_pause_button.setEnabled(True)
+        self.tracking_worker.start()
+
+    def selected_track_ids(self):
+        # the tracker ids of the selected labels ("ID <id>: <label>"), raises ValueError for a label without an id
+        tracks = []
+        for item in self.labelList.selectedItems():
+            x = item.text()
+            i1, i2 = x.find('D'), x.find(':')
+            tracks.append(int(x[i1 + 2:i2]))
+        return tracks
+
+    def follow_selected_tracks(self):
+
+        """
+        Summary:
+            While tracking the assigned objects only, follow the objects selected in the label list
+            (the worker reads the tracks to follow for each frame, like the tracking loop did on the GUI thread).
+        """
 
+        worker = self.tracking_worker
+        if worker is None or worker.tracks_to_follow is None or len(self.labelList.selectedItems()) == 0:
+            return
+        try:
+            worker.tracks_to_follow = self.selected_track_ids()
+        except ValueError:
+            # a label that is not a tracked object, the tracked objects do not change
+            pass
 
-            if existing_annotation:
-                existing_annotation = False
-                # print('\nloading existing annotation\n')
-                shapes = self.canvas.shapes
-                shapes = self.convert_qt_shapes_to_shapes(shapes)
+    def track_pause_button_toggled(self, paused):
+        if self.tracking_worker is not None:
+            if paused:
+                self.tracking_worker.pause()
             else:
-                with torch.no_grad():
-                    # shapes = self.intelligenceHelper.get_shapes_of_one(
-                    #     self.CURRENT_FRAME_IMAGE, img_array_flag=True)
-                    shapes = self.annotate_one(called_from_tracking=True)
-
-            curr_frame = self.CURRENT_FRAME_IMAGE
-            # current_objects_ids = []
-            if len(shapes) == 0:
-                # print("no detection in this frame")
-                self.update_gui_after_tracking(i)
-                continue
+                self.tracking_worker.resume()
+        self.track_pause_button.setText("Resume Tracking" if paused else "Pause Tracking")
 
-            for shape in shapes:
-                if shape['content'] is None:
-                    shape['content'] = 1.0
-            boxes, confidences, class_ids, segments = self.get_boxes_conf_classids_segments(
-                shapes)
-
-            boxes = np.array(boxes, dtype=int)
-            confidences = np.array(confidences)
-            class_ids = np.array(class_ids)
-            detections = Detections(
-                xyxy=boxes,
-                confidence=confidences,
-                class_id=class_ids,
-            )
-            boxes = torch.from_numpy(detections.xyxy)
-            confidences = torch.from_numpy(detections.confidence)
-            class_ids = torch.from_numpy(detections.class_id)
-
-            dets = torch.cat((boxes, confidences.unsqueeze(
-                1), class_ids.unsqueeze(1)), dim=1)
-            # convert dets to torch.float32 to avoid error in the tracker update function
-            dets = dets.to(torch.float32)
-            if hasattr(self.tracker, 'tracker') and hasattr(self.tracker.tracker, 'camera_update'):
-                if prev_frame is not None and curr_frame is not None:  # camera motion compensation
-                    self.tracker.tracker.camera_update(prev_frame, curr_frame)
-                    # print('camera update')
-            prev_frame = curr_frame
-            with torch.no_grad():
-                org_tracks = self.tracker.update(
-                    dets.cpu(), self.CURRENT_FRAME_IMAGE)
-
-            tracks = []
-            for org_track in org_tracks:
-                track = []
-                for i in range(6):
-                    track.append(int(org_track[i]))
-                track[4] += int(self.maxID)
-                track.append(org_track[6])
-
-                tracks.append(track)
-
-            matched_shapes, unmatched_shapes = self.match_detections_with_tracks(
-                shapes, tracks)
-            shapes = matched_shapes
-
-            self.CURRENT_SHAPES_IN_IMG = [
-                shape_ for shape_ in shapes if shape_["group_id"] is not None]
-
-            if self.TRACK_ASSIGNED_OBJECTS_ONLY and tracks_to_follow is not None:
-                try:
-                    if len(self.labelList.selectedItems()) != 0:
-                        tracks_to_follow = []
-                        for item in self.labelList.selectedItems():
-                            x = item.text()
-                            i1, i2 = x.find('D'), x.find(':')
-                            # print(x, x[i1 + 2:i2])
-                            tracks_to_follow.append(int(x[i1 + 2:i2]))
-                    self.CURRENT_SHAPES_IN_IMG = [
-                        shape_ for shape_ in shapes if shape_["group_id"] in tracks_to_follow]
-                except:
-                    # this happens when the user selects a label that is not a tracked object so there is error in extracting the tracker id
-                    # show a message box to the user (hinting to use the tracker on the image first so that the label has a tracker id to be selected)
-                    self.errorMessage(
-                        'Error', 'Please use the tracker on the image first so that you can select labels with IDs to track')
+    def reset_track_pause_button(self):
+        self.track_pause_button.blockSignals(True)
+        self.track_pause_button.setChecked(False)
+        self.track_pause_button.blockSignals(False)
+        self.track_pause_button.setText("Pause Tracking")
+        self.track_pause_button.setEnabled(False)
 
-                    return
-                
-            if self.area_dropdown.currentIndex() == 1 and len(self.canvas.tracking_area_polygon) > 2:
-                area_polygon = self.canvas.tracking_area_polygon
-                shape1 = [tuple([int(x[0]), int(x[1])]) for x in area_polygon]
-                polygon1 = Polygon(shape1)
-                final = []
-                for shape in self.CURRENT_SHAPES_IN_IMG:
-                    points = shape["points"]
-                    shape2 = [tuple([int(points[z]), int(points[z + 1])])
-                            for z in range(0, len(points), 2)]
-                    polygon2 = Polygon(shape2)
-                    if polygon1.intersects(polygon2):
-                        final.append(shape)
-                self.CURRENT_SHAPES_IN_IMG = copy.deepcopy(final)
-                
+    def stop_tracking(self):
 
-            # to understand the json output file structure it is a dictionary of frames and each frame is a dictionary of tracker_ids and each tracker_id is a dictionary of bbox , confidence , class_id , segment
-            json_frame = {}
-            json_frame.update({'frame_idx': self.INDEX_OF_CURRENT_FRAME})
-            json_frame_object_list = []
-            for shape in self.CURRENT_SHAPES_IN_IMG:
-                self.rec_frame_for_id(
-                    int(shape["group_id"]), self.INDEX_OF_CURRENT_FRAME, type_='add')
-                json_tracked_object = {}
-                json_tracked_object['tracker_id'] = int(shape["group_id"])
-                json_tracked_object['bbox'] = [int(i) for i in shape['bbox']]
-                json_tracked_object['confidence'] = shape["content"]
-                json_tracked_object['class_name'] = shape["label"]
-                json_tracked_object['class_id'] = coco_classes.index(
-                    shape["label"]) if shape["label"] in coco_classes else -1
-                points = shape["points"]
-                segment = [[int(points[z]), int(points[z + 1])]
-                           for z in range(0, len(points), 2)]
-                json_tracked_object['segment'] = segment
-
-                json_frame_object_list.append(json_tracked_object)
-
-            json_frame.update({'frame_data': json_frame_object_list})
-
-            # for h in range(len(listObj)):
-            #     if listObj[h]['frame_idx'] == self.INDEX_OF_CURRENT_FRAME:
-            #         listObj.pop(h)
-            #         break
-            # listObj.pop(self.INDEX_OF_CURRENT_FRAME - 1)
-
-            # sort the list of frames by the frame index
-            # listObj.append(json_frame)
-            listObj[self.INDEX_OF_CURRENT_FRAME - 1] = json_frame
+        """
+        Summary:
+            Cancel the running tracking worker (if any) and wait for it to persist the frames it tracked.
+            The ids and trajectories of all the persisted frames are recorded here (the signals of the frames
+            persisted after the cancel are not handled), so the id index saved with them is complete.
+        """
 
-            QtWidgets.QApplication.processEvents()
-            self.update_gui_after_tracking(i)
-            print('finished tracking for frame ', self.INDEX_OF_CURRENT_FRAME)
-            import psutil
-            if self.INDEX_OF_CURRENT_FRAME % 10 == 0:
-                print(f"Total Memory: {psutil.virtual_memory().total / 1024 ** 3} GB | Free Memory: {psutil.virtual_memory().free / 1024 ** 3} GB | Percent Used: {psutil.virtual_memory().percent} %")
+        if self.tracking_worker is None:
+            return
+        worker = self.tracking_worker
+        self.tracking_worker = None
+        worker.frameTracked.disconnect()
+        worker.trackingFinished.disconnect()
+        worker.cancel()
+        worker.wait()
+        self.reset_track_pause_button()
+        if worker.last_persisted_idx >= self.tracking_start_frame:
+            self.calculate_trajectories(range(self.tracking_start_frame - 1, worker.last_persisted_idx))
+            self.id_index_dirty = True
+        self.TrackingMode = False
 
-        # listObj = sorted(listObj, key=lambda k: k['frame_idx'])
-        self.load_objects_to_json__orjson(listObj)
+    def on_frame_tracked(self, frame_idx, frame_data):
+
+        """
+        Summary:
+            Record the ids of a tracked frame (already persisted by the worker) and show it if it is the latest one.
+
+        Args:
+            frame_idx (int): the index of the tracked frame
+            frame_data (list): the tracked objects of the frame (None if nothing was detected)
+        """
+
+        if frame_data is not None:
+            for object_ in frame_data:
+                self.rec_frame_for_id(object_['tracker_id'], frame_idx, type_='add')
+            self.id_index_dirty = True
+        self.tracking_last_frame = frame_idx
+        # only the latest tracked frame is shown, the display skips frames if it is slower than the tracking
+        QtCore.QTimer.singleShot(0, self.show_last_tracked_frame)
+
+    def show_last_tracked_frame(self):
+        frame_idx = getattr(self, 'tracking_last_frame', None)
+        if not self.TrackingMode or frame_idx is None or frame_idx == self.INDEX_OF_CURRENT_FRAME:
+            return
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        self.load_shapes_for_video_frame(json_file_name, frame_idx)
+        self.main_video_frames_slider.setValue(frame_idx)
+
+    def on_tracking_progress(self, nTracked, nFrames):
+        self.tracking_progress_bar.setValue(int(nTracked / nFrames * 100))
+
+    def on_tracking_finished(self, last_frame_idx, fps):
+
+        """
+        Summary:
+            Update the trajectories of the tracked frames and restore the GUI once the tracking worker is done.
+
+        Args:
+            last_frame_idx (int): the index of the last persisted frame
+            fps (float): the tracking speed in frames per second
+        """
+
+        print(f'finished tracking frames {self.tracking_start_frame} to {last_frame_idx} ({fps:.2f} frames/s)')
+        self.tracking_worker = None
+        if last_frame_idx >= self.tracking_start_frame:
+            self.calculate_trajectories(range(self.tracking_start_frame - 1, last_frame_idx))
+        self.compact_frame_journal()
 
         # Notify the user that the tracking is finished
         self._config = get_config()
@@ -4450,17 +4498,16 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.TrackingMode = False
         self.labelFile = None
-        self.main_video_frames_slider.setValue(self.INDEX_OF_CURRENT_FRAME - 1)
-        self.main_video_frames_slider.setValue(self.INDEX_OF_CURRENT_FRAME)
+        last_frame_idx = max(last_frame_idx, self.tracking_start_frame)
+        self.main_video_frames_slider.setValue(last_frame_idx - 1)
+        self.main_video_frames_slider.setValue(last_frame_idx)
 
         self.tracking_progress_bar.hide()
         self.tracking_progress_bar.setValue(0)
-        # self.track_stop_button.hide()
-        # self.track_stop_button.setEnabled(False)
+        self.reset_track_pause_button()
 
-        # Enable Exports & Restore button Text and Color
+        # Enable Exports
         self.actions.export.setEnabled(True)
-        # self.export_as_video_button.setEnabled(True)
 
     def convert_qt_shapes_to_shapes(self, qt_shapes):
         return helpers.convert_qt_shapes_to_shapes(qt_shapes)
@@ -4566,71 +4613,34 @@ class MainWindow(QtWidgets.QMainWindow):
         # print (f"output filename is {output_filename}")
         self.update_current_frame_annotation()
         json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
-        input_video_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}.mp4'
+        input_video_file_name = self.frame_provider.video_path
         output_video_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.mp4'
         if output_filename is not False:
             output_video_file_name = output_filename
         print (f"output video file name is {output_video_file_name}")
-        input_cap = cv2.VideoCapture(input_video_file_name)
-        output_cap = cv2.VideoWriter(output_video_file_name, cv2.VideoWriter_fourcc(
-            *'mp4v'), int(self.CURRENT_VIDEO_FPS), (int(self.CURRENT_VIDEO_WIDTH), int(self.CURRENT_VIDEO_HEIGHT)))
-        listObj = self.load_objects_from_json__orjson()
-
-        # make a progress bar for exporting video (with percentage of progress)   TO DO LATER
-        empty_frame = False
-        empty_video = True
-        for target_frame_idx in range(self.TOTAL_VIDEO_FRAMES):
-            try:
-                self.INDEX_OF_CURRENT_FRAME = target_frame_idx + 1
-                ret, image = input_cap.read()
-                shapes = []
-                # self.waitWindow(
-                #         visible=True, text=f'Please Wait.\nFrame {target_frame_idx} is being exported...')
-                frame_idx = listObj[target_frame_idx]['frame_idx']
-                frame_objects = listObj[target_frame_idx]['frame_data']
-                # print(frame_idx)
-                for object_ in frame_objects:
-                    shape = {}
-                    shape["label"] = object_['class_name']
-                    shape["group_id"] = str(object_['tracker_id'])
-                    shape["content"] = str(object_['confidence'])
-                    shape["bbox"] = object_['bbox']
-                    points = object_['segment']
-                    points = np.array(points, np.int16).flatten().tolist()
-                    shape["points"] = points
-                    shape["shape_type"] = "polygon"
-                    shape["other_data"] = {}
-                    shape["flags"] = {}
-                    shapes.append(shape)
-
-                if len(shapes) == 0:
-                    if not empty_frame:
-                        self.waitWindow(visible=True, text=f'Processing...')
-                        empty_frame = True
-                    continue
-                self.waitWindow(visible=True, text=f'Please Wait.\nFrame {target_frame_idx} is being exported...')
-                image = self.draw_bb_on_image(image, shapes, image_qt_flag=False)
-                output_cap.write(image)
-                empty_frame = False
-                empty_video = False
-            except:
-                input_cap.release()
-                output_cap.release()
-
 
-        input_cap.release()
-        output_cap.release()
-        # print("done exporting video")
+        # decode, render (a pool of threads) and write run off the GUI thread, the GUI only polls the progress
+        # (the exporter builds its own trajectories from the frame store, the trajectories of the app are not shared with it)
+        exporter = utils.VideoExporter(input_video_file_name, output_video_file_name, json_file_name,
+                                       self.TOTAL_VIDEO_FRAMES, self.CURRENT_ANNOATAION_FLAGS,
+                                       self.CURRENT_ANNOATAION_TRAJECTORIES['length'],
+                                       self.CURRENT_ANNOATAION_TRAJECTORIES['alpha'], fps=self.CURRENT_VIDEO_FPS)
+        result = []
+        export_thread = threading.Thread(target=lambda: result.append(exporter.run()), daemon=True)
+        self.interrupted = False
+        export_thread.start()
+        while export_thread.is_alive():
+            if self.interrupted:
+                self.interrupted = False
+                exporter.cancel()
+            nDecoded, nTotalFrames, nWritten = exporter.progress()
+            self.waitWindow(visible=True, text=f'Please Wait.\nFrame {nDecoded} of {nTotalFrames} is being exported...')
+            export_thread.join(0.1)
         self.waitWindow()
 
-        try:
-            if empty_video:
-                os.remove(output_video_file_name)
-                return False
-        except:
-            pass
-        
-        self.INDEX_OF_CURRENT_FRAME = self.main_video_frames_slider.value()
+        if not result or not result[0]:
+            return False
+
         # show message saying that the video is exported
         if output_filename is False:
             helpers.OKmsgBox("Export Video", "Done Exporting Video")
@@ -4639,7 +4649,6 @@ class MainWindow(QtWidgets.QMainWindow):
             return output_filename
 
     def clear_video_annotations_button_clicked(self):
-        self.global_listObj = []
         length_Value = self.CURRENT_ANNOATAION_TRAJECTORIES['length']
         alpha_Value = self.CURRENT_ANNOATAION_TRAJECTORIES['alpha']
         self.CURRENT_ANNOATAION_TRAJECTORIES.clear()
@@ -4661,6 +4670,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # now delete the json file if it exists
         if os.path.exists(json_file_name):
             os.remove(json_file_name)
+        helpers.close_frame_store(json_file_name, delete=True)
         helpers.OKmsgBox("clear annotations",
                          "All video frames annotations are cleared")
         self.main_video_frames_slider.setValue(2)
@@ -4683,8 +4693,6 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.current_annotation_mode != "video":
             return
 
-        listObj = self.load_objects_from_json__orjson()
-
         json_frame = {}
         json_frame.update({'frame_idx': self.INDEX_OF_CURRENT_FRAME})
         json_frame_object_list = []
@@ -4720,15 +4728,13 @@ class MainWindow(QtWidgets.QMainWindow):
         # listObj.pop(self.INDEX_OF_CURRENT_FRAME - 1)
 
         # listObj.append(json_frame)
-        listObj[self.INDEX_OF_CURRENT_FRAME - 1] = json_frame
-
         # listObj = sorted(listObj, key=lambda k: k['frame_idx'])
         # with open(json_file_name, 'w') as json_file:
         #     json.dump(listObj, json_file,
         #               indent=4,
         #               separators=(',', ': '))
         # json_file.close()
-        self.load_objects_to_json__orjson(listObj)
+        self.set_frame_objects({self.INDEX_OF_CURRENT_FRAME: json_frame['frame_data']})
         print("saved frame annotation")
 
     def trajectory_length_lineEdit_changed(self):
@@ -4944,6 +4950,13 @@ class MainWindow(QtWidgets.QMainWindow):
         self.track_stop_button.pressed.connect(
             self.Escape_clicked)
         self.videoControls_2.addWidget(self.track_stop_button)
+
+        self.track_pause_button = QtWidgets.QPushButton("Pause Tracking")
+        self.track_pause_button.setStyleSheet(self.buttons_text_style_sheet)
+        self.track_pause_button.setCheckable(True)
+        self.track_pause_button.setEnabled(False)
+        self.track_pause_button.toggled.connect(self.track_pause_button_toggled)
+        self.videoControls_2.addWidget(self.track_pause_button)
     
 
         # add 5 checkboxes to control the CURRENT ANNOATAION FLAGS including (bbox , id , class , mask , traj)
@@ -5689,26 +5702,153 @@ class MainWindow(QtWidgets.QMainWindow):
         # print("done running sam model")
 
     def load_objects_from_json__json(self):
-        if self.global_listObj != []:
-            return self.global_listObj
         json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
         return helpers.load_objects_from_json__json(json_file_name, self.TOTAL_VIDEO_FRAMES)
 
     def load_objects_to_json__json(self, listObj):
-        self.global_listObj = listObj
         json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
         helpers.load_objects_to_json__json(json_file_name, listObj)
 
     def load_objects_from_json__orjson(self):
-        if self.global_listObj != []:
-            return self.global_listObj
         json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
         return helpers.load_objects_from_json__orjson(json_file_name, self.TOTAL_VIDEO_FRAMES)
 
-    def load_objects_to_json__orjson(self, listObj):
-        self.global_listObj = listObj
+    def load_objects_to_json__orjson(self, listObj, frames=None):
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        helpers.load_objects_to_json__orjson(json_file_name, listObj, frames)
+        self.id_index_dirty = True
+        self.journal_compaction_timer.start()
+
+    def get_frame_objects(self, frame_idx):
+        
+        """
+        Summary:
+            Get the objects of a single video frame, only this frame is decoded.
+            
+        Args:
+            frame_idx (int): the frame index (starts from 1)
+            
+        Returns:
+            frame_data (list): the objects of the frame
+        """
+        
         json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
-        helpers.load_objects_to_json__orjson(json_file_name, listObj)
+        return helpers.get_frame_objects(json_file_name, self.TOTAL_VIDEO_FRAMES, frame_idx)
+
+    def iter_frames(self, frames=None):
+        
+        """
+        Summary:
+            Iterate over the objects of some video frames, only the requested frames are decoded.
+            
+        Args:
+            frames (iterable): frame indices (starts from 1) (default: None -> all frames)
+            
+        Returns:
+            a generator of (frame_idx, frame_data)
+        """
+        
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        return helpers.iter_frames(json_file_name, self.TOTAL_VIDEO_FRAMES, frames)
+
+    def set_frame_objects(self, frames):
+        
+        """
+        Summary:
+            Save the objects of some video frames, the other frames are left untouched.
+            
+        Args:
+            frames (dict): frame index (starts from 1) -> frame_data
+        """
+        
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        helpers.set_frame_objects(json_file_name, self.TOTAL_VIDEO_FRAMES, sorted(frames.items()))
+        self.id_index_dirty = True
+        self.journal_compaction_timer.start()
+
+    def compact_frame_journal(self, background=True):
+        
+        """
+        Summary:
+            Compact the journal of the current video into its frame store (called when the user is idle).
+            Once the journal is compacted, the id index is saved if it changed.
+            
+        Args:
+            background (bool): compact on a background thread (default: True)
+        """
+        
+        if self.current_annotation_mode != "video":
+            return
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        journal = helpers.get_frame_journal(json_file_name, self.TOTAL_VIDEO_FRAMES)
+        if journal.has_pending() or journal.is_compacting():
+            helpers.compact_frame_journal(json_file_name, background)
+            if background:
+                # check again later to save the id index once the compaction is done
+                self.journal_compaction_timer.start()
+                return
+        self.save_id_index()
+
+    def flush_video_annotations(self):
+        
+        """
+        Summary:
+            Compact the journal of the current video and save its id index (before closing the video).
+        """
+        
+        if self.current_annotation_mode != "video":
+            return
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        if not os.path.exists(helpers.store_path_from_json(json_file_name)):
+            return
+        journal = helpers.get_frame_journal(json_file_name, self.TOTAL_VIDEO_FRAMES)
+        if journal.compaction_thread is not None:
+            journal.compaction_thread.join()
+        self.compact_frame_journal(background=False)
+
+    def save_id_index(self):
+        
+        """
+        Summary:
+            Save the id index sidecar of the current video (frames, first/last frame, centers and color of each id).
+            The index is only saved when the journal is fully compacted, so it matches the generation of the frame store.
+        """
+        
+        if not self.id_index_dirty:
+            return
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        journal = helpers.get_frame_journal(json_file_name, self.TOTAL_VIDEO_FRAMES)
+        if journal.has_pending() or journal.is_compacting():
+            return
+        utils.save_id_index(utils.id_index_path_from_json(json_file_name), journal.store.generation,
+                            self.id_frames_rec, self.CURRENT_ANNOATAION_TRAJECTORIES)
+        self.id_index_dirty = False
+
+    def load_id_index(self):
+        
+        """
+        Summary:
+            Load id_frames_rec and the trajectories of the current video from its id index sidecar.
+            The trajectories are recalculated from all frames only if the index is missing or stale.
+        """
+        
+        json_file_name = f'{self.CURRENT_VIDEO_PATH}/{self.CURRENT_VIDEO_NAME}_tracking_results.json'
+        index = None
+        if os.path.exists(helpers.store_path_from_json(json_file_name)):
+            journal = helpers.get_frame_journal(json_file_name, self.TOTAL_VIDEO_FRAMES)
+            # replayed journal changes are not in the index
+            if not journal.has_pending():
+                index = utils.load_id_index(utils.id_index_path_from_json(json_file_name),
+                                            journal.store.generation, self.TOTAL_VIDEO_FRAMES)
+        if index is None:
+            self.calculate_trajectories()
+            self.id_index_dirty = True
+            return
+        self.id_frames_rec, trajectories = index
+        self.CURRENT_ANNOATAION_TRAJECTORIES.update(trajectories)
+        for key in self.id_frames_rec.keys():
+            self.minID = min(self.minID, int(key[3:]) - 1)
+        self.id_index_dirty = False
 
 
     # def assignVideShortcuts(self):
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+import argparse
+
+from labelme.utils.video_export import export_video
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export a video with its tracking results drawn on it")
+    parser.add_argument("video_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--json_file", default=None, help="the tracking results (default: <video>_tracking_results.json)")
+    parser.add_argument("--workers", type=int, default=None, help="the number of render threads")
+    parser.add_argument("--keep_empty_frames", action="store_true", help="also write the frames without objects")
+    parser.add_argument("--trajectories", action="store_true", help="draw the trajectories")
+    parser.add_argument("--no_masks", action="store_true", help="do not draw the masks")
+    args = parser.parse_args()
+
+    flags = {"traj": args.trajectories, "bbox": True, "id": True, "class": True,
+             "mask": not args.no_masks, "polygons": True, "conf": True}
+    exported = export_video(args.video_file, args.output_file, json_file_name=args.json_file, flags=flags,
+                            workers=args.workers, skip_empty_frames=not args.keep_empty_frames)
+    if exported:
+        print(f"exported {args.output_file}")
+    else:
+        print("nothing was exported (no tracking results)")
+
+
+if __name__ == "__main__":
+    main()
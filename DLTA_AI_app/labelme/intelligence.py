@@ -1,6 +1,9 @@
 from ultralytics import YOLO
+import copy
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 try:
     from inferencing import models_inference
 except ModuleNotFoundError:
@@ -19,6 +22,8 @@ import os
 import os.path as osp
 import warnings
 import numpy as np
+import cv2
+import PIL.Image
 import urllib.request
 from .shape import Shape
 from labelme.utils.model_explorer import ModelExplorerDialog
@@ -30,6 +35,10 @@ warnings.filterwarnings("ignore")
 
 from .utils import helpers
 from .utils.sam import Sam_Predictor
+from .utils.model_registry import ModelRegistry
+from .utils.nms import nms
+from .utils.detection_cache import DetectionCache, RawDetections, image_key
+from .utils.tiling import tile_windows, merge_tiles
 
 
 coco_classes = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light',
@@ -41,6 +50,7 @@ coco_classes = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'tr
                 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard',
                 'cell phone', 'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase',
                 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
+coco_class_ids = {label: i for i, label in enumerate(coco_classes)}
 # make a list of 12 unique colors as we will use them to draw bounding boxes of different classes in different colors
 # so the calor palette will be used to draw bounding boxes of different classes in different colors
 # the color pallette should have the famous 12 colors as red, green, blue, yellow, cyan, magenta, white, black, gray, brown, pink, and orange in bgr format
@@ -65,41 +75,114 @@ color_palette = [(75, 25, 230),
 class IntelligenceWorker(QThread):
     sinOut = pyqtSignal(int, int)
 
-    def __init__(self, parent, images, source,multi_model_flag=False):
+    def __init__(self, parent, images, source,multi_model_flag=False, max_batch_size=8, store_data=True):
         super(IntelligenceWorker, self).__init__(parent)
         self.parent = parent
         self.source = source
         self.images = images
         self.multi_model_flag = multi_model_flag
+        # embed the image data in the label files (the "Save With Image Data" option of the app)
+        self.store_data = store_data
+        self.max_batch_size = max_batch_size
         self.notif = []
 
-    def run(self):
-        index = 0
-        total = len(self.images)
-        for filename in self.images:
-
-            if self.parent.isVisible == False:
-                return
-            if self.source.operationCanceled == True:
-                return
-            index = index + 1
-            json_name = osp.splitext(filename)[0] + ".json"
-            # if os.path.exists(json_name)==False:
-
-            if os.path.isdir(json_name):
-                os.remove(json_name)
+    def detect_one_safe(self, filename):
+        try:
+            return self.source.detect_one(filename, multi_model_flag=self.multi_model_flag)
+        except Exception as e:
+            print(e)
+            return None
 
+    def save_one(self, filename, detections):
+        # polygonization and saving of one image of a batch (runs in the thread pool)
+        json_name = osp.splitext(filename)[0] + ".json"
+        if os.path.isdir(json_name):
+            os.remove(json_name)
+        s = self.source.shapes_of_detections(detections)
+        # without the image data, the label file references the image and its size is the size of the decoded image
+        self.source.saveLabelFile(filename, s, image_shape=self.source.image_shape_of_detections(detections),
+                                  store_data=self.store_data)
+
+    def wait_saved(self, pending, done, total):
+        # wait for the label files of a batch to be saved, then report the progress
+        futures, index = pending
+        for future in futures:
             try:
-                print("Decoding "+filename)
-                if self.multi_model_flag:
-                    s = self.source.get_shapes_of_one(filename, multi_model_flag=True)
-                else:
-                    s = self.source.get_shapes_of_one(filename)
-                s = convert_shapes_to_qt_shapes(s)
-                self.source.saveLabelFile(filename, s)
+                future.result()
             except Exception as e:
                 print(e)
-            self.sinOut.emit(index, total)
+        for i in range(done, index):
+            self.sinOut.emit(i + 1, total)
+        return max(done, index)
+
+    def run(self):
+        index = 0
+        total = len(self.images)
+        batch_size = batch_size_for_memory(self.max_batch_size)
+        start_time = time.time()
+        # the saving of the previous batch (futures, index after it) and the number of images done
+        pending = ([], 0)
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+            while index < total:
+                if self.parent.isVisible == False:
+                    return
+                if self.source.operationCanceled == True:
+                    return
+                batch = self.images[index:index + batch_size]
+                print(f"Decoding {len(batch)} images from {batch[0]}")
+                try:
+                    batch_detections = self.source.detect_batch(batch, multi_model_flag=self.multi_model_flag)
+                except Exception as e:
+                    if is_out_of_memory(e) and batch_size > 1:
+                        # retry the same images with a smaller batch
+                        batch_size = max(1, batch_size // 2)
+                        torch.cuda.empty_cache()
+                        print(f"out of memory, the batch size is reduced to {batch_size}")
+                        continue
+                    # one unreadable image fails the whole batch, so annotate its images one by one
+                    print(e)
+                    batch_detections = [self.detect_one_safe(filename) for filename in batch]
+
+                # one forward pass per batch, then the polygonization and saving fan out per image on the writer pool,
+                # and the next batch runs through the model while the images of this batch are saved
+                futures = [executor.submit(self.save_one, filename, detections)
+                           for filename, detections in zip(batch, batch_detections) if detections is not None]
+                index = index + len(batch)
+                done = self.wait_saved(pending, done, total)
+                pending = (futures, index)
+            self.wait_saved(pending, done, total)
+        print(f"annotated {total} images in {time.time() - start_time:.2f} s (batch size {batch_size})")
+
+
+def is_out_of_memory(error):
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+def batch_size_for_memory(max_batch_size=8, image_memory_mb=512):
+
+    """
+    Summary:
+        Choose the batch size of the batch annotation from the free memory (GPU memory if CUDA is used).
+
+    Args:
+        max_batch_size: the maximum batch size (default: 8)
+        image_memory_mb: the estimated memory of one image in a forward pass in MB (default: 512)
+
+    Returns:
+        batch_size: a batch size between 1 and max_batch_size
+    """
+
+    try:
+        if torch.cuda.is_available():
+            free_memory, _ = torch.cuda.mem_get_info()
+        else:
+            import psutil
+            free_memory = psutil.virtual_memory().available
+    except Exception:
+        return 1
+    # keep half of the free memory for the models and the rest of the app
+    return max(1, min(max_batch_size, int(free_memory / 2 / (image_memory_mb * 1024 * 1024))))
 
 
 def convert_shapes_to_qt_shapes(shapes):
@@ -150,8 +233,37 @@ class Intelligence():
             self.selectedclasses = {i:class_ for i,class_ in enumerate(coco_classes)}
             print("error in loading the default classes from the config file, so we will use all the coco classes")
         self.selectedmodels = []
+        # the loaded models are kept (up to the memory budget) so switching or merging models does not load them again
+        self.models = ModelRegistry(self.config.get("model_cache_mb", 4096))
+        self.reader.fusion_strategy = self.config.get("model_fusion_strategy", "union")
+        # the raw outputs of the models, so changing the thresholds or the classes does not run the models again
+        self.detection_cache = DetectionCache(self.config.get("detection_cache_mb", 512))
+        # large images are cut into overlapping tiles that are run in batches
+        self.tiled_inference = self.config.get("tiled_inference", False)
+        self.tile_size = self.config.get("tile_size", 1024)
+        self.tile_overlap = self.config.get("tile_overlap", 0.2)
+        # the models are shared with the snapshots of the worker threads, one inference runs at a time
+        # (the thresholds and classes of an inference are set on the model itself, see set_test_cfg)
+        self.inference_lock = threading.Lock()
         self.current_model_name, self.current_mm_model = self.make_mm_model("")
 
+    def snapshot(self):
+
+        """
+        Summary:
+            Copy the model settings (the current model, the selected models and classes, the thresholds) for a worker thread,
+            so changing them from the menus while the worker runs does not change its detections.
+            The copy shares the loaded models, the detection cache and the inference lock.
+
+        Returns:
+            intelligence: a shallow copy of the Intelligence object
+        """
+
+        intelligence = copy.copy(self)
+        intelligence.selectedclasses = dict(self.selectedclasses)
+        intelligence.selectedmodels = list(self.selectedmodels)
+        return intelligence
+
     @torch.no_grad()
     def make_mm_model(self, selected_model_name):
         try:
@@ -172,20 +284,19 @@ class Intelligence():
             return
 
 
-        torch.cuda.empty_cache()
+        device = "cuda" if torch.cuda.is_available() else "cpu"
         if "YOLOv8" in selected_model_name:
-            model = YOLO(checkpoint)
-            model.fuse()
+            model = self.models.get((None, checkpoint, device), lambda: self.load_yolo_model(checkpoint))
             return selected_model_name, model
 
         try:
             print(f"From the working one: {config}")
-            model = init_detector(config,
-                                  checkpoint,
-                                  device=torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+            model = self.models.get((config, checkpoint, device),
+                                    lambda: init_detector(config, checkpoint, device=torch.device(device)))
         except:
             print(
                 "Error in loading the model, please check if the config and checkpoint files do exist")
+            raise
 
             #    cfg_options= dict(iou_threshold=0.2))
 
@@ -194,17 +305,21 @@ class Intelligence():
             # "C:/Users/Shehab/Desktop/mmdetection/mmdetection/checkpoints/htc_r50_sac_1x_coco-bfa60c54.pth", device = torch.device("cuda"))
         return selected_model_name, model
 
+    def load_yolo_model(self, checkpoint):
+        model = YOLO(checkpoint)
+        model.fuse()
+        return model
+
     @ torch.no_grad()
     def make_mm_model_more(self, selected_model_name, config, checkpoint, device = None):
-        torch.cuda.empty_cache()
         print(
             f"Selected model is {selected_model_name}\n and config is {config}\n and checkpoint is {checkpoint}")
+        mm_device = "cuda" if torch.cuda.is_available() else "cpu"
 
         # if YOLOv8
         if "YOLOv8" in selected_model_name:
             try:
-                model = YOLO(checkpoint)
-                model.fuse()
+                model = self.models.get((None, checkpoint, mm_device), lambda: self.load_yolo_model(checkpoint))
                 return selected_model_name, model
             except Exception as e:
                 helpers.OKmsgBox("Error", f"Error in loading the model\n{e}", "critical")
@@ -215,7 +330,8 @@ class Intelligence():
             try:
                 # make "ViT-L SAM model-L" to "vit_l"
                 model_type = selected_model_name.lower().replace("-", "_").split(" ")[0]
-                model = Sam_Predictor(model_type, checkpoint, device)
+                model = self.models.get((model_type, checkpoint, str(device)),
+                                        lambda: Sam_Predictor(model_type, checkpoint, device))
                 return selected_model_name, model
             except Exception as e:
                 helpers.OKmsgBox("Error", f"Error in loading the model\n{e}", "critical")
@@ -225,8 +341,8 @@ class Intelligence():
         else:
             try:
                 print(f"From the new one: {config}")
-                model = init_detector(config, checkpoint, device=torch.device(
-                    "cuda" if torch.cuda.is_available() else "cpu"))
+                model = self.models.get((config, checkpoint, mm_device),
+                                        lambda: init_detector(config, checkpoint, device=torch.device(mm_device)))
             except Exception as e:
                 helpers.OKmsgBox
                 helpers.OKmsgBox("Error", f"Error in loading the model\n{e}", "critical")
@@ -245,56 +361,215 @@ class Intelligence():
         bbox = [min(x), min(y), max(x), max(y)]
         return bbox
 
-    def get_shapes_of_one(self, image, img_array_flag=False, multi_model_flag=False):
-        # print(f"Threshold is {self.conf_threshold}")
-        # results = self.reader.decode_file(img_path = filename, threshold = self.conf_threshold , selected_model_name = self.current_model_name)["results"]
+    def get_shapes_of_one(self, image, img_array_flag=False, multi_model_flag=False, cache_key=None):
+        detections = self.detect_one(image, img_array_flag, multi_model_flag, cache_key)
+        return self.shapes_of_detections(detections)
+
+    def raw_detections(self, keys, model_name, images, threshold, model=None):
+
+        """
+        Summary:
+            Get the raw detections of a model on images from the detection cache, running the model only on the images that are not cached.
+
+        Args:
+            keys: a list of the cache keys of the images (see image_key)
+            model_name: the name of the model
+            images: a list of images (paths or numpy arrays)
+            threshold: the confidence threshold of the model (the model runs with it and the selected classes, see decode_file_raw)
+            model: the loaded model (default: None -> loaded with make_mm_model if an image is not cached)
+
+        Returns:
+            raws: a list of RawDetections
+        """
+
+        # the large images are run tile by tile in tiled inference mode (cached apart from the whole image detections)
+        windows = [self.tiles_of(image) for image in images]
+        keys = [key if tiles is None else (key, "tiles", self.tile_size, self.tile_overlap) for key, tiles in zip(keys, windows)]
+        raws = [self.detection_cache.get((key, model_name)) for key in keys]
+        missing = [i for i, raw in enumerate(raws) if raw is None or not raw.covers(self.selectedclasses, threshold)]
+        if len(missing) == 0:
+            return raws
+        with self.inference_lock:
+            if model is None:
+                self.current_model_name, self.current_mm_model = self.make_mm_model(model_name)
+                model = self.current_mm_model
+            tiled = [i for i in missing if windows[i] is not None]
+            whole = [i for i in missing if windows[i] is None]
+            decoded = [self.reader.decode_tiled_raw(images[i], model, windows[i], self.selectedclasses, threshold) for i in tiled]
+            if len(whole) == 1:
+                decoded += [self.reader.decode_file_raw(images[whole[0]], model, self.selectedclasses, threshold)]
+            elif len(whole) > 1:
+                decoded += self.reader.decode_batch_raw([images[i] for i in whole], model, self.selectedclasses, threshold)
+        for i, raw in zip(tiled + whole, decoded):
+            self.detection_cache.put((keys[i], model_name), raw)
+            raws[i] = raw
+        return raws
+
+    def tiles_of(self, image):
+
+        """
+        Summary:
+            Get the tiles of an image in tiled inference mode.
+
+        Args:
+            image: a path or a numpy array
+
+        Returns:
+            windows: the windows of the tiles (see tile_windows), None if the image is run whole
+        """
+
+        if not self.tiled_inference:
+            return None
+        if isinstance(image, str):
+            with PIL.Image.open(image) as pil_image:
+                width, height = pil_image.size
+        else:
+            height, width = image.shape[:2]
+        if max(height, width) <= self.tile_size:
+            return None
+        return tile_windows((height, width), self.tile_size, self.tile_overlap)
+
+    def sam_tiled_shapes(self, image, windows):
+
+        """
+        Summary:
+            Run SAM automatic mode on the tiles of a large image and merge the shapes of the tiles (see utils.tiling).
+
+        Args:
+            image: a path or a numpy array
+            windows: the windows of the tiles (see tile_windows)
+
+        Returns:
+            shapes: a list of shapes
+        """
+
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        tile_raws = []
+        for x0, y0, x1, y1 in windows:
+            tile_shapes = self.current_mm_model.get_all_shapes(np.ascontiguousarray(image[y0:y1, x0:x1]), self.iou_threshold)
+            polygons = [np.asarray(shape["points"], dtype=int).reshape(-1, 2) for shape in tile_shapes]
+            boxes = [np.concatenate([polygon.min(axis=0), polygon.max(axis=0)]) for polygon in polygons]
+            scores = [float(shape["content"]) for shape in tile_shapes]
+            tile_raws.append(RawDetections(np.array(boxes).reshape(-1, 4), scores, np.zeros(len(scores)),
+                                           (y1 - y0, x1 - x0), polygons=polygons))
+        raw = merge_tiles(tile_raws, windows, image.shape[:2])
+        polygons = [raw.polygon(i) for i in range(len(raw))]
+        return [self.current_mm_model.polygon_to_shape(polygon, raw.scores[i], f'X{i}')
+                for i, polygon in enumerate(polygons) if len(polygon) >= 3]
+
+    def detect_one(self, image, img_array_flag=False, multi_model_flag=False, cache_key=None):
+        
+        """
+        Summary:
+            Run the model(s) on an image without converting the masks to polygons.
+            It is the first half of get_shapes_of_one, so the tracking pipeline can run the detection of a frame
+            while the masks of the previous frame are converted to polygons.
+            The raw detections are cached, so running again with other thresholds or classes does not run the model again.
+            
+        Args:
+            image: the image (path or numpy array)
+            img_array_flag: True if the image is a numpy array
+            multi_model_flag: True to merge the masks of the selected models
+            cache_key: the key of the image in the detection cache (default: None -> computed from the image, see image_key)
+            
+        Returns:
+            detections: a dictionary with one of the keys
+                "shapes" (SAM, already shapes), "raw" (model name -> (RawDetections, confidence threshold))
+        """
+        
         start_time = time.time()
-        # if img_array_flag is true then the image is a numpy array and not a path
         if multi_model_flag:
             # to handle the case of the user selecting no models
             if len(self.selectedmodels) == 0:
-                return []
-            self.reader.annotating_models.clear()
-            for model_name,model_threshold in self.selectedmodels:
-                #print(f"Annotating on {model_name} with threshold {model_threshold}")
-                self.current_model_name, self.current_mm_model = self.make_mm_model(
-                    model_name)
-                if img_array_flag:
-                    results0, results1 = self.reader.decode_file(
-                        img=image, model=self.current_mm_model, classdict=self.selectedclasses, threshold=model_threshold, img_array_flag=True)
-                else:
-                    results0, results1 = self.reader.decode_file(
-                        img=image, model=self.current_mm_model, classdict=self.selectedclasses, threshold=model_threshold)
-                
-                self.reader.annotating_models[model_name] = [results0, results1]
-                end_time = time.time()
-                print(
-                    f"Time taken to annoatate img on {self.current_model_name}: {int((end_time - start_time)*1000)} ms" + "\n")
-            
-            print('merging masks')
-            results0, results1 = self.reader.merge_masks()
-            results = self.reader.polegonise(
-                results0, results1, classdict=self.selectedclasses)['results']
+                return {"shapes": []}
+            key = cache_key if cache_key is not None else image_key(image)
+            raws = {}
+            for model_name, model_threshold in self.selectedmodels:
+                raws[model_name] = (self.raw_detections([key], model_name, [image], model_threshold)[0], model_threshold)
+            print(f"Time taken to annoatate img on {len(raws)} models: {int((time.time() - start_time)*1000)} ms")
+            return {"raw": raws, "multi_model": True}
+
+        if "SAM" in self.current_model_name:
+            windows = self.tiles_of(image)
+            if windows is not None:
+                shapes = self.sam_tiled_shapes(image, windows)
+            else:
+                shapes = self.current_mm_model.get_all_shapes(image, self.iou_threshold)
+            end_time = time.time()
+            print(f"Time taken to annoatate img on {self.current_model_name}: {int((end_time - start_time)*1000)} ms")
+            return {"shapes": shapes}
 
-        else:
+        key = cache_key if cache_key is not None else image_key(image)
+        model_name = self.current_model_name
+        raw = self.raw_detections([key], model_name, [image], self.conf_threshold, self.current_mm_model)[0]
+        print(f"Time taken to annoatate img on {model_name}: {int((time.time() - start_time)*1000)} ms")
+        return {"raw": {model_name: (raw, self.conf_threshold)}, "multi_model": False}
+
+    def detect_batch(self, images, multi_model_flag=False, cache_keys=None):
+        
+        """
+        Summary:
+            Run the model(s) on a batch of images with one forward pass per model (batched detect_one).
+            Only the images that are not in the detection cache are run.
+            SAM models do not support batches, they run image by image.
             
-            if "SAM" in self.current_model_name:
-                shapes = self.current_mm_model.get_all_shapes(image, self.iou_threshold)
-                end_time = time.time()
-                print(f"Time taken to annoatate img on {self.current_model_name}: {int((end_time - start_time)*1000)} ms")
-                return shapes
+        Args:
+            images: a list of images (paths or numpy arrays)
+            multi_model_flag: True to merge the masks of the selected models
+            cache_keys: the keys of the images in the detection cache (default: None -> computed from the images, see image_key)
             
-            results = self.reader.decode_file(
-                img=image, model=self.current_mm_model, classdict=self.selectedclasses, threshold=self.conf_threshold, img_array_flag=img_array_flag)
-            # print(type(results))
-            if isinstance(results, tuple):
-                results = self.reader.polegonise(
-                    results[0], results[1], classdict=self.selectedclasses)['results']
-            else:
-                results = results['results']
+        Returns:
+            detections: a list with the output of detect_one for each image
+        """
+        
+        start_time = time.time()
+        if multi_model_flag:
+            if len(self.selectedmodels) == 0:
+                return [{"shapes": []} for _ in images]
+            models = self.selectedmodels
+        elif "SAM" in self.current_model_name:
+            return [self.detect_one(image, cache_key=None if cache_keys is None else cache_keys[i])
+                    for i, image in enumerate(images)]
+        else:
+            models = [(self.current_model_name, self.conf_threshold)]
+
+        keys = cache_keys if cache_keys is not None else [image_key(image) for image in images]
+        detections = [{"raw": {}, "multi_model": multi_model_flag} for _ in images]
+        for model_name, model_threshold in models:
+            model = None if multi_model_flag else self.current_mm_model
+            for detection, raw in zip(detections, self.raw_detections(keys, model_name, images, model_threshold, model)):
+                detection["raw"][model_name] = (raw, model_threshold)
+        end_time = time.time()
+        print(f"Time taken to annoatate {len(images)} images on {len(models)} model(s): {int((end_time - start_time)*1000)} ms")
+        return detections
+
+    def shapes_of_detections(self, detections):
+        
+        """
+        Summary:
+            Convert the output of detect_one to shapes (filter the raw detections with the selected classes and thresholds,
+            masks to polygons, then NMS). It is the second half of get_shapes_of_one.
             
-            end_time = time.time()
-            print(f"Time taken to annoatate img on {self.current_model_name}: {int((end_time - start_time)*1000)} ms")
+        Args:
+            detections: the output of detect_one
+            
+        Returns:
+            shapes: a list of shapes
+        """
+        
+        if "shapes" in detections:
+            return detections["shapes"]
+        if detections.get("multi_model"):
+            results0, results1 = self.reader.merge_masks({
+                model_name: raw.class_masks(self.selectedclasses, threshold)
+                for model_name, (raw, threshold) in detections["raw"].items()})
+            results = self.reader.polegonise(
+                results0, results1, classdict=self.selectedclasses)['results']
+        else:
+            results = []
+            for raw, threshold in detections["raw"].values():
+                results += raw.results(self.selectedclasses, threshold)
 
         shapes = []
         for result in results:
@@ -376,57 +651,47 @@ class Intelligence():
 
         return iou
 
-    def OURnms(self, shapes, iou_threshold=0.5):
+    def OURnms(self, shapes, iou_threshold=0.5, class_aware=False, mask_iou=False):
         """
         Perform non-maximum suppression on a list of shapes based on their bounding boxes using IOU threshold.
+        The IoU of all the pairs is computed at once (see utils.nms), the points of the shapes are parsed once.
 
         Args:
-            shapes (list): List of shapes, each shape is a dictionary with keys (bbox, confidence, class_id)
+            shapes (list): List of shapes, each shape is a dictionary with keys (points, content, label)
             iou_threshold (float): IOU threshold for non-maximum suppression.
+            class_aware (bool): only suppress shapes of the same label (default: False -> class agnostic)
+            mask_iou (bool): use the IoU of the polygons instead of the IoU of their boxes (default: False)
 
         Returns:
-            list: List of shapes after performing non-maximum suppression, each shape is a dictionary with keys (bbox, confidence, class_id)
+            shapes (list): List of the kept shapes sorted by confidence
+            boxes (np.ndarray): (n, 4) boxes (xmin, ymin, xmax, ymax) of the kept shapes
+            confidences (np.ndarray): (n,) confidences of the kept shapes
+            class_ids (np.ndarray): (n,) coco class ids of the kept shapes (-1 if the label is not a coco class)
+            segments (list): List of the segments of the kept shapes, each segment is a list of [x, y] points
         """
-        iou_threshold = float(iou_threshold)
         for shape in shapes:
             if shape['content'] is None:
                 shape['content'] = 1.0
 
-        # Sort shapes by their confidence
-        shapes.sort(key=lambda x: x['content'], reverse=True)
-
-        boxes, confidences, class_ids, segments = self.get_boxes_conf_classids_segments(
-            shapes)
-
-        toBeRemoved = []
-
-        # Loop through each shape
-        for i in range(len(shapes)):
-            shape_bbox = boxes[i]
-            # Loop through each remaining shape
-            for j in range(i + 1, len(shapes)):
-                remaining_shape_bbox = boxes[j]
-
-                # Compute IOU between shape and remaining_shape
-                iou = self.compute_iou(shape_bbox, remaining_shape_bbox)
-
-                # If IOU is greater than threshold, remove remaining_shape from shapes list
-                if iou > iou_threshold:
-                    toBeRemoved.append(j)
-
-        shapesFinal = []
-        boxesFinal = []
-        confidencesFinal = []
-        class_idsFinal = []
-        segmentsFinal = []
-        for i in range(len(shapes)):
-            if i in toBeRemoved:
-                continue
-            shapesFinal.append(shapes[i])
-        boxesFinal, confidencesFinal, class_idsFinal, segmentsFinal = self.get_boxes_conf_classids_segments(
-            shapesFinal)
-
-        return shapesFinal, boxesFinal, confidencesFinal, class_idsFinal, segmentsFinal
+        segments = []
+        boxes = np.zeros((len(shapes), 4))
+        for i, shape in enumerate(shapes):
+            # points are one dimensional array of x1,y1,x2,y2,x3,y3,x4,y4
+            segment = np.asarray(shape["points"], dtype=float).astype(int).reshape(-1, 2)
+            if len(segment) > 0:
+                boxes[i, :2] = segment.min(axis=0)
+                boxes[i, 2:] = segment.max(axis=0)
+            segments.append(segment.tolist())
+        confidences = np.array([float(shape['content']) for shape in shapes])
+        class_ids = np.array([coco_class_ids.get(shape["label"], -1) for shape in shapes], dtype=int)
+        labels = [shape["label"] for shape in shapes]
+
+        keep = nms(boxes, confidences, iou_threshold,
+                   class_ids=np.unique(labels, return_inverse=True)[1] if class_aware and len(shapes) else None,
+                   segments=segments if mask_iou else None)
+
+        return ([shapes[i] for i in keep], boxes[keep], confidences[keep], class_ids[keep],
+                [segments[i] for i in keep])
 
     # print the labels of the selected classes in the dialog
     # def updatlabellist(self):
@@ -440,9 +705,9 @@ class Intelligence():
     #         mainwindow = self.parent
     #         mainwindow.addLabel(shape)
 
-    def get_shapes_of_batch(self, images, multi_model_flag=False, notif = []):
+    def get_shapes_of_batch(self, images, multi_model_flag=False, notif = [], store_data=True):
         self.pd = self.startOperationDialog()
-        self.thread = IntelligenceWorker(self.parent, images, self, multi_model_flag)
+        self.thread = IntelligenceWorker(self.parent, images, self, multi_model_flag, store_data=store_data)
         self.thread.sinOut.connect(self.updateDialog)
         self.thread.start()
         self.notif = notif
@@ -776,25 +1041,28 @@ class Intelligence():
         verticalLayout.addWidget(buttonBox)
         buttonBox.accepted.connect(dialog.accept)
         buttonBox.rejected.connect(dialog.reject)
-        self.models = []
+        self.models_checkboxes = []
         self.thresholds = []
         for i in range(len(models)):
             model_layout = QtWidgets.QHBoxLayout()
-            self.models.append(QtWidgets.QCheckBox(models[i], dialog))
+            self.models_checkboxes.append(QtWidgets.QCheckBox(models[i], dialog))
             self.thresholds.append(QtWidgets.QDoubleSpinBox(dialog))
             self.thresholds[i].setRange(0, 1)
             self.thresholds[i].setSingleStep(0.01)
             self.thresholds[i].setValue(0.5)
-            model_layout.addWidget(self.models[i])
+            model_layout.addWidget(self.models_checkboxes[i])
             model_layout.addWidget(self.thresholds[i])
             verticalLayout_2.addLayout(model_layout)
         dialog.show()
         dialog.exec_()
         self.selectedmodels.clear()
-        for i in range(len(self.models)):
-            if self.models[i].isChecked():
-                self.selectedmodels.append((self.models[i].text(),self.thresholds[i].value()))
+        for i in range(len(self.models_checkboxes)):
+            if self.models_checkboxes[i].isChecked():
+                self.selectedmodels.append((self.models_checkboxes[i].text(),self.thresholds[i].value()))
         #print(self.selectedmodels)
+        # load the selected models once, annotating reuses them from the registry
+        for model_name, _ in self.selectedmodels:
+            self.make_mm_model(model_name)
         return self.selectedmodels
 
     def updateDialog(self, completed, total):
@@ -839,10 +1107,44 @@ class Intelligence():
     def clear_annotating_models(self):
         self.reader.annotating_models.clear()
 
-    def saveLabelFile(self, filename, detectedShapes):
+    def image_shape_of_detections(self, detections):
+        # the (height, width) of the decoded image the raw detections come from (None if none of them knows it)
+        for raw, _ in detections.get("raw", {}).values():
+            if min(raw.image_shape) > 0:
+                return raw.image_shape
+        return None
+
+    def saveLabelFile(self, filename, detectedShapes, image_shape=None, store_data=True):
+
+        """
+        Summary:
+            Save the label file of an image.
+            Without the image data, the label file only references the image (imagePath), so the image is not
+            read again, re-encoded or base64 encoded, and its size is taken from the decoded image (or its header).
+
+        Args:
+            filename: the path of the image
+            detectedShapes: a list of Qt shapes, or of shape dictionaries (see shapes_of_detections)
+            image_shape: the (height, width) of the decoded image (default: None -> read from the image)
+            store_data: embed the image data in the label file (default: True)
+
+        Returns:
+            None
+        """
+
         lf = LabelFile()
 
         def format_shape(s):
+            if isinstance(s, dict):
+                return dict(
+                    label=s["label"],
+                    points=np.array(s["points"], np.uint16).tolist(),
+                    bbox=[int(v) for v in s.get("bbox") or []],
+                    group_id=s["group_id"],
+                    content=s["content"],
+                    shape_type=s["shape_type"],
+                    flags=s.get("flags") or {},
+                )
             data = s.other_data.copy()
             data.update(
                 dict(
@@ -857,10 +1159,16 @@ class Intelligence():
             )
             return data
 
-        shapes = [format_shape(item) for item in detectedShapes]
+        # skip point-empty shapes
+        shapes = [format_shape(item) for item in detectedShapes if not isinstance(item, dict) or item["points"]]
 
-        imageData = LabelFile.load_image_file(filename)
-        image = QtGui.QImage.fromData(imageData)
+        if store_data:
+            imageData = LabelFile.load_image_file(filename)
+            image = QtGui.QImage.fromData(imageData)
+            imageHeight, imageWidth = image.height(), image.width()
+        else:
+            imageData = None
+            imageHeight, imageWidth = image_shape[:2] if image_shape is not None else LabelFile.image_size(filename)
         if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
             os.makedirs(osp.dirname(filename))
         json_name = osp.splitext(filename)[0] + ".json"
@@ -870,8 +1178,8 @@ class Intelligence():
             shapes=shapes,
             imagePath=imagePath,
             imageData=imageData,
-            imageHeight=image.height(),
-            imageWidth=image.width(),
+            imageHeight=int(imageHeight),
+            imageWidth=int(imageWidth),
             otherData={},
             flags={},
         )
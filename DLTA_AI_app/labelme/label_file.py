@@ -4,6 +4,8 @@ import io
 import json
 import os.path as osp
 
+import numpy as np
+import orjson
 import PIL.Image
 
 from labelme import __version__
@@ -40,10 +42,22 @@ class LabelFile(object):
         self.shapes = []
         self.imagePath = None
         self.imageData = None
+        # the image of a label file that only references it, read on first use of imageData
+        self._imageFile = None
         if filename is not None:
             self.load(filename)
         self.filename = filename
 
+    @property
+    def imageData(self):
+        if self._imageData is None and self._imageFile is not None:
+            self._imageData = self.load_image_file(self._imageFile)
+        return self._imageData
+
+    @imageData.setter
+    def imageData(self, imageData):
+        self._imageData = imageData
+
     @staticmethod
     def load_image_file(filename):
         try:
@@ -67,6 +81,56 @@ class LabelFile(object):
             f.seek(0)
             return f.read()
 
+    @staticmethod
+    def load_image_array(filename, exif_orientation=True):
+        # decode an image once to an RGB (RGBA if it has transparency) array,
+        # None if it cannot be read or is not 8 bits (the encoded image is used instead)
+        # exif_orientation: False for the image data of a label file, it is shown and validated as it is stored
+        try:
+            image_pil = PIL.Image.open(filename)
+            if exif_orientation:
+                image_pil = utils.apply_exif_orientation(image_pil)
+            if image_pil.mode in ["RGBA", "LA", "PA"] or (
+                image_pil.mode == "P" and "transparency" in image_pil.info
+            ):
+                image_pil = image_pil.convert("RGBA")
+            elif image_pil.mode in ["1", "L", "P", "RGB", "CMYK", "YCbCr"]:
+                image_pil = image_pil.convert("RGB")
+            else:
+                return None
+            return np.asarray(image_pil)
+        except IOError:
+            logger.error("Failed opening image file: {}".format(filename))
+            return None
+
+    def image_array(self):
+        # the decoded image of the label file (see load_image_array)
+        if self._imageData is not None:
+            return self.load_image_array(io.BytesIO(self._imageData), exif_orientation=False)
+        return self.load_image_array(self._imageFile)
+
+    @staticmethod
+    def image_size(filename, exif_orientation=True):
+        # the (height, width) of an image read from its header without decoding it,
+        # after its exif orientation with the rule of utils.apply_exif_orientation if exif_orientation
+        try:
+            with PIL.Image.open(filename) as image_pil:
+                width, height = image_pil.size
+                orientation = None
+                if exif_orientation:
+                    try:
+                        exif = image_pil._getexif()
+                    except AttributeError:
+                        exif = None
+                    orientation = exif.get(0x0112) if exif else None
+        except IOError:
+            logger.error("Failed opening image file: {}".format(filename))
+            return None
+        if orientation in [5, 6, 7, 8]:
+            # transposed or rotated by 90 degrees
+            width, height = height, width
+        return height, width
+
     def load(self, filename):
         keys = [
             "version",
@@ -105,18 +169,22 @@ class LabelFile(object):
                     )
                 )
 
+            # the image is validated from its header, it is only decoded when it is used
+            imageFile = None
             if data["imageData"] is not None:
                 imageData = base64.b64decode(data["imageData"])
                 if PY2 and QT4:
                     imageData = utils.img_data_to_png_data(imageData)
+                image_size = self.image_size(io.BytesIO(imageData), exif_orientation=False)
             else:
                 # relative path from label file to relative path from cwd
-                imagePath = osp.join(osp.dirname(filename), data["imagePath"])
-                imageData = self.load_image_file(imagePath)
+                imageFile = osp.join(osp.dirname(filename), data["imagePath"])
+                imageData = None
+                image_size = self.image_size(imageFile)
             flags = data.get("flags") or {}
             imagePath = data["imagePath"]
             self._check_image_height_and_width(
-                base64.b64encode(imageData).decode("utf-8"),
+                image_size,
                 data.get("imageHeight"),
                 data.get("imageWidth"),
             )
@@ -148,24 +216,27 @@ class LabelFile(object):
         self.shapes = shapes
         self.imagePath = imagePath
         self.imageData = imageData
+        self._imageFile = imageFile
         self.filename = filename
         self.otherData = otherData
 
     @staticmethod
-    def _check_image_height_and_width(imageData, imageHeight, imageWidth):
-        img_arr = utils.img_b64_to_arr(imageData)
-        if imageHeight is not None and img_arr.shape[0] != imageHeight:
+    def _check_image_height_and_width(image_size, imageHeight, imageWidth):
+        # image_size: the (height, width) of the image (see image_size)
+        if image_size is None:
+            raise IOError("Failed reading the size of the image")
+        if imageHeight is not None and image_size[0] != imageHeight:
             logger.error(
                 "imageHeight does not match with imageData or imagePath, "
                 "so getting imageHeight from actual image."
             )
-            imageHeight = img_arr.shape[0]
-        if imageWidth is not None and img_arr.shape[1] != imageWidth:
+            imageHeight = image_size[0]
+        if imageWidth is not None and image_size[1] != imageWidth:
             logger.error(
                 "imageWidth does not match with imageData or imagePath, "
                 "so getting imageWidth from actual image."
             )
-            imageWidth = img_arr.shape[1]
+            imageWidth = image_size[1]
         return imageHeight, imageWidth
 
     def save(
@@ -180,10 +251,10 @@ class LabelFile(object):
         flags=None,
     ):
         if imageData is not None:
-            imageData = base64.b64encode(imageData).decode("utf-8")
             imageHeight, imageWidth = self._check_image_height_and_width(
-                imageData, imageHeight, imageWidth
+                self.image_size(io.BytesIO(imageData), exif_orientation=False), imageHeight, imageWidth
             )
+            imageData = base64.b64encode(imageData).decode("utf-8")
         if otherData is None:
             otherData = {}
         if flags is None:
@@ -201,8 +272,11 @@ class LabelFile(object):
             assert key not in data
             data[key] = value
         try:
-            with open(filename, "w") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with io.open(filename, "wb") as f:
+                f.write(orjson.dumps(
+                    data,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+                ))
             self.filename = filename
         except Exception as e:
             raise LabelFileError(e)
@@ -0,0 +1,358 @@
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+from qtpy.QtCore import QThread
+from qtpy.QtCore import Signal as pyqtSignal
+from shapely.geometry import Polygon
+from supervision.detection.core import Detections
+
+from .intelligence import coco_classes
+from .logger import logger
+from .utils import helpers
+from .utils.detection_cache import image_key
+
+
+# the item a stage puts in its output queue when its input is exhausted (or the tracking is cancelled)
+END = None
+
+
+class TrackingWorker(QThread):
+
+    """
+    Summary:
+        Track objects over a range of video frames off the GUI thread.
+        The work is split into stages connected by bounded queues, each stage runs in its own thread
+        so decoding, detection, polygonization, tracking and persistence of consecutive frames overlap:
+
+            decode -> detect -> polygonize -> track -> persist
+
+        The tracker itself runs in the worker thread (it is sequential by nature).
+        Progress is reported through signals, the tracking can be paused, resumed and cancelled.
+    """
+
+    # (number of tracked frames, number of frames to track)
+    progress = pyqtSignal(int, int)
+    # (frame index, frame_data or None if nothing was detected), emitted once the frame is persisted
+    frameTracked = pyqtSignal(int, object)
+    # (last tracked frame index, frames per second)
+    trackingFinished = pyqtSignal(int, float)
+    trackingError = pyqtSignal(str)
+
+    def __init__(self, parent, video_path, json_file_name, nTotalFrames, start_frame, nFrames,
+                 intelligenceHelper, tracker, multi_model_flag=False, first_frame_shapes=None,
+                 tracks_to_follow=None, area_polygon=None, id_offset=0, keyframe_index=None, queue_size=8, batch_size=4):
+
+        """
+        Summary:
+            Create a tracking worker.
+
+        Args:
+            parent: the main window
+            video_path: the path of the video file
+            json_file_name: the name of the json results file of the video (the frames are saved to its frame journal)
+            nTotalFrames: the total number of frames of the video
+            start_frame: the first frame to track (starts from 1)
+            nFrames: the number of frames to track
+            intelligenceHelper: the Intelligence object that runs the models (a snapshot, see Intelligence.snapshot,
+                                so the models and classes selected from the menus while tracking do not change it)
+            tracker: the tracker
+            multi_model_flag: True to merge the masks of the selected models
+            first_frame_shapes: shapes to use for the first frame instead of detecting (the existing annotation)
+            tracks_to_follow: only keep these tracker ids (default: None -> all), it is read for each frame so it can be changed while tracking
+            area_polygon: only keep the objects that intersect this polygon (default: None -> all)
+            id_offset: added to the tracker ids (the max id of the video)
+            keyframe_index: the KeyframeIndex of the video to seek to the first frame
+            queue_size: the size of the queues between stages
+            batch_size: the maximum number of decoded frames that run through the model in one forward pass
+        """
+
+        super(TrackingWorker, self).__init__(parent)
+        self.video_path = video_path
+        self.json_file_name = json_file_name
+        self.nTotalFrames = nTotalFrames
+        self.start_frame = start_frame
+        self.nFrames = nFrames
+        self.intelligenceHelper = intelligenceHelper
+        self.tracker = tracker
+        self.multi_model_flag = multi_model_flag
+        self.first_frame_shapes = first_frame_shapes
+        self.tracks_to_follow = tracks_to_follow
+        self.area_polygon = Polygon(area_polygon) if area_polygon is not None else None
+        self.id_offset = int(id_offset)
+        self.keyframe_index = keyframe_index
+        # the frames are cached by the detection cache under (video key, frame index), tracking again does not detect again
+        self.video_key = image_key(video_path)
+
+        self.batch_size = max(1, min(batch_size, queue_size))
+        self.decoded = queue.Queue(queue_size)
+        self.detected = queue.Queue(queue_size)
+        self.polygonized = queue.Queue(queue_size)
+        self.tracked = queue.Queue(queue_size)
+
+        self.cancelled = False
+        self.running = threading.Event()
+        self.running.set()
+        self.error = None
+        self.last_tracked_idx = start_frame - 1
+        self.last_persisted_idx = start_frame - 1
+
+    def cancel(self):
+        self.cancelled = True
+        self.running.set()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def is_paused(self):
+        return not self.running.is_set()
+
+    def _put(self, q, item):
+        while not self.cancelled:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.cancelled:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return END
+
+    def _put_tracked(self, item, persist_stage):
+        # a tracked frame is always handed to the persist stage, even if the tracking is cancelled (unless the stage failed)
+        while persist_stage.is_alive():
+            try:
+                self.tracked.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _stage(self, target, *args):
+        def run_stage():
+            try:
+                target(*args)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                self.cancel()
+        thread = threading.Thread(target=run_stage, daemon=True)
+        thread.start()
+        return thread
+
+    def _decode_stage(self):
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            # seek once to the keyframe before the first frame, then decode sequentially
+            if self.keyframe_index is not None:
+                keyframe_idx = self.keyframe_index.preceding(self.start_frame)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe_idx - 1)
+                for _ in range(self.start_frame - keyframe_idx):
+                    cap.grab()
+            else:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame - 1)
+            for frame_idx in range(self.start_frame, self.start_frame + self.nFrames):
+                self.running.wait()
+                if self.cancelled:
+                    break
+                success, frame = cap.read()
+                if not success:
+                    break
+                if not self._put(self.decoded, (frame_idx, frame)):
+                    break
+        finally:
+            cap.release()
+            self._put(self.decoded, END)
+
+    def _next_batch(self):
+        # the next decoded frame and the frames already waiting behind it (up to batch_size), ended is True after the last frame
+        item = self._get(self.decoded)
+        if item is END:
+            return [], True
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.decoded.get_nowait()
+            except queue.Empty:
+                break
+            if item is END:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _detect_stage(self):
+        ended = False
+        while not ended:
+            batch, ended = self._next_batch()
+            if len(batch) == 0:
+                break
+            # the frames already decoded are not run through the model while the tracking is paused
+            self.running.wait()
+            if self.cancelled:
+                break
+            detections = {}
+            if batch[0][0] == self.start_frame and self.first_frame_shapes is not None:
+                detections[self.start_frame] = {"shapes": self.first_frame_shapes}
+            # the frames of a batch run through the model in one forward pass
+            frames = [(frame_idx, frame) for frame_idx, frame in batch if frame_idx not in detections]
+            if len(frames) > 0:
+                with torch.no_grad():
+                    batch_detections = self.intelligenceHelper.detect_batch(
+                        [frame for _, frame in frames], multi_model_flag=self.multi_model_flag,
+                        cache_keys=[(self.video_key, frame_idx) for frame_idx, _ in frames])
+                detections.update(zip([frame_idx for frame_idx, _ in frames], batch_detections))
+            if not all(self._put(self.detected, (frame_idx, frame, detections[frame_idx])) for frame_idx, frame in batch):
+                break
+        self._put(self.detected, END)
+
+    def _polygonize_stage(self):
+        while True:
+            item = self._get(self.detected)
+            if item is END:
+                break
+            frame_idx, frame, detections = item
+            shapes = self.intelligenceHelper.shapes_of_detections(detections)
+            if not self._put(self.polygonized, (frame_idx, frame, shapes)):
+                break
+        self._put(self.polygonized, END)
+
+    def _persist_stage(self):
+        # the frames that were tracked are persisted even if the tracking is cancelled, until the worker sends END
+        while True:
+            item = self.tracked.get()
+            if item is END:
+                break
+            frame_idx, frame_data = item
+            if frame_data is not None:
+                # append the tracked frame to the journal so that a crash does not lose it
+                helpers.set_frame_objects(self.json_file_name, self.nTotalFrames, [(frame_idx, frame_data)])
+            self.last_persisted_idx = frame_idx
+            self.frameTracked.emit(frame_idx, frame_data)
+
+    def track_frame(self, frame, prev_frame, shapes):
+
+        """
+        Summary:
+            Update the tracker with the shapes of a frame and build the frame_data of the tracked objects.
+
+        Args:
+            frame: the frame (cv2 image)
+            prev_frame: the previous frame (for camera motion compensation)
+            shapes: the shapes detected in the frame
+
+        Returns:
+            frame_data: a list of objects (each object is a dictionary with keys (tracker_id, bbox, confidence, class_name, class_id, segment))
+        """
+
+        for shape in shapes:
+            if shape['content'] is None:
+                shape['content'] = 1.0
+        boxes, confidences, class_ids, segments = helpers.get_boxes_conf_classids_segments(shapes)
+
+        detections = Detections(
+            xyxy=np.array(boxes, dtype=int),
+            confidence=np.array(confidences),
+            class_id=np.array(class_ids),
+        )
+        boxes = torch.from_numpy(detections.xyxy)
+        confidences = torch.from_numpy(detections.confidence)
+        class_ids = torch.from_numpy(detections.class_id)
+        dets = torch.cat((boxes, confidences.unsqueeze(1), class_ids.unsqueeze(1)), dim=1)
+        # convert dets to torch.float32 to avoid error in the tracker update function
+        dets = dets.to(torch.float32)
+
+        if hasattr(self.tracker, 'tracker') and hasattr(self.tracker.tracker, 'camera_update'):
+            if prev_frame is not None:  # camera motion compensation
+                self.tracker.tracker.camera_update(prev_frame, frame)
+        with torch.no_grad():
+            org_tracks = self.tracker.update(dets.cpu(), frame)
+
+        tracks = []
+        for org_track in org_tracks:
+            track = [int(org_track[i]) for i in range(6)]
+            track[4] += self.id_offset
+            track.append(org_track[6])
+            tracks.append(track)
+
+        matched_shapes, unmatched_shapes = helpers.match_detections_with_tracks(shapes, tracks)
+        shapes = [shape for shape in matched_shapes if shape["group_id"] is not None]
+
+        if self.tracks_to_follow is not None:
+            shapes = [shape for shape in shapes if shape["group_id"] in self.tracks_to_follow]
+
+        if self.area_polygon is not None:
+            final = []
+            for shape in shapes:
+                points = shape["points"]
+                polygon = Polygon([(int(points[z]), int(points[z + 1])) for z in range(0, len(points), 2)])
+                if self.area_polygon.intersects(polygon):
+                    final.append(shape)
+            shapes = final
+
+        frame_data = []
+        for shape in shapes:
+            points = shape["points"]
+            frame_data.append({
+                'tracker_id': int(shape["group_id"]),
+                'bbox': [int(i) for i in shape['bbox']],
+                'confidence': shape["content"],
+                'class_name': shape["label"],
+                'class_id': coco_classes.index(shape["label"]) if shape["label"] in coco_classes else -1,
+                'segment': [[int(points[z]), int(points[z + 1])] for z in range(0, len(points), 2)],
+            })
+        return frame_data
+
+    def run(self):
+        start_time = time.time()
+        persist_stage = self._stage(self._persist_stage)
+        stages = [self._stage(self._decode_stage),
+                  self._stage(self._detect_stage),
+                  self._stage(self._polygonize_stage)]
+
+        nTracked = 0
+        prev_frame = None
+        try:
+            while True:
+                self.running.wait()
+                item = self._get(self.polygonized)
+                if item is END:
+                    break
+                frame_idx, frame, shapes = item
+                frame_data = self.track_frame(frame, prev_frame, shapes) if len(shapes) > 0 else None
+                if len(shapes) > 0:
+                    prev_frame = frame
+                if not self._put_tracked((frame_idx, frame_data), persist_stage):
+                    break
+                nTracked += 1
+                self.last_tracked_idx = frame_idx
+                self.progress.emit(nTracked, self.nFrames)
+                if nTracked % 100 == 0:
+                    logger.info(f"tracking: {nTracked} frames, {nTracked / (time.time() - start_time):.2f} frames/s")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.cancel()
+
+        self.cancel()
+        for stage in stages:
+            stage.join()
+        # let the persist stage save the last tracked frames before finishing
+        self._put_tracked(END, persist_stage)
+        persist_stage.join()
+
+        elapsed = time.time() - start_time
+        fps = nTracked / elapsed if elapsed > 0 else 0.0
+        logger.info(f"tracking finished: {nTracked} frames in {elapsed:.2f} s ({fps:.2f} frames/s)")
+        if self.error is not None:
+            self.trackingError.emit(self.error)
+        self.trackingFinished.emit(self.last_persisted_idx, fps)
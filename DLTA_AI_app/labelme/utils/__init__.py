@@ -30,3 +30,15 @@ from .export import exportCOCO, exportCOCOvid, exportMOT, FolderDialog
 from .model_explorer import ModelExplorerDialog
 from .help import show_runtime_data, git_hub_link, feedback, open_license, check_updates, preferences, shortcut_selector, open_guide
 from .vid_to_frames import VideoFrameExtractor
+from .frame_store import FrameStore
+from .frame_buffer import FrameBuffer
+from .frame_journal import FrameJournal
+from .id_index import save_id_index, load_id_index, id_index_path_from_json
+from .trajectory import Trajectory
+from .frame_provider import VideoFrameProvider
+from .keyframe_index import KeyframeIndex
+from .video_export import VideoExporter, export_video
+from .model_registry import ModelRegistry
+from .nms import nms, box_iou_matrix
+from .mask_fusion import MaskFusion
+from .detection_cache import DetectionCache, RawDetections, image_key
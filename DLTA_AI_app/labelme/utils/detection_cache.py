@@ -0,0 +1,321 @@
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from .polygonize import box_extent, mask_to_polygon
+
+
+"""
+Raw Detection Cache:
+    The outputs of a model on an image before the class and confidence filters (RawDetections) are cached
+    per (image key, model name), so changing the confidence threshold, the selected classes or the NMS settings
+    re-derives the shapes from the cache instead of running the model again (for one image, a directory or a video).
+
+    RawDetections:
+        boxes:      (n, 4) float array of (x1, y1, x2, y2)
+        scores:     (n,) float array
+        class_ids:  (n,) int array (the class ids of the model)
+        masks:      None, or a list of n compact masks (extent, packed bits of the mask cropped to its extent)
+        polygons:   a list of n polygons, computed from the masks on first use and kept
+        classes:    the classes the model was restricted to (None -> all the classes)
+        min_score:  the confidence threshold the model was restricted to (0 -> none)
+
+    The selected classes and the confidence threshold are pushed into the post-processing of the models, so a cache entry
+    is only used for the classes and thresholds it covers (a subset of its classes, a threshold at or above its min_score);
+    raising the threshold or deselecting classes re-filters the cache, lowering it or selecting more classes runs the model again.
+
+    The image key is (path, modification time, size) for image files, (shape, hash of the pixels) for numpy images,
+    or any hashable key given by the caller (e.g. (video path, frame index) for video frames).
+"""
+
+
+def image_key(image):
+
+    """
+    Summary:
+        Get the cache key of an image.
+
+    Args:
+        image: a path or a numpy array
+
+    Returns:
+        key: a hashable key that changes when the image changes
+    """
+
+    if isinstance(image, str):
+        stat = os.stat(image)
+        return ("file", os.path.abspath(image), stat.st_mtime_ns, stat.st_size)
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(image.data, digest_size=16).hexdigest()
+    return ("array", image.shape, str(image.dtype), digest)
+
+
+class RawDetections(object):
+
+    def __init__(self, boxes, scores, class_ids, image_shape, masks=None, polygons=None, round_scores=False):
+
+        """
+        Summary:
+            Create the raw detections of a model on an image.
+
+        Args:
+            boxes: (n, 4) boxes (x1, y1, x2, y2)
+            scores: (n,) confidences
+            class_ids: (n,) class ids
+            image_shape: the (height, width) of the masks
+            masks: a list of n full-size masks, compacted here (default: None -> polygons must be given)
+            polygons: a list of n polygons (default: None -> computed from the masks when needed)
+            round_scores: compare the scores rounded to 2 decimals with the threshold (YOLO) (default: False)
+        """
+
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=float).reshape(-1)
+        self.class_ids = np.asarray(class_ids, dtype=int).reshape(-1)
+        self.image_shape = tuple(image_shape[:2])
+        self.round_scores = round_scores
+        self.masks = None
+        if masks is not None:
+            self.masks = [self.compact(mask, box) for mask, box in zip(masks, self.boxes)]
+        self.polygons = list(polygons) if polygons is not None else [None] * len(self.scores)
+        self.classes = None
+        self.min_score = 0.0
+
+    @classmethod
+    def from_crops(cls, boxes, scores, class_ids, image_shape, crops, round_scores=False):
+
+        """
+        Summary:
+            Create raw detections from masks that are already cropped to their extents (e.g. the merged detections of tiles).
+
+        Args:
+            boxes: (n, 4) boxes (x1, y1, x2, y2)
+            scores: (n,) confidences
+            class_ids: (n,) class ids
+            image_shape: the (height, width) of the image
+            crops: a list of n (extent, crop), extent is (row_start, col_start, row_end, col_end), crop the boolean mask inside it
+            round_scores: see __init__ (default: False)
+
+        Returns:
+            raw: the RawDetections
+        """
+
+        raw = cls(boxes, scores, class_ids, image_shape, round_scores=round_scores)
+        raw.masks = [(np.asarray(extent), np.packbits(crop, axis=None)) for extent, crop in crops]
+        return raw
+
+    def __len__(self):
+        return len(self.scores)
+
+    @staticmethod
+    def compact(mask, box):
+        extent = box_extent(mask, box)
+        r0, c0, r1, c1 = extent
+        return extent, np.packbits(mask[r0:r1, c0:c1] > 0, axis=None)
+
+    def nbytes(self):
+        nbytes = self.boxes.nbytes + self.scores.nbytes + self.class_ids.nbytes
+        if self.masks is not None:
+            nbytes += sum(bits.nbytes for _, bits in self.masks)
+        nbytes += sum(8 * len(polygon) for polygon in self.polygons if polygon is not None)
+        return nbytes
+
+    def restricted_to(self, classdict=None, threshold=None):
+
+        """
+        Summary:
+            Record the classes and the confidence threshold the model was restricted to when it produced the detections.
+
+        Args:
+            classdict: a dictionary of the selected classes (default: None -> all the classes)
+            threshold: the confidence threshold (default: None -> none)
+
+        Returns:
+            self
+        """
+
+        self.classes = None if classdict is None else set(classdict.keys())
+        self.min_score = 0.0 if threshold is None else float(threshold)
+        return self
+
+    def covers(self, classdict, threshold):
+
+        """
+        Summary:
+            Check if the detections of the selected classes above the threshold are all in the raw detections.
+
+        Args:
+            classdict: a dictionary of the selected classes (class id -> class name)
+            threshold: the confidence threshold
+
+        Returns:
+            covered: True if filtering the raw detections gives the same detections as running the model again
+        """
+
+        if float(threshold) < self.min_score:
+            return False
+        return self.classes is None or set(classdict.keys()) <= self.classes
+
+    def select(self, classdict, threshold):
+
+        """
+        Summary:
+            Get the detections of the selected classes above the confidence threshold.
+
+        Args:
+            classdict: a dictionary of the selected classes (class id -> class name)
+            threshold: the confidence threshold
+
+        Returns:
+            indices: the indices of the kept detections, in detection order
+        """
+
+        scores = np.round(self.scores, 2) if self.round_scores else self.scores
+        keep = (scores >= float(threshold)) & np.isin(self.class_ids, list(classdict.keys()))
+        return np.flatnonzero(keep)
+
+    def crop(self, i):
+        extent, bits = self.masks[i]
+        r0, c0, r1, c1 = extent
+        return extent, np.unpackbits(bits, count=(r1 - r0) * (c1 - c0)).reshape(r1 - r0, c1 - c0).astype(bool)
+
+    def mask(self, i):
+        (r0, c0, r1, c1), crop = self.crop(i)
+        mask = np.zeros(self.image_shape, dtype=bool)
+        mask[r0:r1, c0:c1] = crop
+        return mask
+
+    def polygon(self, i):
+
+        """
+        Summary:
+            Get the polygon of a detection (traced from its compact mask the first time).
+
+        Args:
+            i: the index of the detection
+
+        Returns:
+            polygon: an int array of (x, y) points (see polygonize.mask_to_polygon)
+        """
+
+        if self.polygons[i] is None:
+            (r0, c0, r1, c1), crop = self.crop(i)
+            if crop.size == 0:
+                self.polygons[i] = []
+                return self.polygons[i]
+            # the same one pixel margin as tracing the full mask (none at the sides of the image)
+            h, w = self.image_shape
+            pr0, pc0, pr1, pc1 = max(r0 - 1, 0), max(c0 - 1, 0), min(r1 + 1, h), min(c1 + 1, w)
+            local = np.zeros((pr1 - pr0, pc1 - pc0), dtype=bool)
+            local[r0 - pr0:r1 - pr0, c0 - pc0:c1 - pc0] = crop
+            self.polygons[i] = mask_to_polygon(local, [r0 - pr0, c0 - pc0, r1 - pr0, c1 - pc0], offset=(pr0, pc0))
+        return self.polygons[i]
+
+    def results(self, classdict, threshold):
+
+        """
+        Summary:
+            Get the polygons of the selected classes above the confidence threshold.
+
+        Args:
+            classdict: a dictionary of the selected classes (class id -> class name)
+            threshold: the confidence threshold
+
+        Returns:
+            results: a list of results (class, confidence, bbox, seg)
+        """
+
+        results = []
+        for i in self.select(classdict, threshold):
+            polygon = self.polygon(i)
+            if len(polygon) < 3:
+                continue
+            results.append({
+                "class": classdict[self.class_ids[i]],
+                "confidence": str(round(self.scores[i], 2)),
+                "bbox": self.boxes[i].astype(int),
+                "seg": polygon,
+            })
+        return results
+
+    def class_masks(self, classdict, threshold):
+
+        """
+        Summary:
+            Get the boxes and the full-size masks of the selected classes above the confidence threshold, class by class
+            (the format of an mmdet result, used to merge the masks of several models).
+
+        Args:
+            classdict: a dictionary of the selected classes (class id -> class name)
+            threshold: the confidence threshold
+
+        Returns:
+            results0, results1: the boxes (k, 5) and the masks of each selected class (in the order of classdict)
+        """
+
+        keep = self.select(classdict, threshold)
+        results0 = []
+        results1 = []
+        for class_id in classdict.keys():
+            indices = keep[self.class_ids[keep] == class_id]
+            results0.append(np.concatenate([self.boxes[indices], self.scores[indices, None]], axis=1))
+            results1.append([self.mask(i) for i in indices])
+        return results0, results1
+
+
+class DetectionCache(object):
+
+    """
+    Summary:
+        LRU cache of RawDetections keyed by (image key, model name), the least recently used entries are evicted above the memory budget.
+    """
+
+    def __init__(self, max_memory_mb=512):
+
+        """
+        Summary:
+            Create a detection cache.
+
+        Args:
+            max_memory_mb: the memory budget of the cached detections in MB (default: 512)
+        """
+
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def memory(self):
+        with self.lock:
+            return sum(self.sizes.values())
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, detections):
+        with self.lock:
+            self.entries[key] = detections
+            self.entries.move_to_end(key)
+            self.sizes[key] = detections.nbytes()
+            while len(self.entries) > 1 and sum(self.sizes.values()) > self.max_memory_bytes:
+                evicted, _ = self.entries.popitem(last=False)
+                self.sizes.pop(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
@@ -0,0 +1,219 @@
+import os
+import os.path as osp
+
+import orjson
+
+from labelme.logger import logger
+
+
+"""
+Directory Index Structure:
+    The images of an image directory (and of its subdirectories) and their label files are indexed in a single file
+    next to the images ("<directory>/.dlta_index"), so opening a large directory again does not walk and stat the whole tree.
+
+    {
+        "version": 1,
+        "extensions": [".jpg", ".png", ...],
+        "dirs": {
+            "<absolute path of a directory>": {
+                "mtime":   the modification time of the directory (ns) when it was scanned
+                "subdirs": [names of the subdirectories],
+                "images":  {image name: modification time (ns)},
+                "labels":  {label file name: [modification time (ns), size, number of shapes]},
+            },
+            ...
+        }
+    }
+
+    Refreshing the index only lists the directories whose modification time changed (files were added, removed or renamed),
+    and only parses the label files that changed. A label file that is rewritten in place does not change its directory,
+    so the app updates its entry when it saves or deletes it (update_label).
+    The label files are next to their images, or in the output directory (label_dir, not recursive) if one is set.
+"""
+
+
+INDEX_NAME = ".dlta_index"
+VERSION = 1
+
+
+def count_shapes(label_file):
+    try:
+        with open(label_file, "rb") as f:
+            return len(orjson.loads(f.read()).get("shapes") or [])
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class DirectoryIndex(object):
+
+    def __init__(self, folder, extensions, label_dir=None):
+
+        """
+        Summary:
+            Create the index of an image directory, loaded from its index file if it has one.
+
+        Args:
+            folder: the path of the image directory
+            extensions: the image extensions (lower case, with the dot)
+            label_dir: the directory of the label files (default: None -> next to the images)
+        """
+
+        self.folder = osp.abspath(folder)
+        self.extensions = sorted(set(extensions))
+        self.label_dir = osp.abspath(label_dir) if label_dir else None
+        self.index_file = osp.join(self.folder, INDEX_NAME)
+        self.dirs = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file, "rb") as f:
+                index = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return
+        if index.get("version") == VERSION and index.get("extensions") == self.extensions:
+            self.dirs = index["dirs"]
+
+    def save(self):
+        try:
+            record = self.dirs.get(self.folder)
+            up_to_date = record is not None and record["mtime"] == os.stat(self.folder).st_mtime_ns
+            # creating the index file changes the modification time of the directory, so it is created first
+            # and written in place (that does not change the directory), with the modification time after its creation
+            if not osp.exists(self.index_file):
+                open(self.index_file, "wb").close()
+            if up_to_date:
+                record["mtime"] = os.stat(self.folder).st_mtime_ns
+            with open(self.index_file, "r+b") as f:
+                f.write(orjson.dumps({"version": VERSION, "extensions": self.extensions, "dirs": self.dirs}))
+                f.truncate()
+        except OSError as e:
+            logger.warning(f"the index of {self.folder} can not be saved: {e}")
+
+    def scan_dir(self, path, mtime, previous=None):
+
+        """
+        Summary:
+            List a directory (its images, label files and subdirectories).
+
+        Args:
+            path: the absolute path of the directory
+            mtime: the modification time of the directory (ns)
+            previous: the previous record of the directory, its label counts are kept for the label files that did not change (default: None)
+
+        Returns:
+            record: the record of the directory (see the structure above)
+        """
+
+        old_labels = previous["labels"] if previous is not None else {}
+        record = {"mtime": mtime, "subdirs": [], "images": {}, "labels": {}}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        record["subdirs"].append(entry.name)
+                        continue
+                    extension = osp.splitext(entry.name)[1].lower()
+                    if extension in self.extensions:
+                        record["images"][entry.name] = entry.stat().st_mtime_ns
+                    elif extension == ".json":
+                        stat = entry.stat()
+                        old = old_labels.get(entry.name)
+                        if old is not None and old[0] == stat.st_mtime_ns and old[1] == stat.st_size:
+                            record["labels"][entry.name] = old
+                        else:
+                            record["labels"][entry.name] = [stat.st_mtime_ns, stat.st_size, count_shapes(entry.path)]
+                except OSError:
+                    continue
+        return record
+
+    def refresh(self):
+
+        """
+        Summary:
+            Bring the index up to date with the directory (only the directories that changed are listed again).
+
+        Returns:
+            self
+        """
+
+        seen = set()
+        stack = [(self.folder, True)]
+        if self.label_dir is not None:
+            stack.append((self.label_dir, False))
+        while stack:
+            path, recursive = stack.pop()
+            if path in seen:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            record = self.dirs.get(path)
+            if record is None or record["mtime"] != mtime:
+                try:
+                    record = self.scan_dir(path, mtime, record)
+                except OSError:
+                    continue
+                self.dirs[path] = record
+            seen.add(path)
+            if recursive:
+                stack.extend((osp.join(path, name), True) for name in record["subdirs"])
+        for path in set(self.dirs) - seen:
+            del self.dirs[path]
+        return self
+
+    def label_file_of(self, image_path):
+        label_name = osp.splitext(osp.basename(image_path))[0] + ".json"
+        return osp.join(self.label_dir or osp.dirname(image_path), label_name)
+
+    def entries(self):
+
+        """
+        Summary:
+            Get the images of the index, sorted by path (case insensitive).
+
+        Returns:
+            entries: a list of (image path, modification time (ns), has label file, number of shapes)
+        """
+
+        entries = []
+        output_labels = self.dirs.get(self.label_dir, {"labels": {}})["labels"] if self.label_dir is not None else None
+        for path, record in self.dirs.items():
+            # the output directory is only indexed for its label files
+            if path != self.folder and not path.startswith(self.folder + os.sep):
+                continue
+            labels = record["labels"] if output_labels is None else output_labels
+            prefix = osp.join(path, "")
+            for name, mtime in record["images"].items():
+                label = labels.get(osp.splitext(name)[0] + ".json")
+                entries.append((prefix + name, mtime, label is not None, label[2] if label is not None else 0))
+        entries.sort(key=lambda entry: entry[0].lower())
+        return entries
+
+    def update_label(self, label_file, nShapes=None):
+
+        """
+        Summary:
+            Update the entry of a label file that was saved or deleted by the app.
+
+        Args:
+            label_file: the path of the label file
+            nShapes: the number of shapes in the label file (default: None -> read from the file)
+
+        Returns:
+            None
+        """
+
+        record = self.dirs.get(osp.dirname(osp.abspath(label_file)))
+        if record is None:
+            return
+        name = osp.basename(label_file)
+        try:
+            stat = os.stat(label_file)
+        except OSError:
+            record["labels"].pop(name, None)
+            return
+        if nShapes is None:
+            nShapes = count_shapes(label_file)
+        record["labels"][name] = [stat.st_mtime_ns, stat.st_size, nShapes]
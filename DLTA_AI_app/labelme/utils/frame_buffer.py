@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+from qtpy import QtGui
+
+
+"""
+Frame Buffer:
+    The image on the canvas is decoded once into a contiguous BGR ndarray (the format of OpenCV), and Qt gets a QImage
+    view over the same memory (Format_BGR888), so the models, SAM and the overlays read the pixels Qt paints
+    without converting between the formats of Qt and OpenCV.
+
+        array:    (h, w, 3) uint8 BGR, C contiguous, owned by the frame buffer
+        qimage:   a QImage over the memory of array (no copy), it keeps a reference to array so it stays valid
+                  as long as it is used
+
+    Overlays (boxes, masks, trajectories) are drawn on a copy of the array, the result is a new frame buffer.
+"""
+
+
+class FrameBuffer(object):
+
+    def __init__(self, array):
+
+        """
+        Summary:
+            Create a frame buffer from an OpenCV image.
+
+        Args:
+            array: a BGR (h, w, 3), BGRA (h, w, 4) or grayscale (h, w) uint8 image, converted to a contiguous BGR array if needed
+        """
+
+        array = np.asarray(array)
+        if array.ndim == 2:
+            array = cv2.cvtColor(array, cv2.COLOR_GRAY2BGR)
+        elif array.shape[2] == 4:
+            array = cv2.cvtColor(array, cv2.COLOR_BGRA2BGR)
+        self.array = np.ascontiguousarray(array, dtype=np.uint8)
+        self._qimage = None
+
+    @classmethod
+    def from_rgb(cls, array):
+
+        """
+        Summary:
+            Create a frame buffer from an RGB (or RGBA) image, e.g. an image decoded by PIL.
+
+        Args:
+            array: an RGB (h, w, 3) or RGBA (h, w, 4) uint8 image
+
+        Returns:
+            frame: the FrameBuffer
+        """
+
+        code = cv2.COLOR_RGBA2BGR if array.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        return cls(cv2.cvtColor(array, code))
+
+    @classmethod
+    def from_qimage(cls, image):
+
+        """
+        Summary:
+            Create a frame buffer from a QImage (one copy of the pixels).
+
+        Args:
+            image: a QImage
+
+        Returns:
+            frame: the FrameBuffer
+        """
+
+        image = image.convertToFormat(QtGui.QImage.Format_BGR888)
+        h, w = image.height(), image.width()
+        ptr = image.constBits()
+        ptr.setsize(image.bytesPerLine() * h)
+        # the rows of a QImage are 4 byte aligned
+        rows = np.frombuffer(ptr, dtype=np.uint8).reshape(h, image.bytesPerLine())
+        return cls(rows[:, :3 * w].reshape(h, w, 3).copy())
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def qimage(self):
+
+        """
+        Summary:
+            Get the QImage view over the array (created on first use).
+
+        Returns:
+            image: a QImage in Format_BGR888 that shares the memory of the array
+        """
+
+        if self._qimage is None:
+            h, w = self.array.shape[:2]
+            self._qimage = QtGui.QImage(self.array.data, w, h, self.array.strides[0], QtGui.QImage.Format_BGR888)
+            # the QImage does not own its memory
+            self._qimage.frame_array = self.array
+        return self._qimage
+
+    def copy(self):
+        return FrameBuffer(self.array.copy())
@@ -0,0 +1,276 @@
+import os
+import struct
+import threading
+import zlib
+
+import orjson
+
+
+"""
+Frame Journal Structure:
+    A frame journal is an append-only file next to the frame store of a video (*_tracking_results.journal).
+    Every change of a frame is appended to the journal as a record, so a crash loses at most the frame being written.
+
+    [record]    frame index (uint32), payload length (uint32), crc32 of the payload (uint32)
+    [payload]   the frame_data of the frame encoded with orjson
+
+    The latest payload of each frame is kept in memory (pending) and is read before the frame store.
+    Compaction writes the pending frames into the frame store and truncates the journal.
+    A truncated or corrupted record at the end of the journal (e.g. a crash while appending) is ignored on replay.
+"""
+
+
+RECORD = struct.Struct("<III")
+
+
+def journal_path_from_json(json_file_name):
+
+    """
+    Summary:
+        Get the path of the frame journal of a video from the path of its json results file.
+
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+
+    Returns:
+        journal_file_name: the name of the frame journal file (*_tracking_results.journal)
+    """
+
+    return os.path.splitext(json_file_name)[0] + ".journal"
+
+
+class FrameJournal(object):
+
+    def __init__(self, file_name, store):
+
+        """
+        Summary:
+            Open a frame journal on top of a frame store and replay it if it exists.
+
+        Args:
+            file_name: the name of the journal file
+            store: the FrameStore the journal is compacted into
+        """
+
+        self.file_name = file_name
+        self.store = store
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.sequence = 0
+        self.compaction_thread = None
+
+        self.replay()
+        self.file = open(file_name, "ab")
+
+    def replay(self):
+
+        """
+        Summary:
+            Read the journal file and keep the latest record of each frame in memory.
+
+        Returns:
+            nFrames: the number of frames recovered from the journal
+        """
+
+        with self.lock:
+            if not os.path.exists(self.file_name):
+                return 0
+            with open(self.file_name, "rb") as f:
+                data = f.read()
+            position = 0
+            valid_end = 0
+            while position + RECORD.size <= len(data):
+                frame_idx, length, crc = RECORD.unpack_from(data, position)
+                payload = data[position + RECORD.size: position + RECORD.size + length]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    break
+                self.sequence += 1
+                self.pending[frame_idx] = (self.sequence, payload)
+                position += RECORD.size + length
+                valid_end = position
+            # drop the damaged tail so that new records are appended after the last valid one
+            if valid_end != len(data):
+                with open(self.file_name, "r+b") as f:
+                    f.truncate(valid_end)
+            return len(self.pending)
+
+    def append(self, frame_idx, frame_data, sync=True):
+
+        """
+        Summary:
+            Append the objects of a frame to the journal.
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+            frame_data: a list of objects of the frame
+            sync: flush the record to the disk
+
+        Returns:
+            None
+        """
+
+        payload = orjson.dumps(frame_data)
+        with self.lock:
+            self.file.write(RECORD.pack(frame_idx, len(payload), zlib.crc32(payload)) + payload)
+            self.sequence += 1
+            self.pending[frame_idx] = (self.sequence, payload)
+            if sync:
+                self.sync()
+
+    def append_frames(self, frames):
+
+        """
+        Summary:
+            Append the objects of multiple frames to the journal and flush once.
+
+        Args:
+            frames: an iterable of (frame_idx, frame_data)
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            for frame_idx, frame_data in frames:
+                self.append(frame_idx, frame_data, sync=False)
+            self.sync()
+
+    def sync(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def read_frame(self, frame_idx):
+
+        """
+        Summary:
+            Read the objects of a single frame from the journal if it has a pending change, otherwise from the store.
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+
+        Returns:
+            frame_data: a list of objects of the frame
+        """
+
+        with self.lock:
+            if frame_idx in self.pending:
+                return orjson.loads(self.pending[frame_idx][1])
+        return self.store.read_frame(frame_idx)
+
+    def iter_frames(self, frames=None):
+
+        """
+        Summary:
+            Iterate over the objects of some frames, only the requested frames are decoded.
+
+        Args:
+            frames: an iterable of frame indices (starts from 1), if None all frames are iterated
+
+        Returns:
+            a generator of (frame_idx, frame_data)
+        """
+
+        frames = frames if frames is not None else range(1, len(self.store) + 1)
+        for frame_idx in frames:
+            yield frame_idx, self.read_frame(frame_idx)
+
+    def to_list(self):
+
+        """
+        Summary:
+            Read the whole video in the json layout (store content with the pending changes applied).
+
+        Returns:
+            listObj: a list of objects (each object is a dictionary of a frame with keys (frame_idx, frame_data))
+        """
+
+        with self.lock:
+            return [{'frame_idx': i + 1, 'frame_data': self.read_frame(i + 1)}
+                    for i in range(len(self.store))]
+
+    def has_pending(self):
+        return len(self.pending) > 0
+
+    def is_compacting(self):
+        return self.compaction_thread is not None and self.compaction_thread.is_alive()
+
+    def clear(self):
+
+        """
+        Summary:
+            Drop the pending changes and truncate the journal (used when the whole store is rewritten).
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            self.pending = {}
+            self.file.truncate(0)
+            self.sync()
+
+    def compact(self):
+
+        """
+        Summary:
+            Write the pending frames into the frame store and truncate the journal.
+            Frames changed while compacting stay in the journal.
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            if not self.pending:
+                return
+            snapshot = dict(self.pending)
+
+        self.store.write_frames((frame_idx, orjson.loads(payload))
+                                for frame_idx, (sequence, payload) in sorted(snapshot.items()))
+
+        with self.lock:
+            for frame_idx, (sequence, payload) in snapshot.items():
+                if self.pending.get(frame_idx, (None, None))[0] == sequence:
+                    del self.pending[frame_idx]
+            # rewrite the journal with the frames that changed while compacting
+            remaining = sorted(self.pending.items())
+            self.file.truncate(0)
+            for frame_idx, (sequence, payload) in remaining:
+                self.file.write(RECORD.pack(frame_idx, len(payload), zlib.crc32(payload)) + payload)
+            self.sync()
+
+    def compact_in_background(self):
+
+        """
+        Summary:
+            Compact the journal on a background thread (does nothing if a compaction is already running).
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            if not self.pending:
+                return
+            if self.is_compacting():
+                return
+            self.compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self.compaction_thread.start()
+
+    def close(self):
+
+        """
+        Summary:
+            Wait for the background compaction, compact the remaining changes and close the journal.
+
+        Returns:
+            None
+        """
+
+        if self.compaction_thread is not None:
+            self.compaction_thread.join()
+        self.compact()
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
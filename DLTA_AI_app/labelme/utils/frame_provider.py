@@ -0,0 +1,244 @@
+import collections
+import threading
+
+import cv2
+
+from .keyframe_index import KeyframeIndex
+
+
+class VideoFrameProvider(object):
+
+    """
+    Summary:
+        Serve decoded video frames from a memory-bounded LRU cache.
+        A background thread reads ahead sequentially in the direction of travel (forward or backward),
+        so stepping through the video, playing it or interpolating over a range does not seek and decode the same GOPs again.
+        Random access seeks to the preceding keyframe of the keyframe index and decodes forward.
+    """
+
+    def __init__(self, video_path, max_cache_mb=512, read_ahead=30):
+
+        """
+        Summary:
+            Open a video for frame access.
+
+        Args:
+            video_path: the path of the video file
+            max_cache_mb: the memory budget of the decoded frames cache in MB (default: 512)
+            read_ahead: the number of frames to read ahead in the direction of travel (default: 30)
+        """
+
+        self.video_path = video_path
+        self.max_cache_bytes = max_cache_mb * 1024 * 1024
+        self.read_ahead = read_ahead
+
+        self.cap = cv2.VideoCapture(video_path)
+        self.nTotalFrames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # the index (starts from 1) of the frame the next cap.read() returns
+        self.next_frame_idx = 1
+
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = 0
+        # the size of a decoded frame (known after the first decode), the read-ahead window must fit in the cache with the current frame
+        self.frame_nbytes = None
+        self.cap_lock = threading.Lock()
+        self.cache_lock = threading.Lock()
+
+        # the keyframe index is loaded (or built by a demux pass) in the background, seeks use CAP_PROP_POS_FRAMES until it is ready
+        self.keyframe_index = None
+        threading.Thread(target=self._load_keyframe_index, daemon=True).start()
+
+        self.last_requested_idx = None
+        self.direction = 1
+        # the (position, direction) the read-ahead thread last read ahead of, it is not read ahead of again
+        self.read_ahead_done = None
+        self.stopped = False
+        self.wake_up = threading.Condition()
+        self.read_ahead_thread = threading.Thread(target=self._read_ahead_loop, daemon=True)
+        self.read_ahead_thread.start()
+
+    def get_frame(self, frame_idx):
+
+        """
+        Summary:
+            Get a decoded frame (BGR), from the cache if possible.
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+
+        Returns:
+            frame: a cv2 image (a copy, the caller may modify it) or None if the frame can not be read
+        """
+
+        if frame_idx < 1 or frame_idx > self.nTotalFrames:
+            return None
+
+        if self.last_requested_idx is not None and frame_idx != self.last_requested_idx:
+            self.direction = 1 if frame_idx > self.last_requested_idx else -1
+        self.last_requested_idx = frame_idx
+
+        frame = self._get_cached(frame_idx)
+        if frame is None:
+            with self.cap_lock:
+                frame = self._decode(frame_idx)
+        with self.wake_up:
+            self.wake_up.notify()
+        return None if frame is None else frame.copy()
+
+    def _get_cached(self, frame_idx):
+        with self.cache_lock:
+            frame = self.cache.get(frame_idx, None)
+            if frame is not None:
+                self.cache.move_to_end(frame_idx)
+            return frame
+
+    def _put_cached(self, frame_idx, frame):
+        with self.cache_lock:
+            if frame_idx in self.cache:
+                self.cache.move_to_end(frame_idx)
+                return
+            self.cache[frame_idx] = frame
+            self.cache_bytes += frame.nbytes
+            self.frame_nbytes = frame.nbytes
+            while self.cache_bytes > self.max_cache_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted.nbytes
+
+    def _seek(self, frame_idx):
+
+        """
+        Summary:
+            Move the capture so that the next read returns the given frame (cap_lock must be held).
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+
+        Returns:
+            None
+        """
+
+        if frame_idx == self.next_frame_idx:
+            return
+        if self.keyframe_index is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx - 1)
+            self.next_frame_idx = frame_idx
+            return
+
+        keyframe_idx = self.keyframe_index.preceding(frame_idx)
+        # keep decoding from the current position if it is in the same GOP before the frame
+        if self.next_frame_idx is None or not keyframe_idx <= self.next_frame_idx < frame_idx:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe_idx - 1)
+            self.next_frame_idx = keyframe_idx
+        while self.next_frame_idx < frame_idx:
+            if not self.cap.grab():
+                self.next_frame_idx = None
+                return
+            self.next_frame_idx += 1
+
+    def _load_keyframe_index(self):
+        try:
+            self.keyframe_index = KeyframeIndex.load_or_build(self.video_path)
+        except Exception as e:
+            print(f"could not build the keyframe index of {self.video_path}: {e}")
+
+    def _decode(self, frame_idx):
+
+        """
+        Summary:
+            Decode a frame with the capture and cache it (cap_lock must be held).
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+
+        Returns:
+            frame: a cv2 image or None if the frame can not be read
+        """
+
+        frame = self._get_cached(frame_idx)
+        if frame is not None:
+            return frame
+        self._seek(frame_idx)
+        success, frame = self.cap.read()
+        if not success:
+            # the position of the capture is unknown after a failed read
+            self.next_frame_idx = None
+            return None
+        self.next_frame_idx = frame_idx + 1
+        self._put_cached(frame_idx, frame)
+        return frame
+
+    def read_ahead_window(self):
+        # a window larger than the cache would evict its own frames (and read them again forever)
+        if self.frame_nbytes is None:
+            return 0
+        return min(self.read_ahead, max(0, self.max_cache_bytes // self.frame_nbytes - 1))
+
+    def _read_ahead_range(self):
+        frame_idx = self.last_requested_idx
+        if frame_idx is None or self.read_ahead_done == (frame_idx, self.direction):
+            return []
+        window = self.read_ahead_window()
+        if self.direction > 0:
+            frames = range(frame_idx + 1, min(frame_idx + window, self.nTotalFrames) + 1)
+        else:
+            # decode backward ranges forward from their first frame (one seek instead of one per frame)
+            frames = range(max(frame_idx - window, 1), frame_idx)
+        with self.cache_lock:
+            return [idx for idx in frames if idx not in self.cache]
+
+    def _read_ahead_loop(self):
+        while not self.stopped:
+            frames = self._read_ahead_range()
+            if len(frames) == 0:
+                with self.wake_up:
+                    self.wake_up.wait(0.5)
+                continue
+            requested = (self.last_requested_idx, self.direction)
+            failed = False
+            for frame_idx in frames:
+                # stop reading ahead if the user moved somewhere else, the new position is served first
+                if self.stopped or (self.last_requested_idx, self.direction) != requested:
+                    break
+                with self.cap_lock:
+                    failed = self._decode(frame_idx) is None
+                if failed:
+                    break
+            else:
+                # a full pass, the position is not read ahead of again until the user moves
+                self.read_ahead_done = requested
+            if failed:
+                with self.wake_up:
+                    self.wake_up.wait(0.5)
+
+    def clear(self):
+
+        """
+        Summary:
+            Drop all the cached frames.
+
+        Returns:
+            None
+        """
+
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+        self.read_ahead_done = None
+
+    def release(self):
+
+        """
+        Summary:
+            Stop the read-ahead thread and release the video.
+
+        Returns:
+            None
+        """
+
+        self.stopped = True
+        with self.wake_up:
+            self.wake_up.notify()
+        self.read_ahead_thread.join()
+        with self.cap_lock:
+            self.cap.release()
+        self.clear()
@@ -0,0 +1,318 @@
+import os
+import struct
+import threading
+
+import orjson
+
+from labelme.logger import logger
+
+
+"""
+Frame Store Structure:
+    A frame store is a single binary file that holds the annotations of a video, frame by frame.
+    It replaces rewriting the whole "_tracking_results.json" file for every edit.
+
+    [header]        magic (8 bytes), version (uint32), number of frames (uint32), generation (uint64)
+    [offset table]  one entry per frame: offset (uint64), length (uint32), capacity (uint32)
+    [records]       the frame_data of each frame encoded with orjson
+
+    A frame with length 0 has no objects (empty frame_data).
+    A record is rewritten in place if it fits in its capacity, otherwise it is appended to the end of the file.
+    The generation is incremented on every write, it is used to know if the sidecar files of the video are stale.
+"""
+
+
+MAGIC = b"DLTAFRM1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+ENTRY = struct.Struct("<QII")
+
+# extra space reserved for each appended record so that small edits can be written in place later
+SLACK_RATIO = 0.25
+
+
+def store_path_from_json(json_file_name):
+
+    """
+    Summary:
+        Get the path of the frame store of a video from the path of its json results file.
+
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+
+    Returns:
+        store_file_name: the name of the frame store file (*_tracking_results.frames)
+    """
+
+    return os.path.splitext(json_file_name)[0] + ".frames"
+
+
+class FrameStoreError(Exception):
+    pass
+
+
+class FrameStore(object):
+
+    def __init__(self, file_name, nTotalFrames):
+
+        """
+        Summary:
+            Open a frame store, create it if it does not exist.
+
+        Args:
+            file_name: the name of the frame store file
+            nTotalFrames: the total number of frames of the video
+        """
+
+        self.file_name = file_name
+        self.nTotalFrames = int(nTotalFrames)
+        self.generation = 0
+        self.lock = threading.RLock()
+        self.entries = []
+
+        if not os.path.exists(file_name):
+            self._create(self.nTotalFrames)
+        self.file = open(file_name, "r+b")
+        self._read_header()
+
+        # the frame count of a video is an estimate (it differs between OpenCV builds and codecs),
+        # the store grows to it but never drops the frames it already has
+        if len(self.entries) < self.nTotalFrames:
+            self.resize(self.nTotalFrames)
+        elif len(self.entries) > self.nTotalFrames:
+            logger.warning(f"{file_name} has {len(self.entries)} frames, the video has {self.nTotalFrames}, the frames are kept")
+
+    def _create(self, nTotalFrames):
+        with open(self.file_name, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, nTotalFrames, 0))
+            f.write(ENTRY.pack(0, 0, 0) * nTotalFrames)
+
+    def _read_header(self):
+        self.file.seek(0)
+        header = self.file.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise FrameStoreError(f"{self.file_name} is not a valid frame store")
+        magic, version, nFrames, generation = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise FrameStoreError(f"{self.file_name} is not a valid frame store")
+        table = self.file.read(ENTRY.size * nFrames)
+        self.entries = [list(entry) for entry in ENTRY.iter_unpack(table)]
+        self.generation = generation
+
+    def _write_entry(self, i):
+        self.file.seek(HEADER.size + ENTRY.size * i)
+        self.file.write(ENTRY.pack(*self.entries[i]))
+
+    def _bump_generation(self):
+        self.generation += 1
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(self.entries), self.generation))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def read_frame(self, frame_idx):
+
+        """
+        Summary:
+            Read the objects of a single frame in O(1).
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+
+        Returns:
+            frame_data: a list of objects (each object is a dictionary with keys (tracker_id, bbox, confidence, class_name, class_id, segment))
+        """
+
+        with self.lock:
+            if frame_idx < 1 or frame_idx > len(self.entries):
+                return []
+            offset, length, capacity = self.entries[frame_idx - 1]
+            if length == 0:
+                return []
+            self.file.seek(offset)
+            record = self.file.read(length)
+        return orjson.loads(record)
+
+    def write_frame(self, frame_idx, frame_data, flush=True):
+
+        """
+        Summary:
+            Write the objects of a single frame.
+            The record is written in place if it fits, otherwise it is appended to the end of the file.
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+            frame_data: a list of objects of the frame
+            flush: flush the file after writing
+
+        Returns:
+            None
+        """
+
+        if frame_idx < 1 or frame_idx > len(self.entries):
+            return
+        record = orjson.dumps(frame_data) if len(frame_data) > 0 else b""
+        with self.lock:
+            i = frame_idx - 1
+            offset, length, capacity = self.entries[i]
+            if len(record) == 0:
+                # keep the old slot so the frame can be refilled in place
+                self.entries[i] = [offset, 0, capacity]
+            elif len(record) <= capacity:
+                self.file.seek(offset)
+                self.file.write(record)
+                self.entries[i] = [offset, len(record), capacity]
+            else:
+                self.file.seek(0, os.SEEK_END)
+                offset = self.file.tell()
+                capacity = len(record) + int(len(record) * SLACK_RATIO)
+                self.file.write(record + b"\x00" * (capacity - len(record)))
+                self.entries[i] = [offset, len(record), capacity]
+            self._write_entry(i)
+            self._bump_generation()
+            if flush:
+                self.file.flush()
+
+    def write_frames(self, frames):
+
+        """
+        Summary:
+            Write the objects of multiple frames.
+
+        Args:
+            frames: an iterable of (frame_idx, frame_data)
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            for frame_idx, frame_data in frames:
+                self.write_frame(frame_idx, frame_data, flush=False)
+            self.file.flush()
+
+    def to_list(self):
+
+        """
+        Summary:
+            Read the whole store in the json layout.
+
+        Returns:
+            listObj: a list of objects (each object is a dictionary of a frame with keys (frame_idx, frame_data))
+        """
+
+        with self.lock:
+            return [{'frame_idx': i + 1, 'frame_data': self.read_frame(i + 1)}
+                    for i in range(len(self.entries))]
+
+    def from_list(self, listObj):
+
+        """
+        Summary:
+            Replace the content of the store with a list of objects in the json layout.
+
+        Args:
+            listObj: a list of objects (each object is a dictionary of a frame with keys (frame_idx, frame_data))
+
+        Returns:
+            None
+        """
+
+        frames = {}
+        for frame in listObj:
+            frames[frame['frame_idx']] = frame['frame_data']
+        nFrames = max([len(self.entries), self.nTotalFrames] + list(frames.keys()))
+        self._rewrite(lambda frame_idx: frames.get(frame_idx, []), nFrames)
+
+    def import_json(self, json_file_name):
+
+        """
+        Summary:
+            Import a json results file (the old layout) into the store.
+
+        Args:
+            json_file_name: the name of the json file
+
+        Returns:
+            None
+        """
+
+        with open(json_file_name, "rb") as jf:
+            listObj = orjson.loads(jf.read())
+        self.from_list(listObj)
+
+    def export_json(self, json_file_name):
+
+        """
+        Summary:
+            Export the store to a json results file (the old layout) so that the exporters keep working.
+
+        Args:
+            json_file_name: the name of the json file
+
+        Returns:
+            None
+        """
+
+        with open(json_file_name, "wb") as jf:
+            jf.write(orjson.dumps(self.to_list(), option=orjson.OPT_INDENT_2))
+
+    def resize(self, nTotalFrames):
+
+        """
+        Summary:
+            Grow the store to a number of frames (the frames it has are never dropped).
+
+        Args:
+            nTotalFrames: the new number of frames (ignored if the store has more)
+
+        Returns:
+            None
+        """
+
+        self.nTotalFrames = int(nTotalFrames)
+        if self.nTotalFrames <= len(self.entries):
+            return
+        self._rewrite(self.read_frame, self.nTotalFrames)
+
+    def compact(self):
+
+        """
+        Summary:
+            Rewrite the store contiguously to reclaim the space of the records that were moved to the end of the file.
+
+        Returns:
+            None
+        """
+
+        self._rewrite(self.read_frame)
+
+    def _rewrite(self, get_frame_data, nFrames=None):
+        # nFrames: the number of frames of the rewritten store (default: None -> the frames of the store)
+        with self.lock:
+            tmp_file_name = self.file_name + ".tmp"
+            nFrames = max(len(self.entries), self.nTotalFrames) if nFrames is None else nFrames
+            entries = []
+            offset = HEADER.size + ENTRY.size * nFrames
+            with open(tmp_file_name, "wb") as f:
+                f.seek(offset)
+                for frame_idx in range(1, nFrames + 1):
+                    frame_data = get_frame_data(frame_idx)
+                    record = orjson.dumps(frame_data) if len(frame_data) > 0 else b""
+                    f.write(record)
+                    entries.append([offset, len(record), len(record)])
+                    offset += len(record)
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, VERSION, nFrames, self.generation + 1))
+                for entry in entries:
+                    f.write(ENTRY.pack(*entry))
+            self.file.close()
+            os.replace(tmp_file_name, self.file_name)
+            self.file = open(self.file_name, "r+b")
+            self._read_header()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
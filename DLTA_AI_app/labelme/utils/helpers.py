@@ -16,6 +16,11 @@ import sys
 import subprocess
 import platform
 from shapely.geometry import Polygon
+from .frame_store import FrameStore, store_path_from_json
+from .frame_journal import FrameJournal, journal_path_from_json
+from .id_index import id_index_path_from_json
+from .trajectory import Trajectory
+from .frame_buffer import FrameBuffer
 
 try:
     from .custom_exports import custom_exports_list
@@ -572,6 +577,24 @@ def convert_QT_to_cv(incomingImage):
     return arr
 
 
+def overlay_array(image):
+    
+    """
+    Summary:
+        Get a BGR copy of an image to draw overlays on (the frame itself is not modified).
+        
+    Args:
+        image: a FrameBuffer or a QT image
+        
+    Returns:
+        arr: a cv image (h, w, 3)
+    """
+    
+    if isinstance(image, FrameBuffer):
+        return image.array.copy()
+    return FrameBuffer.from_qimage(image).array
+
+
 def convert_cv_to_qt(cv_img):
     
     """
@@ -697,8 +720,8 @@ def draw_trajectories(trajectories, CurrentFrameIndex, flags, img, shapes):
     x = trajectories['length']
     for shape in shapes:
         id = shape["group_id"]
-        pts_traj = trajectories['id_' + str(id)][max(
-            CurrentFrameIndex - x, 0): CurrentFrameIndex]
+        # the consecutive centers of the id ending at the current frame (within the trajectory length)
+        pts_traj = trajectories['id_' + str(id)].tail(CurrentFrameIndex, x)
         pts_poly = np.array([[x, y] for x, y in zip(
             shape["points"][0::2], shape["points"][1::2])])
         color_poly = trajectories['id_color_' + str(
@@ -710,26 +733,25 @@ def draw_trajectories(trajectories, CurrentFrameIndex, flags, img, shapes):
                 cv2.fillPoly(img, pts=[pts_poly], color=color_poly)
             alpha = trajectories['alpha']
             img = cv2.addWeighted(original_img, alpha, img, 1 - alpha, 0)
-        for i in range(len(pts_traj) - 1, 0, - 1):
-
-            thickness = (len(pts_traj) - i <= 10) * 1 + (len(pts_traj) -
-                                                            i <= 20) * 1 + (len(pts_traj) - i <= 30) * 1 + 3
-            # max_thickness = 6
-            # thickness = max(1, round(i / len(pts_traj) * max_thickness))
+        if not flags['traj'] or len(pts_traj) < 2:
+            continue
 
-            if pts_traj[i - 1] is None or pts_traj[i] is None:
+        # color_traj = tuple(int(0.95 * x) for x in color_poly)
+        color_traj = color_poly
+
+        # the segment ending at point i is thicker the closer it is to the current frame
+        # (6 for the last 10 frames, 5 for the last 20, 4 for the last 30 and 3 for the rest)
+        # max_thickness = 6
+        # thickness = max(1, round(i / len(pts_traj) * max_thickness))
+        n = len(pts_traj)
+        for thickness, (near, far) in zip([3, 4, 5, 6], [(n - 1, 30), (30, 20), (20, 10), (10, 0)]):
+            # segments ending at points i with far < n - i <= near
+            first, last = max(n - near, 1), n - far - 1
+            if first > last:
                 continue
-            if pts_traj[i] == (-1, - 1) or pts_traj[i - 1] == (-1, - 1):
-                break
-
-            # color_traj = tuple(int(0.95 * x) for x in color_poly)
-            color_traj = color_poly
-
-            if flags['traj']:
-                cv2.line(img, pts_traj[i - 1],
-                            pts_traj[i], color_traj, thickness)
-                if ((len(pts_traj) - 1 - i) % 10 == 0):
-                    cv2.circle(img, pts_traj[i], 3, (0, 0, 0), -1)
+            cv2.polylines(img, [pts_traj[first - 1:last + 1].reshape(-1, 1, 2)], False, color_traj, thickness)
+        for i in range(n - 1, 0, -10):
+            cv2.circle(img, (int(pts_traj[i, 0]), int(pts_traj[i, 1])), 3, (0, 0, 0), -1)
 
     return img
 
@@ -744,22 +766,58 @@ def draw_bb_on_image(trajectories, CurrentFrameIndex, flags, nTotalFrames, image
         trajectories: a dictionary of trajectories.
         CurrentFrameIndex: the current frame index.
         nTotalFrames: the total number of frames.
-        image: a QT image or a cv2 image.
+        image: a FrameBuffer, a QT image or a cv2 image.
         shapes: a list of shapes.
-        image_qt_flag: a flag to indicate if the image is a QT image or a cv2 image.
+        image_qt_flag: a flag to indicate if the image is a FrameBuffer (or a QT image) or a cv2 image.
         
     Returns:
-        img: a QT image or a cv2 image.
+        img: a QT image (a view over the drawn frame) or a cv2 image.
     """
     
     img = image
     if image_qt_flag:
-        img = convert_QT_to_cv(image)
+        img = overlay_array(image)
 
+    update_trajectories(trajectories, CurrentFrameIndex, shapes)
     for shape in shapes:
         id = shape["group_id"]
         label = shape["label"]
         conf = shape["content"]
+        color = trajectories['id_color_' + str(id)]
+
+        (x1, y1, x2, y2) = shape["bbox"]
+        x, y, w, h = int(x1), int(y1), int(x2 - x1), int(y2 - y1)
+        img = draw_bb_id(flags, img, x, y, w, h, id, conf,
+                                label, color, thickness=1)
+
+    # print(sys.getsizeof(trajectories))
+
+    img = draw_trajectories(trajectories, CurrentFrameIndex, flags, img, shapes)
+
+    if image_qt_flag:
+        img = FrameBuffer(img).qimage()
+
+    return img
+
+
+def update_trajectories(trajectories, CurrentFrameIndex, shapes):
+    
+    """
+    Summary:
+        Record the (smoothed) bbox centers and the colors of the shapes of a frame in the trajectories.
+        
+    Args:
+        trajectories: a dictionary of trajectories
+        CurrentFrameIndex: the current frame index
+        shapes: a list of shapes
+        
+    Returns:
+        None
+    """
+    
+    for shape in shapes:
+        id = shape["group_id"]
+        label = shape["label"]
 
         # color calculation
         # idx = coco_classes.index(label) if label in coco_classes else -1
@@ -772,62 +830,64 @@ def draw_bb_on_image(trajectories, CurrentFrameIndex, flags, nTotalFrames, image
         color = color_palette[idx]
 
         (x1, y1, x2, y2) = shape["bbox"]
-        x, y, w, h = int(x1), int(y1), int(x2 - x1), int(y2 - y1)
-        img = draw_bb_id(flags, img, x, y, w, h, id, conf,
-                                label, color, thickness=1)
         center = (int((x1 + x2) / 2), int((y1 + y2) / 2))
-        try:
-            centers_rec = trajectories['id_' + str(id)]
-            try:
-                (xp, yp) = centers_rec[CurrentFrameIndex - 2]
-                (xn, yn) = center
-                if (xp == -1 or xn == -1):
-                    c = 5 / 0
-                r = 0.5
-                x = r * xn + (1 - r) * xp
-                y = r * yn + (1 - r) * yp
-                center = (int(x), int(y))
-            except:
-                pass
-            centers_rec[CurrentFrameIndex - 1] = center
-            trajectories['id_' +
-                                                    str(id)] = centers_rec
-            trajectories['id_color_' +
-                                                    str(id)] = color
-        except:
-            centers_rec = [(-1, - 1)] * int(nTotalFrames)
-            centers_rec[CurrentFrameIndex - 1] = center
-            trajectories['id_' +
-                                                    str(id)] = centers_rec
-            trajectories['id_color_' +
-                                                    str(id)] = color
+        if 'id_' + str(id) not in trajectories:
+            trajectories['id_' + str(id)] = Trajectory()
+        centers_rec = trajectories['id_' + str(id)]
+        # smooth the center with the center of the previous frame
+        previous = centers_rec.get(CurrentFrameIndex - 1)
+        if previous is not None:
+            r = 0.5
+            center = (int(r * center[0] + (1 - r) * previous[0]),
+                      int(r * center[1] + (1 - r) * previous[1]))
+        centers_rec.set(CurrentFrameIndex, center)
+        trajectories['id_color_' + str(id)] = color
 
-    # print(sys.getsizeof(trajectories))
 
-    img = draw_trajectories(trajectories, CurrentFrameIndex, flags, img, shapes)
-
-    if image_qt_flag:
-        img = convert_cv_to_qt(img, )
-
-    return img
+def frame_objects_to_shapes(frame_objects):
+    
+    """
+    Summary:
+        Convert the objects of a video frame to shapes.
+        
+    Args:
+        frame_objects: a list of objects (each object is a dictionary with keys (tracker_id, bbox, confidence, class_name, class_id, segment))
+        
+    Returns:
+        shapes: a list of shapes
+    """
+    
+    shapes = []
+    for object_ in frame_objects:
+        shape = {}
+        shape["label"] = object_["class_name"]
+        shape["group_id"] = object_['tracker_id']
+        shape["content"] = object_['confidence']
+        shape["bbox"] = object_['bbox']
+        shape["points"] = np.array(object_['segment'], np.int16).flatten().tolist()
+        shape["shape_type"] = "polygon"
+        shape["other_data"] = {}
+        shape["flags"] = {}
+        shapes.append(shape)
+    return shapes
 
 
 def draw_bb_on_image_MODE(flags, image, shapes):
     
     """
     Summary:
-        Draw bounding boxes on an QT image (multiple ids) in MODE image.
+        Draw bounding boxes on an image (multiple ids) in MODE image.
         
     Args:
         flags: a dictionary of flags.
-        image: a QT image.
+        image: a FrameBuffer or a QT image.
         shapes: a list of shapes.
         
     Returns:
-        img: a QT image.
+        img: a QT image (a view over the drawn frame).
     """
     
-    img = convert_QT_to_cv(image)
+    img = overlay_array(image)
 
     for shape in shapes:
         
@@ -861,7 +921,7 @@ def draw_bb_on_image_MODE(flags, image, shapes):
             alpha = 0.70
             img = cv2.addWeighted(original_img, alpha, img, 1 - alpha, 0)
     
-    img = convert_cv_to_qt(img, )
+    img = FrameBuffer(img).qimage()
 
     return img
 
@@ -1051,11 +1111,210 @@ def load_objects_to_json__json(json_file_name, listObj):
     json_file.close()
 
 
+# the opened frame stores and frame journals (one per video), keyed by the store file name
+# the opened frame stores and journals, by the json results file name of their video
+frame_stores = {}
+frame_journals = {}
+
+
+def get_frame_store(json_file_name, nTotalFrames):
+    
+    """
+    Summary:
+        Get the frame store of a video (open it once and keep it open).
+        If the store does not exist but an old json results file exists, the json file is imported into the store.
+        
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+        nTotalFrames: the total number of frames
+        
+    Returns:
+        store: the FrameStore of the video
+    """
+    
+    store_file_name = store_path_from_json(json_file_name)
+    store = frame_stores.get(json_file_name, None)
+    if store is not None and store.nTotalFrames == nTotalFrames and os.path.exists(store_file_name):
+        return store
+    if store is not None:
+        close_frame_store(json_file_name)
+    import_legacy = not os.path.exists(store_file_name) and os.path.exists(json_file_name)
+    store = FrameStore(store_file_name, nTotalFrames)
+    if import_legacy:
+        store.import_json(json_file_name)
+    frame_stores[json_file_name] = store
+    return store
+
+
+def get_frame_journal(json_file_name, nTotalFrames):
+    
+    """
+    Summary:
+        Get the frame journal of a video (open it once and keep it open).
+        Opening the journal replays the changes that were not compacted into the frame store yet (e.g. after a crash).
+        
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+        nTotalFrames: the total number of frames
+        
+    Returns:
+        journal: the FrameJournal of the video
+    """
+    
+    store = get_frame_store(json_file_name, nTotalFrames)
+    journal = frame_journals.get(json_file_name, None)
+    if journal is None:
+        journal = FrameJournal(journal_path_from_json(json_file_name), store)
+        frame_journals[json_file_name] = journal
+    return journal
+
+
+def compact_frame_journal(json_file_name, background=True):
+    
+    """
+    Summary:
+        Compact the frame journal of a video into its frame store.
+        
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+        background: if True, compact on a background thread
+        
+    Returns:
+        None
+    """
+    
+    journal = frame_journals.get(json_file_name, None)
+    if journal is None:
+        return
+    if background:
+        journal.compact_in_background()
+    else:
+        journal.compact()
+
+
+def close_frame_store(json_file_name, delete=False):
+    
+    """
+    Summary:
+        Close the frame store of a video (the journal is compacted first).
+        
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+        delete: if True, the store, journal and id index files are deleted and the pending changes are dropped
+        
+    Returns:
+        None
+    """
+    
+    store_file_name = store_path_from_json(json_file_name)
+    journal = frame_journals.pop(json_file_name, None)
+    if journal is not None:
+        if delete:
+            journal.clear()
+        journal.close()
+    store = frame_stores.pop(json_file_name, None)
+    if store is not None:
+        store.close()
+    if delete:
+        for file_name in [store_file_name, journal_path_from_json(json_file_name), id_index_path_from_json(json_file_name)]:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+
+def close_all_frame_stores():
+    
+    """
+    Summary:
+        Compact the journals and close the frame stores of all the opened videos (called on exit).
+        
+    Returns:
+        None
+    """
+    
+    for json_file_name in list(frame_stores.keys()):
+        close_frame_store(json_file_name)
+
+
+def export_frame_store_to_json(json_file_name, nTotalFrames):
+    
+    """
+    Summary:
+        Write the json results file of a video from its frame store, the exporters read the json file.
+        
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+        nTotalFrames: the total number of frames
+        
+    Returns:
+        None
+    """
+    
+    journal = get_frame_journal(json_file_name, nTotalFrames)
+    journal.compact()
+    journal.store.export_json(json_file_name)
+
+
+def get_frame_objects(json_file_name, nTotalFrames, frame_idx):
+    
+    """
+    Summary:
+        Get the objects of a single frame of a video, only this frame is decoded.
+        
+    Args:
+        json_file_name: the name of the json file
+        nTotalFrames: the total number of frames
+        frame_idx: the frame index (starts from 1)
+        
+    Returns:
+        frame_data: a list of objects (each object is a dictionary with keys (tracker_id, bbox, confidence, class_name, class_id, segment))
+    """
+    
+    return get_frame_journal(json_file_name, nTotalFrames).read_frame(frame_idx)
+
+
+def iter_frames(json_file_name, nTotalFrames, frames=None):
+    
+    """
+    Summary:
+        Iterate over the objects of some frames of a video, only the requested frames are decoded.
+        
+    Args:
+        json_file_name: the name of the json file
+        nTotalFrames: the total number of frames
+        frames: an iterable of frame indices (starts from 1), if None all frames are iterated
+        
+    Returns:
+        a generator of (frame_idx, frame_data)
+    """
+    
+    return get_frame_journal(json_file_name, nTotalFrames).iter_frames(frames)
+
+
+def set_frame_objects(json_file_name, nTotalFrames, frames):
+    
+    """
+    Summary:
+        Set the objects of some frames of a video (appended to the frame journal).
+        
+    Args:
+        json_file_name: the name of the json file
+        nTotalFrames: the total number of frames
+        frames: an iterable of (frame_idx, frame_data)
+        
+    Returns:
+        None
+    """
+    
+    get_frame_journal(json_file_name, nTotalFrames).append_frames(
+        (frame_idx, frame_data) for frame_idx, frame_data in frames
+        if 0 < frame_idx <= nTotalFrames)
+
+
 def load_objects_from_json__orjson(json_file_name, nTotalFrames):
     
     """
     Summary:
-        Load objects from a json file using orjson library.
+        Load objects of a video from its frame store and journal (records are decoded using orjson library).
         
     Args:
         json_file_name: the name of the json file
@@ -1065,35 +1324,35 @@ def load_objects_from_json__orjson(json_file_name, nTotalFrames):
         listObj: a list of objects (each object is a dictionary of a frame with keys (frame_idx, frame_data))
     """
     
-    listObj = [{'frame_idx': i + 1, 'frame_data': []}
-                for i in range(nTotalFrames)]
-    if not os.path.exists(json_file_name):
-        with open(json_file_name, "wb") as jf:
-            jf.write(orjson.dumps(listObj))
-        jf.close()
-    with open(json_file_name, "rb") as jf:
-        listObj = orjson.loads(jf.read())
-    jf.close()
-    return listObj
+    return get_frame_journal(json_file_name, nTotalFrames).to_list()
 
 
-def load_objects_to_json__orjson(json_file_name, listObj):
+def load_objects_to_json__orjson(json_file_name, listObj, frames=None):
     
     """
     Summary:
-        Load objects to a json file using orjson library.
+        Load objects of a video to its frame journal (records are encoded using orjson library).
+        Only the given frames are appended to the journal, the other frames are left untouched.
         
     Args:
         json_file_name: the name of the json file
         listObj: a list of objects (each object is a dictionary of a frame with keys (frame_idx, frame_data))
+        frames: the indices of the changed frames (starts from 1), if None the whole store is rewritten
         
     Returns:
         None
     """
     
-    with open(json_file_name, "wb") as jf:
-        jf.write(orjson.dumps(listObj, option=orjson.OPT_INDENT_2))
-    jf.close()
+    journal = get_frame_journal(json_file_name, len(listObj))
+    if frames is None:
+        if journal.compaction_thread is not None:
+            journal.compaction_thread.join()
+        journal.clear()
+        journal.store.from_list(listObj)
+    else:
+        set_frame_objects(json_file_name, len(listObj),
+                          ((frame_idx, listObj[frame_idx - 1]['frame_data'])
+                           for frame_idx in sorted(set(frames)) if 0 < frame_idx <= len(listObj)))
 
 
 def scaleQTshape(self, originalshape, center, ratioX, ratioY):
@@ -1325,8 +1584,7 @@ def delete_id_from_rec_and_traj(id, id_frames_rec, trajectories, frames):
     id_frames_rec['id_' + str(id)] = id_frames_rec['id_' + str(id)] - set(frames)
     
     # remove frames from trajectories for this id
-    for frame in frames:
-        trajectories['id_' + str(id)][frame - 1] = (-1, -1)
+    trajectories['id_' + str(id)].remove(frames)
         
     return id_frames_rec, trajectories
     
@@ -1359,16 +1617,14 @@ def transfer_rec_and_traj(id, id_frames_rec, trajectories, frames, new_id):
         new_id_traj = trajectories['id_' + str(new_id)]
     except:
         new_id_rec = set()
-        new_id_traj = [(-1, -1)] * len(id_traj)
+        new_id_traj = Trajectory()
         
     # transfer frames
     id_rec = id_rec - set(frames)
     new_id_rec = new_id_rec.union(set(frames))
     
     # transfer trajectories
-    for frame in frames:
-        new_id_traj[frame - 1] = id_traj[frame - 1]
-        id_traj[frame - 1] = (-1, -1)
+    new_id_traj.update(id_traj.pop(frames))
     
     id_frames_rec['id_' + str(id)] = id_rec
     id_frames_rec['id_' + str(new_id)] = new_id_rec
@@ -0,0 +1,111 @@
+import os
+
+import orjson
+
+from .trajectory import Trajectory
+
+
+"""
+ID Index Structure:
+    The id index is a sidecar file of a video (*_tracking_results.ids) that holds for each tracker id
+    the frames it appears in, its first and last frames, its trajectory centers and its color.
+    It lets openVideo restore id_frames_rec and the trajectories without decoding every frame of the video.
+
+    {
+        "generation": the generation of the frame store the index was saved with,
+        "ids": {
+            "<id>": {"frames": [...], "first": int, "last": int, "centers": [[frame, cx, cy], ...], "color": [b, g, r]}
+        }
+    }
+
+    The index is stale if its generation is not the generation of the frame store (the store was written after the index).
+"""
+
+
+def id_index_path_from_json(json_file_name):
+
+    """
+    Summary:
+        Get the path of the id index of a video from the path of its json results file.
+
+    Args:
+        json_file_name: the name of the json file (*_tracking_results.json)
+
+    Returns:
+        id_index_file_name: the name of the id index file (*_tracking_results.ids)
+    """
+
+    return os.path.splitext(json_file_name)[0] + ".ids"
+
+
+def save_id_index(file_name, generation, id_frames_rec, trajectories):
+
+    """
+    Summary:
+        Save the id index of a video.
+
+    Args:
+        file_name: the name of the id index file
+        generation: the generation of the frame store
+        id_frames_rec: a dictionary of id frames records ('id_N' -> set of frames)
+        trajectories: a dictionary of trajectories ('id_N' -> Trajectory, 'id_color_N' -> color)
+
+    Returns:
+        None
+    """
+
+    ids = {}
+    for key, frames in id_frames_rec.items():
+        id = key[3:]
+        if len(frames) == 0:
+            continue
+        centers = trajectories.get('id_' + id, None)
+        color = trajectories.get('id_color_' + id, None)
+        ids[id] = {
+            'frames': sorted(frames),
+            'first': min(frames),
+            'last': max(frames),
+            'centers': centers.to_array().tolist() if centers is not None else [],
+            'color': list(color) if color is not None else None,
+        }
+
+    tmp_file_name = file_name + ".tmp"
+    with open(tmp_file_name, "wb") as f:
+        f.write(orjson.dumps({'generation': generation, 'ids': ids}))
+    os.replace(tmp_file_name, file_name)
+
+
+def load_id_index(file_name, generation, nTotalFrames):
+
+    """
+    Summary:
+        Load the id index of a video if it exists and is not stale.
+
+    Args:
+        file_name: the name of the id index file
+        generation: the generation of the frame store
+        nTotalFrames: the total number of frames
+
+    Returns:
+        (id_frames_rec, trajectories) or None if the index is missing, stale or corrupted
+    """
+
+    if not os.path.exists(file_name):
+        return None
+    try:
+        with open(file_name, "rb") as f:
+            index = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if index.get('generation', None) != generation:
+        return None
+
+    id_frames_rec = {}
+    trajectories = {}
+    for id, record in index['ids'].items():
+        id_frames_rec['id_' + id] = set(record['frames'])
+        centers = [center for center in record['centers'] if 0 < center[0] <= nTotalFrames]
+        trajectories['id_' + id] = Trajectory(centers)
+        if record['color'] is not None:
+            trajectories['id_color_' + id] = tuple(record['color'])
+    return id_frames_rec, trajectories
@@ -0,0 +1,174 @@
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from labelme.label_file import LabelFile
+from labelme.logger import logger
+from .frame_buffer import FrameBuffer
+
+
+"""
+Image Prefetch:
+    In image directory mode, the images next to the current one in the file list (and their label files) are loaded
+    in the background, so opening the next or the previous image does not wait for the file I/O, the JSON parsing and the decode.
+
+        entry:      (signature, labelFile, frameBuffer), the future of the entry is cached as soon as it is submitted,
+                    so an image that is opened while it is being prefetched waits for it instead of loading it again
+        signature:  the (modification time, size) of the image and of its label file when they were read,
+                    an entry whose files changed since then is stale and is not used
+        bound:      at most max_entries entries are kept, the least recently requested ones are dropped first
+
+    Saving or deleting a label file invalidates the entry of its image.
+"""
+
+
+def file_signature(filename, label_file):
+    signature = []
+    for path in [filename, label_file]:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def load_frame(filename, labelFile=None):
+
+    """
+    Summary:
+        Decode an image (the image of its label file if given) into a frame buffer.
+
+    Args:
+        filename: the path of the image
+        labelFile: the LabelFile of the image (default: None -> the image file is read)
+
+    Returns:
+        frame: a FrameBuffer, None if the image can not be read
+    """
+
+    if labelFile is not None:
+        image_array = labelFile.image_array()
+    else:
+        image_array = LabelFile.load_image_array(filename)
+    if image_array is not None:
+        return FrameBuffer.from_rgb(image_array)
+    # 16 bit images (OpenCV converts them to 8 bits)
+    frame_array = cv2.imread(filename)
+    return FrameBuffer(frame_array) if frame_array is not None else None
+
+
+def load_entry(filename, label_file):
+
+    """
+    Summary:
+        Load an image and its label file.
+
+    Args:
+        filename: the path of the image
+        label_file: the path of its label file
+
+    Returns:
+        entry: (signature, labelFile, frameBuffer), labelFile is None if there is no label file
+    """
+
+    signature = file_signature(filename, label_file)
+    labelFile = None
+    if signature[1] is not None and LabelFile.is_label_file(label_file):
+        labelFile = LabelFile(label_file)
+    return signature, labelFile, load_frame(filename, labelFile)
+
+
+class ImagePrefetcher(object):
+
+    """
+    Summary:
+        Load the neighbours of the current image of an image directory on a thread pool, into a bounded cache.
+    """
+
+    def __init__(self, max_entries=8, max_workers=2):
+
+        """
+        Summary:
+            Create an image prefetcher.
+
+        Args:
+            max_entries: the maximum number of cached images (default: 8)
+            max_workers: the number of loading threads (default: 2)
+        """
+
+        self.max_entries = max_entries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def prefetch(self, files):
+
+        """
+        Summary:
+            Start loading images that are not cached yet.
+
+        Args:
+            files: a list of (image path, label file path), the most wanted first
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            for filename, label_file in files:
+                if filename not in self.entries:
+                    self.entries[filename] = self.executor.submit(load_entry, filename, label_file)
+            # the most wanted entries are dropped last
+            for filename, _ in reversed(files):
+                self.entries.move_to_end(filename)
+            while len(self.entries) > self.max_entries:
+                _, future = self.entries.popitem(last=False)
+                future.cancel()
+
+    def get(self, filename, label_file):
+
+        """
+        Summary:
+            Get a prefetched image (waits for it if it is being loaded).
+
+        Args:
+            filename: the path of the image
+            label_file: the path of its label file
+
+        Returns:
+            entry: (labelFile, frameBuffer), None if the image is not cached, its files changed or it failed to load
+                   (the caller loads it and reports the error)
+        """
+
+        with self.lock:
+            future = self.entries.pop(filename, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            signature, labelFile, frameBuffer = future.result()
+        except Exception as e:
+            logger.warning(f"prefetching {filename} failed: {e}")
+            return None
+        if frameBuffer is None or signature != file_signature(filename, label_file):
+            return None
+        return labelFile, frameBuffer
+
+    def invalidate(self, filename):
+        with self.lock:
+            future = self.entries.pop(filename, None)
+        if future is not None:
+            future.cancel()
+
+    def clear(self):
+        with self.lock:
+            for future in self.entries.values():
+                future.cancel()
+            self.entries.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False)
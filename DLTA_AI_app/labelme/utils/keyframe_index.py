@@ -0,0 +1,156 @@
+import bisect
+import os
+
+import cv2
+import orjson
+
+
+"""
+Keyframe Index Structure:
+    The keyframe index of a video holds the indices (starts from 1) of its keyframes.
+    It is built once by a single demux pass (packets are read without decoding them)
+    and cached next to the video (*_keyframes.json), keyed by the size and modification time of the video.
+
+    {"size": int, "mtime": float, "nFrames": int, "keyframes": [1, 251, 501, ...]}
+
+    Random access seeks to the keyframe preceding the target frame and decodes forward,
+    instead of relying on CAP_PROP_POS_FRAMES for every frame.
+"""
+
+
+def keyframe_index_path(video_path):
+
+    """
+    Summary:
+        Get the path of the keyframe index cache of a video.
+
+    Args:
+        video_path: the path of the video file
+
+    Returns:
+        index_file_name: the name of the keyframe index file (*_keyframes.json)
+    """
+
+    return os.path.splitext(video_path)[0] + "_keyframes.json"
+
+
+class KeyframeIndex(object):
+
+    def __init__(self, keyframes, nFrames):
+
+        """
+        Summary:
+            Create a keyframe index.
+
+        Args:
+            keyframes: a sorted list of keyframe indices (starts from 1)
+            nFrames: the number of frames of the video
+        """
+
+        self.keyframes = keyframes if len(keyframes) > 0 and keyframes[0] == 1 else [1] + list(keyframes)
+        self.nFrames = nFrames
+
+    def preceding(self, frame_idx):
+
+        """
+        Summary:
+            Get the keyframe at or before a frame.
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+
+        Returns:
+            keyframe_idx: the index of the preceding keyframe (starts from 1)
+        """
+
+        return self.keyframes[max(bisect.bisect_right(self.keyframes, frame_idx) - 1, 0)]
+
+    @staticmethod
+    def build(video_path):
+
+        """
+        Summary:
+            Build the keyframe index of a video by a single demux pass.
+
+        Args:
+            video_path: the path of the video file
+
+        Returns:
+            index: a KeyframeIndex or None if the OpenCV build can not read raw packets (every frame is then treated as a keyframe)
+        """
+
+        has_key_frame = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+        if has_key_frame is None:
+            return None
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+        try:
+            # read the packets without decoding them
+            if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+                return None
+            keyframes = []
+            nFrames = 0
+            while cap.grab():
+                nFrames += 1
+                if cap.get(has_key_frame):
+                    keyframes.append(nFrames)
+        finally:
+            cap.release()
+        if len(keyframes) == 0:
+            return None
+        return KeyframeIndex(keyframes, nFrames)
+
+    @staticmethod
+    def load_cached(video_path):
+
+        """
+        Summary:
+            Load the cached keyframe index of a video without building it.
+
+        Args:
+            video_path: the path of the video file
+
+        Returns:
+            index: a KeyframeIndex or None if it is not cached or stale
+        """
+
+        try:
+            stat = os.stat(video_path)
+            with open(keyframe_index_path(video_path), "rb") as f:
+                cached = orjson.loads(f.read())
+            if cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+                return KeyframeIndex(cached["keyframes"], cached["nFrames"])
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    @staticmethod
+    def load_or_build(video_path):
+
+        """
+        Summary:
+            Load the cached keyframe index of a video, build and cache it if it is missing or stale.
+
+        Args:
+            video_path: the path of the video file
+
+        Returns:
+            index: a KeyframeIndex or None if it can not be built
+        """
+
+        index = KeyframeIndex.load_cached(video_path)
+        if index is not None:
+            return index
+
+        index_file_name = keyframe_index_path(video_path)
+        stat = os.stat(video_path)
+        index = KeyframeIndex.build(video_path)
+        if index is None:
+            return None
+        try:
+            with open(index_file_name, "wb") as f:
+                f.write(orjson.dumps({"size": stat.st_size, "mtime": stat.st_mtime,
+                                      "nFrames": index.nFrames, "keyframes": index.keyframes}))
+        except OSError:
+            # the folder of the video may be read only, the index is rebuilt next time
+            pass
+        return index
@@ -0,0 +1,230 @@
+from time import time
+
+import numpy as np
+
+from .polygonize import box_extent
+
+
+"""
+Multi-model Mask Fusion:
+    The detections of the merged models are fused class by class. Each instance is kept as the crop of its mask
+    to its extent (an Instance), so comparing two instances only touches the pixels where both of their extents overlap,
+    and the full-size masks are neither copied nor compared.
+
+    The models are visited in order, each instance of a model is matched to the fused clusters of the previous models:
+
+        candidates: the mask IoU of two instances is at most  overlap(extents) / max(area1, area2)
+                    so the pairs whose bound is not above the threshold are filtered out without touching their masks
+        matching:   the mask IoU of the remaining pairs is computed on the crops, an instance joins the cluster
+                    with the highest IoU above the threshold (a cluster takes at most one instance of each model)
+        fusion:     each cluster is fused into one detection with the fusion strategy
+
+    Fusion strategies:
+        union:    box = union of the boxes, confidence = max, mask = union of the masks
+        weighted: box = confidence weighted mean of the boxes, confidence = sum / number of models,
+                  mask = the pixels with a confidence weighted vote of at least half
+        best:     the member with the highest confidence
+"""
+
+
+fusion_strategies = ["union", "weighted", "best"]
+
+
+class Instance(object):
+
+    def __init__(self, box, mask):
+
+        """
+        Summary:
+            Crop a detection mask to its extent.
+
+        Args:
+            box: the detection box (x1, y1, x2, y2, confidence)
+            mask: the full-size mask of the detection (h, w), kept as is (not copied)
+        """
+
+        self.box = np.asarray(box, dtype=float)
+        self.mask = mask
+        self.shape = mask.shape
+        self.extent = box_extent(mask, self.box)
+        r0, c0, r1, c1 = self.extent
+        self.crop = mask[r0:r1, c0:c1] > 0
+        self.area = int(np.count_nonzero(self.crop))
+
+    def iou(self, other):
+        r0, c0 = max(self.extent[0], other.extent[0]), max(self.extent[1], other.extent[1])
+        r1, c1 = min(self.extent[2], other.extent[2]), min(self.extent[3], other.extent[3])
+        if r1 <= r0 or c1 <= c0:
+            return 0.0
+        a = self.crop[r0 - self.extent[0]:r1 - self.extent[0], c0 - self.extent[1]:c1 - self.extent[1]]
+        b = other.crop[r0 - other.extent[0]:r1 - other.extent[0], c0 - other.extent[1]:c1 - other.extent[1]]
+        intersection = np.count_nonzero(a & b)
+        union = self.area + other.area - intersection
+        return intersection / union if union > 0 else 0.0
+
+
+def iou_upper_bounds(instances1, instances2):
+
+    """
+    Summary:
+        Get an upper bound of the mask IoU of every pair of instances from their extents and areas (vectorized).
+
+    Args:
+        instances1: a list of n Instance
+        instances2: a list of m Instance
+
+    Returns:
+        bounds: an array of shape (n, m)
+    """
+
+    extents1 = np.array([instance.extent for instance in instances1], dtype=float).reshape(-1, 4)
+    extents2 = np.array([instance.extent for instance in instances2], dtype=float).reshape(-1, 4)
+    areas1 = np.array([instance.area for instance in instances1], dtype=float)
+    areas2 = np.array([instance.area for instance in instances2], dtype=float)
+    rows = np.clip(np.minimum(extents1[:, None, 2], extents2[None, :, 2]) - np.maximum(extents1[:, None, 0], extents2[None, :, 0]), 0, None)
+    cols = np.clip(np.minimum(extents1[:, None, 3], extents2[None, :, 3]) - np.maximum(extents1[:, None, 1], extents2[None, :, 1]), 0, None)
+    largest = np.maximum(areas1[:, None], areas2[None, :])
+    return np.divide(rows * cols, largest, out=np.zeros_like(largest), where=largest > 0)
+
+
+class MaskFusion(object):
+
+    def __init__(self, iou_threshold=0.5, strategy="union"):
+
+        """
+        Summary:
+            Create a fusion engine for the detections of several models.
+
+        Args:
+            iou_threshold: the mask IoU above which two detections of different models are the same object (default: 0.5)
+            strategy: the fusion strategy, one of fusion_strategies (default: union)
+        """
+
+        if strategy not in fusion_strategies:
+            raise ValueError(f"unknown fusion strategy {strategy}, expected one of {fusion_strategies}")
+        self.iou_threshold = iou_threshold
+        self.strategy = strategy
+        self.timings = {}
+        self.counts = {}
+
+    def fuse(self, models_results):
+
+        """
+        Summary:
+            Fuse the detections of several models (the timing of each stage is kept in self.timings, in ms).
+
+        Args:
+            models_results: a dictionary of model name -> (results0, results1),
+                results0: a list of the boxes (k, 5) of each class, results1: a list of the full-size masks of each class
+
+        Returns:
+            results0, results1: the fused boxes (k, 5) and masks of each class
+        """
+
+        self.timings = {"crop": 0.0, "candidates": 0.0, "match": 0.0, "fuse": 0.0}
+        self.counts = {"pairs": 0, "candidates": 0, "merged": 0}
+        models = list(models_results.values())
+        nModels = len(models)
+        classnos = max([len(results1) for _, results1 in models], default=0)
+
+        results0, results1 = [], []
+        for classno in range(classnos):
+            clusters = []
+            for boxes, masks in models:
+                if classno >= len(masks) or len(masks[classno]) == 0:
+                    continue
+                tic = time()
+                instances = [Instance(box, mask) for box, mask in zip(boxes[classno], masks[classno])]
+                self.timings["crop"] += time() - tic
+                self.match(clusters, instances)
+
+            tic = time()
+            fused = [self.fuse_cluster(cluster, nModels) for cluster in clusters]
+            results0.append(np.array([box for box, _ in fused], dtype=float).reshape(-1, 5))
+            results1.append([mask for _, mask in fused])
+            self.timings["fuse"] += time() - tic
+
+        self.timings = {stage: seconds * 1000 for stage, seconds in self.timings.items()}
+        return results0, results1
+
+    def match(self, clusters, instances):
+
+        """
+        Summary:
+            Add the instances of a model to the clusters of the previous models (the clusters are updated in place).
+
+        Args:
+            clusters: a list of clusters, each cluster is a list of Instance (its first instance represents it)
+            instances: a list of Instance of one model
+
+        Returns:
+            None
+        """
+
+        if len(clusters) == 0:
+            clusters.extend([instance] for instance in instances)
+            return
+
+        tic = time()
+        bounds = iou_upper_bounds([cluster[0] for cluster in clusters], instances)
+        candidates = np.argwhere(bounds > self.iou_threshold)
+        self.counts["pairs"] += bounds.size
+        self.counts["candidates"] += len(candidates)
+        self.timings["candidates"] += time() - tic
+
+        tic = time()
+        ious = []
+        for i, j in candidates:
+            iou = clusters[i][0].iou(instances[j])
+            if iou > self.iou_threshold:
+                ious.append((iou, i, j))
+        # the pairs with the highest IoU are matched first
+        ious.sort(key=lambda x: x[0], reverse=True)
+        matched_clusters, matched_instances = set(), set()
+        for _, i, j in ious:
+            if i in matched_clusters or j in matched_instances:
+                continue
+            clusters[i].append(instances[j])
+            matched_clusters.add(i)
+            matched_instances.add(j)
+            self.counts["merged"] += 1
+        clusters.extend([instance] for j, instance in enumerate(instances) if j not in matched_instances)
+        self.timings["match"] += time() - tic
+
+    def fuse_cluster(self, cluster, nModels):
+
+        """
+        Summary:
+            Fuse the instances of a cluster into one detection with the fusion strategy.
+
+        Args:
+            cluster: a list of Instance
+            nModels: the number of fused models (for the weighted confidence)
+
+        Returns:
+            box, mask: the fused box (x1, y1, x2, y2, confidence) and the fused full-size mask
+        """
+
+        if len(cluster) == 1:
+            return cluster[0].box, cluster[0].mask
+        boxes = np.array([instance.box for instance in cluster])
+        scores = boxes[:, 4]
+        if self.strategy == "best":
+            best = cluster[int(np.argmax(scores))]
+            return best.box, best.mask
+
+        extents = np.array([instance.extent for instance in cluster])
+        r0, c0 = extents[:, :2].min(axis=0)
+        r1, c1 = extents[:, 2:].max(axis=0)
+        votes = np.zeros((r1 - r0, c1 - c0), dtype=float)
+        for instance in cluster:
+            ir0, ic0, ir1, ic1 = instance.extent
+            votes[ir0 - r0:ir1 - r0, ic0 - c0:ic1 - c0] += instance.crop * (instance.box[4] if self.strategy == "weighted" else 1.0)
+        mask = np.zeros(cluster[0].shape, dtype=bool)
+        if self.strategy == "weighted":
+            mask[r0:r1, c0:c1] = votes >= scores.sum() / 2
+            box = np.append((boxes[:, :4] * scores[:, None]).sum(axis=0) / scores.sum(), scores.sum() / max(nModels, len(cluster)))
+        else:
+            mask[r0:r1, c0:c1] = votes > 0
+            box = np.append([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()], scores.max())
+        return box, mask
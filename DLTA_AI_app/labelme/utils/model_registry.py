@@ -0,0 +1,138 @@
+import collections
+import threading
+
+import torch
+
+from labelme.logger import logger
+
+
+def model_size(model):
+
+    """
+    Summary:
+        Estimate the memory of a loaded model (parameters and buffers).
+
+    Args:
+        model: a torch module, or an object holding one in its model attribute (YOLO, Sam_Predictor)
+
+    Returns:
+        size: the size in bytes (0 if it can not be estimated)
+    """
+
+    module = model if isinstance(model, torch.nn.Module) else getattr(model, "model", None)
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelRegistry(object):
+
+    """
+    Summary:
+        LRU cache of loaded models keyed by (config, checkpoint, device).
+        Switching models or annotating with several models (merge segmentation models) reuses the loaded models
+        instead of building them again; the least recently used models are evicted above the memory budget.
+    """
+
+    def __init__(self, max_memory_mb=4096):
+
+        """
+        Summary:
+            Create a model registry.
+
+        Args:
+            max_memory_mb: the memory budget of the loaded models in MB (default: 4096), the most recent model is always kept
+        """
+
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.models = collections.OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.models
+
+    def __len__(self):
+        with self.lock:
+            return len(self.models)
+
+    def memory(self):
+        with self.lock:
+            return sum(self.sizes.values())
+
+    def get(self, key, loader):
+
+        """
+        Summary:
+            Get a loaded model, load it with the loader if it is not in the registry.
+
+        Args:
+            key: (config, checkpoint, device)
+            loader: a function that loads the model (called without arguments)
+
+        Returns:
+            model: the loaded model
+        """
+
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+            model = loader()
+            self.models[key] = model
+            self.sizes[key] = model_size(model)
+            self._evict_over_budget()
+            return model
+
+    def _evict_over_budget(self):
+        evicted = False
+        while len(self.models) > 1 and sum(self.sizes.values()) > self.max_memory_bytes:
+            key, _ = self.models.popitem(last=False)
+            self.sizes.pop(key)
+            logger.info(f"model registry: evicted {key[1]}")
+            evicted = True
+        if evicted:
+            torch.cuda.empty_cache()
+
+    def evict(self, key):
+
+        """
+        Summary:
+            Remove a model from the registry (e.g. its checkpoint was deleted or updated).
+
+        Args:
+            key: (config, checkpoint, device)
+
+        Returns:
+            evicted: True if the model was in the registry
+        """
+
+        with self.lock:
+            if key not in self.models:
+                return False
+            self.models.pop(key)
+            self.sizes.pop(key)
+        torch.cuda.empty_cache()
+        return True
+
+    def set_budget(self, max_memory_mb):
+        with self.lock:
+            self.max_memory_bytes = max_memory_mb * 1024 * 1024
+            self._evict_over_budget()
+
+    def clear(self):
+
+        """
+        Summary:
+            Remove all the models from the registry.
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            self.models.clear()
+            self.sizes.clear()
+        torch.cuda.empty_cache()
@@ -0,0 +1,149 @@
+import time
+
+import cv2
+import numpy as np
+
+
+def box_iou_matrix(boxes):
+
+    """
+    Summary:
+        Compute the IoU of every pair of boxes (vectorized).
+
+    Args:
+        boxes: an array of shape (n, 4) of (xmin, ymin, xmax, ymax)
+
+    Returns:
+        iou: an array of shape (n, n)
+    """
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    inter_w = np.clip(np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    union = areas[:, None] + areas[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def polygon_mask_iou_matrix(segments, boxes):
+
+    """
+    Summary:
+        Compute the mask IoU of every pair of polygons.
+        Each polygon is rasterized once in its own box, and only the pairs whose boxes intersect are compared (on their intersection).
+
+    Args:
+        segments: a list of polygons, each polygon is a list of [x, y] points
+        boxes: an array of shape (n, 4) of (xmin, ymin, xmax, ymax), the boxes of the polygons
+
+    Returns:
+        iou: an array of shape (n, n)
+    """
+
+    boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+    n = len(boxes)
+    masks = []
+    for segment, (x1, y1, x2, y2) in zip(segments, boxes):
+        mask = np.zeros((y2 - y1 + 1, x2 - x1 + 1), dtype=np.uint8)
+        if len(segment) > 0:
+            cv2.fillPoly(mask, [np.asarray(segment, dtype=np.int32) - [x1, y1]], 1)
+        masks.append(mask.astype(bool))
+    areas = np.array([mask.sum() for mask in masks], dtype=np.float64)
+
+    iou = np.zeros((n, n))
+    x1 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    y1 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x2 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    y2 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    for i, j in zip(*np.nonzero(np.triu((x1 <= x2) & (y1 <= y2), 1))):
+        bi, bj = boxes[i], boxes[j]
+        crop_i = masks[i][y1[i, j] - bi[1]:y2[i, j] - bi[1] + 1, x1[i, j] - bi[0]:x2[i, j] - bi[0] + 1]
+        crop_j = masks[j][y1[i, j] - bj[1]:y2[i, j] - bj[1] + 1, x1[i, j] - bj[0]:x2[i, j] - bj[0] + 1]
+        inter = np.count_nonzero(crop_i & crop_j)
+        union = areas[i] + areas[j] - inter
+        iou[i, j] = iou[j, i] = inter / union if union > 0 else 0
+    np.fill_diagonal(iou, 1.0)
+    return iou
+
+
+def nms(boxes, scores, iou_threshold=0.5, class_ids=None, segments=None):
+
+    """
+    Summary:
+        Greedy non-maximum suppression: the detections are visited by decreasing score,
+        a detection is kept if its IoU with every kept detection is not greater than the threshold.
+
+    Args:
+        boxes: an array of shape (n, 4) of (xmin, ymin, xmax, ymax)
+        scores: an array of shape (n,)
+        iou_threshold: the IoU threshold (default: 0.5)
+        class_ids: an array of shape (n,) to only suppress detections of the same class (default: None -> class agnostic)
+        segments: a list of n polygons to use the mask IoU instead of the box IoU (default: None -> box IoU)
+
+    Returns:
+        keep: an int array of the indices of the kept detections, sorted by decreasing score
+    """
+
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    n = len(scores)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    # stable, so equal scores keep their input order
+    order = np.argsort(-scores, kind="stable")
+    boxes = np.asarray(boxes).reshape(-1, 4)[order]
+    if segments is None:
+        iou = box_iou_matrix(boxes)
+    else:
+        iou = polygon_mask_iou_matrix([segments[i] for i in order], boxes)
+    suppresses = iou > float(iou_threshold)
+    if class_ids is not None:
+        class_ids = np.asarray(class_ids)[order]
+        suppresses &= class_ids[:, None] == class_ids[None, :]
+
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in range(n):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= suppresses[i]
+    return order[keep]
+
+
+def benchmark(n=1000, image_size=(2160, 3840), seed=0):
+
+    """
+    Summary:
+        Time the box NMS, the class-aware NMS and the mask NMS on n random detections.
+
+    Args:
+        n: the number of detections (default: 1000)
+        image_size: the size of the image the detections are in (default: 4K)
+        seed: the random seed (default: 0)
+
+    Returns:
+        timings: a dictionary of mode -> (seconds, number of kept detections)
+    """
+
+    rng = np.random.default_rng(seed)
+    h, w = image_size
+    xy = rng.uniform(0, [w - 200, h - 200], size=(n, 2))
+    wh = rng.uniform(20, 200, size=(n, 2))
+    boxes = np.concatenate([xy, xy + wh], axis=1).astype(int)
+    scores = rng.uniform(0, 1, size=n)
+    class_ids = rng.integers(0, 10, size=n)
+    segments = [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, y1, x2, y2 in boxes]
+
+    timings = {}
+    for mode, kwargs in [("box", {}), ("box per class", {"class_ids": class_ids}), ("mask", {"segments": segments})]:
+        start = time.time()
+        keep = nms(boxes, scores, 0.5, **kwargs)
+        timings[mode] = (time.time() - start, len(keep))
+    return timings
+
+
+if __name__ == "__main__":
+    for n in [1000, 3000]:
+        for mode, (seconds, kept) in benchmark(n).items():
+            print(f"{n} detections, {mode} NMS: {seconds * 1000:.1f} ms ({kept} kept)")
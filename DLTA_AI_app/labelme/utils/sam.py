@@ -7,6 +7,8 @@ import skimage.measure
 import torch
 from shapely.geometry import Polygon
 
+from .polygonize import mask_to_polygon, masks_to_polygons
+
 # import mask_to_polygons from inference.py inside the inference class
 # from inference import mask_to_polygons
 
@@ -100,24 +102,8 @@ class Sam_Predictor():
         return np.linalg.norm(contour_end - contour_start, axis=1).sum()
 
     def mask_to_polygons(self, mask, n_points=25, resize_factors=[1.0, 1.0]):
-        mask = mask > 0.0
-        contours = skimage.measure.find_contours(mask)
-        if len(contours) == 0:
-            return []
-        contour = max(contours, key=self.get_contour_length)
-        coords = skimage.measure.approximate_polygon(
-            coords=contour,
-            tolerance=np.ptp(contour, axis=0).max() / 100,
-        )
-
-        coords = coords * resize_factors
-        # convert coords from x y to y x
-        coords = np.fliplr(coords)
-
-        # segment_points are a list of coords
-        segment_points = coords.astype(int)
-        polygon = segment_points
-        return polygon
+        # only the crop of the mask is traced (see polygonize)
+        return mask_to_polygon(mask, resize_factors=resize_factors)
 
     def polygon_to_shape(self, polygon, score, className="SAM instance"):
         shape = {}
@@ -272,7 +258,10 @@ class Sam_Predictor():
         sortedResult = sorted(sam_result, key=lambda x: x['area'], reverse=True)
         masks = [ mask['segmentation'] for mask in sortedResult]
         scores = [mask['stability_score'] for mask in sortedResult]
-        polygons = [self.mask_to_polygons(mask) for mask in masks]
+        # the automatic mask generator boxes are xywh
+        boxes = [[mask['bbox'][0], mask['bbox'][1], mask['bbox'][0] + mask['bbox'][2], mask['bbox'][1] + mask['bbox'][3]]
+                 for mask in sortedResult]
+        polygons = masks_to_polygons(masks, boxes)
         
         toBeRemoved = []
 
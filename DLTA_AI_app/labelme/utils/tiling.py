@@ -0,0 +1,200 @@
+import cv2
+import numpy as np
+
+from .detection_cache import RawDetections
+
+
+"""
+Tiled Inference:
+    Very large images (aerial, microscopy) are cut into overlapping tiles that are run through the model in batches,
+    so small objects keep their resolution and the memory depends on the tile size, not the image size.
+
+        windows:  tiles of tile_size x tile_size (smaller at the sides of small images), each tile overlaps its neighbours
+                  by overlap * tile_size pixels, the last tile of a row (column) ends at the side of the image
+        shift:    the detections of each tile are shifted to the image coordinates (boxes, and the extents of their masks,
+                  the polygons of YOLO and SAM are rasterized inside their box)
+        seams:    the detections of two tiles that overlap are merged if they have the same class and
+                  their IoU inside the overlap of the two tiles is above the threshold
+                  (an object cut by a tile side and the same object seen whole by the next tile match in the overlap)
+                  merged detections get the union of the boxes and of the masks, and the max confidence
+
+    The merged detections are RawDetections of the whole image, so the usual filters, NMS and fusion stages apply to them.
+"""
+
+
+def tile_windows(image_shape, tile_size=1024, overlap=0.2):
+
+    """
+    Summary:
+        Get the windows of the tiles of an image.
+
+    Args:
+        image_shape: the (height, width) of the image
+        tile_size: the size of the tiles in pixels (default: 1024)
+        overlap: the overlap of neighbouring tiles as a fraction of the tile size (default: 0.2)
+
+    Returns:
+        windows: a list of (x0, y0, x1, y1), end excluded
+    """
+
+    h, w = image_shape[:2]
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+    return [(x0, y0, min(x0 + tile_size, w), min(y0 + tile_size, h)) for y0 in starts(h) for x0 in starts(w)]
+
+
+class TileInstance(object):
+
+    def __init__(self, raw, i, window):
+
+        """
+        Summary:
+            Shift a detection of a tile to the image coordinates.
+
+        Args:
+            raw: the RawDetections of the tile
+            i: the index of the detection
+            window: the window of the tile (x0, y0, x1, y1)
+        """
+
+        x0, y0 = window[0], window[1]
+        self.window = window
+        self.box = raw.boxes[i] + [x0, y0, x0, y0]
+        self.score = raw.scores[i]
+        self.class_id = raw.class_ids[i]
+        if raw.masks is not None:
+            extent, self.crop = raw.crop(i)
+        else:
+            extent, self.crop = rasterize(raw.polygons[i])
+        self.extent = np.asarray(extent) + [y0, x0, y0, x0]
+
+    def in_window(self, window):
+        # the crop of the mask inside a window (x0, y0, x1, y1), None if it is outside
+        r0, c0 = max(self.extent[0], window[1]), max(self.extent[1], window[0])
+        r1, c1 = min(self.extent[2], window[3]), min(self.extent[3], window[2])
+        if r1 <= r0 or c1 <= c0:
+            return None
+        return self.crop[r0 - self.extent[0]:r1 - self.extent[0], c0 - self.extent[1]:c1 - self.extent[1]], (r0, c0, r1, c1)
+
+
+def rasterize(polygon):
+
+    """
+    Summary:
+        Rasterize a polygon inside its box.
+
+    Args:
+        polygon: a list or an array of (x, y) points
+
+    Returns:
+        extent, crop: the extent (row_start, col_start, row_end, col_end) and the boolean mask inside it
+    """
+
+    polygon = np.asarray(polygon, dtype=np.int32).reshape(-1, 2)
+    if len(polygon) < 3:
+        return (0, 0, 0, 0), np.zeros((0, 0), dtype=bool)
+    c0, r0 = polygon.min(axis=0)
+    c1, r1 = polygon.max(axis=0) + 1
+    crop = np.zeros((r1 - r0, c1 - c0), dtype=np.uint8)
+    cv2.fillPoly(crop, [polygon - [c0, r0]], 1)
+    return (r0, c0, r1, c1), crop.astype(bool)
+
+
+def seam_iou(a, b):
+
+    """
+    Summary:
+        Get the IoU of two detections of different tiles inside the overlap of their tiles.
+
+    Args:
+        a, b: TileInstance
+
+    Returns:
+        iou: the IoU inside the overlap (0 if one of them is not in the overlap)
+    """
+
+    overlap = (max(a.window[0], b.window[0]), max(a.window[1], b.window[1]),
+               min(a.window[2], b.window[2]), min(a.window[3], b.window[3]))
+    in_a, in_b = a.in_window(overlap), b.in_window(overlap)
+    if in_a is None or in_b is None:
+        return 0.0
+    (crop_a, extent_a), (crop_b, extent_b) = in_a, in_b
+    area_a, area_b = np.count_nonzero(crop_a), np.count_nonzero(crop_b)
+    r0, c0 = max(extent_a[0], extent_b[0]), max(extent_a[1], extent_b[1])
+    r1, c1 = min(extent_a[2], extent_b[2]), min(extent_a[3], extent_b[3])
+    intersection = 0
+    if r1 > r0 and c1 > c0:
+        intersection = np.count_nonzero(
+            crop_a[r0 - extent_a[0]:r1 - extent_a[0], c0 - extent_a[1]:c1 - extent_a[1]] &
+            crop_b[r0 - extent_b[0]:r1 - extent_b[0], c0 - extent_b[1]:c1 - extent_b[1]])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def merge_tiles(tile_raws, windows, image_shape, iou_threshold=0.5):
+
+    """
+    Summary:
+        Shift the detections of the tiles to the image coordinates and merge the detections split by the seams of the tiles.
+
+    Args:
+        tile_raws: a list of the RawDetections of each tile
+        windows: a list of the windows of the tiles (see tile_windows)
+        image_shape: the (height, width) of the image
+        iou_threshold: the IoU inside the overlap of two tiles above which two detections are merged (default: 0.5)
+
+    Returns:
+        raw: the RawDetections of the image
+    """
+
+    instances = [TileInstance(raw, i, window) for raw, window in zip(tile_raws, windows) for i in range(len(raw))]
+    n = len(instances)
+
+    # union find of the detections to merge
+    parents = list(range(n))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    if n > 1:
+        boxes = np.array([instance.box for instance in instances])
+        class_ids = np.array([instance.class_id for instance in instances])
+        tiles = np.array([instance.window for instance in instances])
+        # candidates: different tiles, same class, overlapping boxes
+        candidates = (class_ids[:, None] == class_ids[None, :]) & np.any(tiles[:, None] != tiles[None, :], axis=2)
+        candidates &= (np.minimum(boxes[:, None, 2], boxes[None, :, 2]) > np.maximum(boxes[:, None, 0], boxes[None, :, 0]))
+        candidates &= (np.minimum(boxes[:, None, 3], boxes[None, :, 3]) > np.maximum(boxes[:, None, 1], boxes[None, :, 1]))
+        for i, j in zip(*np.nonzero(np.triu(candidates, 1))):
+            if find(i) != find(j) and seam_iou(instances[i], instances[j]) > iou_threshold:
+                parents[find(j)] = find(i)
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(instances[i])
+
+    merged_boxes, scores, class_ids, masks = [], [], [], []
+    for group in groups.values():
+        extents = np.array([instance.extent for instance in group])
+        r0, c0 = extents[:, :2].min(axis=0)
+        r1, c1 = extents[:, 2:].max(axis=0)
+        crop = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+        for instance in group:
+            ir0, ic0, ir1, ic1 = instance.extent
+            crop[ir0 - r0:ir1 - r0, ic0 - c0:ic1 - c0] |= instance.crop
+        boxes = np.array([instance.box for instance in group])
+        merged_boxes.append([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()])
+        scores.append(max(instance.score for instance in group))
+        class_ids.append(group[0].class_id)
+        masks.append(((r0, c0, r1, c1), crop))
+
+    round_scores = any(raw.round_scores for raw in tile_raws)
+    return RawDetections.from_crops(np.array(merged_boxes).reshape(-1, 4), scores, class_ids, image_shape, masks,
+                                    round_scores=round_scores)
@@ -0,0 +1,207 @@
+import numpy as np
+
+
+class Trajectory(object):
+
+    """
+    Summary:
+        Sparse trajectory of a tracker id, only the frames in which the id is present are stored.
+        The frames (starts from 1) and the centers are kept sorted by frame in int32 arrays that grow by doubling,
+        so appending the next frame (tracking, scrubbing forward) is O(1) amortized.
+    """
+
+    def __init__(self, points=None):
+
+        """
+        Summary:
+            Create a trajectory.
+
+        Args:
+            points: an array-like of (frame, cx, cy) rows (default: None -> empty trajectory)
+        """
+
+        self.n = 0
+        self.frames = np.zeros(16, dtype=np.int32)
+        self.centers = np.zeros((16, 2), dtype=np.int32)
+        if points is not None and len(points) > 0:
+            self.update(points)
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, size):
+        if size <= len(self.frames):
+            return
+        capacity = max(size, 2 * len(self.frames))
+        frames = np.zeros(capacity, dtype=np.int32)
+        centers = np.zeros((capacity, 2), dtype=np.int32)
+        frames[:self.n] = self.frames[:self.n]
+        centers[:self.n] = self.centers[:self.n]
+        self.frames, self.centers = frames, centers
+
+    def _find(self, frame):
+        i = int(np.searchsorted(self.frames[:self.n], frame))
+        return i, (i < self.n and self.frames[i] == frame)
+
+    def get(self, frame):
+
+        """
+        Summary:
+            Get the center of the id in a frame.
+
+        Args:
+            frame: the frame index (starts from 1)
+
+        Returns:
+            center: (cx, cy) or None if the id is not present in the frame
+        """
+
+        i, found = self._find(frame)
+        if not found:
+            return None
+        return (int(self.centers[i, 0]), int(self.centers[i, 1]))
+
+    def set(self, frame, center):
+
+        """
+        Summary:
+            Set the center of the id in a frame.
+
+        Args:
+            frame: the frame index (starts from 1)
+            center: (cx, cy)
+
+        Returns:
+            None
+        """
+
+        if self.n == 0 or frame > self.frames[self.n - 1]:
+            self._reserve(self.n + 1)
+            self.frames[self.n] = frame
+            self.centers[self.n] = center
+            self.n += 1
+            return
+        i, found = self._find(frame)
+        if not found:
+            self._reserve(self.n + 1)
+            self.frames[i + 1:self.n + 1] = self.frames[i:self.n]
+            self.centers[i + 1:self.n + 1] = self.centers[i:self.n]
+            self.frames[i] = frame
+            self.n += 1
+        self.centers[i] = center
+
+    def update(self, points):
+
+        """
+        Summary:
+            Set the centers of the id in multiple frames (vectorized).
+
+        Args:
+            points: an array-like of (frame, cx, cy) rows
+
+        Returns:
+            None
+        """
+
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 3)
+        keep = ~np.isin(self.frames[:self.n], points[:, 0])
+        frames = np.concatenate([self.frames[:self.n][keep], points[:, 0]])
+        centers = np.concatenate([self.centers[:self.n][keep], points[:, 1:]])
+        order = np.argsort(frames, kind="stable")
+        self._reserve(len(frames))
+        self.n = len(frames)
+        self.frames[:self.n] = frames[order]
+        self.centers[:self.n] = centers[order]
+
+    def pop(self, frames):
+
+        """
+        Summary:
+            Remove the id from multiple frames (vectorized).
+
+        Args:
+            frames: an iterable of frame indices (starts from 1)
+
+        Returns:
+            points: an array of the removed (frame, cx, cy) rows
+        """
+
+        frames = np.fromiter(frames, dtype=np.int32)
+        removed = np.isin(self.frames[:self.n], frames)
+        points = self.to_array()[removed]
+        keep = ~removed
+        n = int(keep.sum())
+        self.frames[:n] = self.frames[:self.n][keep]
+        self.centers[:n] = self.centers[:self.n][keep]
+        self.n = n
+        return points
+
+    def remove(self, frames):
+
+        """
+        Summary:
+            Remove the id from multiple frames (vectorized).
+
+        Args:
+            frames: an iterable of frame indices (starts from 1)
+
+        Returns:
+            None
+        """
+
+        self.pop(frames)
+
+    def tail(self, frame, length):
+
+        """
+        Summary:
+            Get the last consecutive centers of the id ending at a frame (the trajectory to draw).
+
+        Args:
+            frame: the last frame index (starts from 1)
+            length: the maximum number of frames of the trajectory
+
+        Returns:
+            centers: an int32 array of shape (k, 2), empty if the id is not present in the frame
+        """
+
+        end, found = self._find(frame)
+        if not found:
+            return self.centers[:0]
+        start = int(np.searchsorted(self.frames[:self.n], frame - length + 1))
+        frames = self.frames[start:end + 1]
+        # the trajectory stops at the first missing frame before the current frame
+        gaps = np.nonzero(np.diff(frames) != 1)[0]
+        if len(gaps) > 0:
+            start += int(gaps[-1]) + 1
+        return self.centers[start:end + 1]
+
+    def window(self, frame, length):
+
+        """
+        Summary:
+            Get a copy of the trajectory restricted to the frames that can be drawn at a frame.
+
+        Args:
+            frame: the last frame index (starts from 1)
+            length: the maximum number of frames of the trajectory
+
+        Returns:
+            trajectory: a new Trajectory with the centers of the frames (frame - length, frame]
+        """
+
+        start = int(np.searchsorted(self.frames[:self.n], frame - length + 1))
+        end = int(np.searchsorted(self.frames[:self.n], frame, side="right"))
+        return Trajectory(np.column_stack([self.frames[start:end], self.centers[start:end]]))
+
+    def to_array(self):
+
+        """
+        Summary:
+            Get the trajectory as an array of (frame, cx, cy) rows.
+
+        Returns:
+            points: an int32 array of shape (n, 3)
+        """
+
+        return np.column_stack([self.frames[:self.n], self.centers[:self.n]])
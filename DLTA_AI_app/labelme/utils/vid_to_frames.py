@@ -1,18 +1,52 @@
 import os
 import sys
 import cv2
-from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QFileDialog, QSlider, QLineEdit, QVBoxLayout, QHBoxLayout, QDialog, QProgressBar
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QFileDialog, QSlider, QLineEdit, QVBoxLayout, QHBoxLayout, QDialog, QProgressBar, QComboBox, QSpinBox
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 from PyQt5 import QtWidgets
 import qdarktheme
 
+from .keyframe_index import KeyframeIndex
+
+
+# the OpenCV write parameter of the quality of each image format
+image_formats = {
+    "jpg": cv2.IMWRITE_JPEG_QUALITY,
+    "png": cv2.IMWRITE_PNG_COMPRESSION,
+    "webp": cv2.IMWRITE_WEBP_QUALITY,
+}
+
+
+def imwrite_params(image_format, quality):
+
+    """
+    Summary:
+        Get the cv2.imwrite parameters of an image format.
+
+    Args:
+        image_format: the image format (jpg, png or webp)
+        quality: the quality (1 to 100), mapped to the compression level (9 to 0) for png
+
+    Returns:
+        params: the cv2.imwrite parameters
+    """
+
+    if image_format == "png":
+        return [image_formats["png"], round((100 - quality) * 9 / 100)]
+    return [image_formats[image_format], int(quality)]
+
 
 class VideoFrameExtractor(QDialog):
-    def __init__(self, mute = None, notification = None):
+    def __init__(self, mute = None, notification = None, image_format = "jpg", quality = 95, workers = None):
         super().__init__()
         self.mute = mute
         self.notification = notification
+        self.image_format = image_format
+        self.quality = quality
+        # the frames are encoded and written by a pool of threads (cv2.imwrite releases the GIL)
+        self.workers = workers or min(8, os.cpu_count() or 1)
         # set minimum window size
         self.setMinimumSize(500, 300)
 
@@ -86,6 +120,17 @@ class VideoFrameExtractor(QDialog):
         self.end_time_label.setFont(font)
         self.end_time_label.setAlignment(Qt.AlignRight)
 
+        self.format_label = QLabel("Image format:")
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(list(image_formats.keys()))
+        self.format_combo.setCurrentText(self.image_format)
+        self.format_combo.currentTextChanged.connect(self.update_image_format)
+        self.quality_label = QLabel("Quality:")
+        self.quality_spin = QSpinBox()
+        self.quality_spin.setRange(1, 100)
+        self.quality_spin.setValue(self.quality)
+        self.quality_spin.valueChanged.connect(self.update_quality)
+
         self.extract_button = QPushButton("Extract Frames")
         self.extract_button.clicked.connect(self.extract_frames)
         self.extract_button.setEnabled(False)
@@ -144,6 +189,12 @@ class VideoFrameExtractor(QDialog):
         end_layout.setContentsMargins(20, 0, 0, 0)
         range_layout.addLayout(end_layout)
 
+        format_layout = QHBoxLayout()
+        format_layout.addWidget(self.format_label)
+        format_layout.addWidget(self.format_combo)
+        format_layout.addWidget(self.quality_label)
+        format_layout.addWidget(self.quality_spin)
+
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.extract_button)
         button_layout.addWidget(self.stop_button)
@@ -156,6 +207,8 @@ class VideoFrameExtractor(QDialog):
 
         main_layout.addLayout(sampling_layout)
 
+        main_layout.addLayout(format_layout)
+
         main_layout.addLayout(button_layout)
 
         main_layout.addWidget(self.progress_bar)
@@ -233,6 +286,14 @@ class VideoFrameExtractor(QDialog):
         except ValueError:
             pass
 
+    def update_image_format(self, text):
+        # Update the image format of the extracted frames
+        self.image_format = text
+
+    def update_quality(self, value):
+        # Update the quality of the extracted frames
+        self.quality = value
+
     def update_start_frame(self, value):
         # Update the start frame when the slider is moved
         self.start_frame = value
@@ -298,9 +359,41 @@ class VideoFrameExtractor(QDialog):
         return f"{int(h):02d}{separator}{int(m):02d}{separator}{int(s):02d}"
 
 
+    def seek(self, vidcap, vid_path, frame):
+
+        """
+        Summary:
+            Move a capture so that the next read returns the given frame.
+            If the keyframe index of the video is cached (e.g. the video was opened in the app), the capture seeks to
+            the preceding keyframe and grabs forward, otherwise it seeks with CAP_PROP_POS_FRAMES
+            (building the index is a demux of the whole video, longer than one seek).
+
+        Args:
+            vidcap: the cv2.VideoCapture of the video
+            vid_path: the path of the video file
+            frame: the frame number (starts from 0)
+
+        Returns:
+            None
+        """
+
+        if frame <= 0:
+            return
+        keyframe_index = KeyframeIndex.load_cached(vid_path)
+        if keyframe_index is None:
+            vidcap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            return
+        # the keyframe index starts from 1
+        keyframe = keyframe_index.preceding(frame + 1) - 1
+        vidcap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        for _ in range(frame - keyframe):
+            if not vidcap.grab():
+                break
+
     def vid_to_frames(self, vid_path, sampling_rate, start_frame, end_frame):
         """
-        Extracts frames from a video file and saves them as JPEG images.
+        Extracts frames from a video file and saves them as images (self.image_format, self.quality).
+        Skipped frames are only grabbed (not decoded) and the frames are encoded and written by a pool of threads.
 
         Args:
             vid_path (str): Path to the video file.
@@ -328,43 +421,61 @@ class VideoFrameExtractor(QDialog):
         # if the video file does not exist, raise an error
 
         # Set the starting frame
-        vidcap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        self.seek(vidcap, vid_path, start_frame)
 
         # Get the total number of frames in the video
         n_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
         print(f"Total number of frames: {n_frames}")
 
+        params = imwrite_params(self.image_format, self.quality)
+        # bound the frames waiting to be written (decoded 4K frames are large)
+        max_pending = 2 * self.workers
+        pending = []
+
         # Initialize counters
         count = start_frame
-        success = True
-
-        # set progress bar Format
-        while success:
-            success, image = vidcap.read()
-            if count % sampling_rate == 0:
-                # Get the time in the video corresponding to the current frame
-                time_in_sec = count / self.fps
-                time_str = self.get_time_string(time_in_sec, separator="_")
-
-                # Save the image with the time in the file name
-                indented_count = str(count).zfill(len(str(n_frames)))
-                cv2.imwrite(f"{frames_path}/frame_{indented_count}_time_{time_str}.jpg", image)
-            
-            self.progress_bar.setValue(int(((count - start_frame) / (end_frame - start_frame)) * 100))
-            self.progress_bar.setFormat(f"{int(((count - start_frame) / (end_frame - start_frame)) * 100)}%")
+        progress = -1
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while count < end_frame:
+                if count % sampling_rate == 0:
+                    success, image = vidcap.read()
+                    if not success:
+                        break
+                    # Get the time in the video corresponding to the current frame
+                    time_in_sec = count / self.fps
+                    time_str = self.get_time_string(time_in_sec, separator="_")
+
+                    # Save the image with the time in the file name
+                    indented_count = str(count).zfill(len(str(n_frames)))
+                    pending.append(executor.submit(
+                        cv2.imwrite, f"{frames_path}/frame_{indented_count}_time_{time_str}.{self.image_format}", image, params))
+                    if len(pending) >= max_pending:
+                        pending.pop(0).result()
+                # skipped frames are not decoded
+                elif not vidcap.grab():
+                    break
+
+                count += 1
+                # the GUI is only updated when the percentage changes
+                if int(((count - start_frame) / (end_frame - start_frame)) * 100) != progress:
+                    progress = int(((count - start_frame) / (end_frame - start_frame)) * 100)
+                    self.progress_bar.setValue(progress)
+                    self.progress_bar.setFormat(f"{progress}%")
+                    QtWidgets.QApplication.processEvents()
+
+                if self.stop:
+                    self.stop = False
+                    self.progress_bar.setFormat("Extraction stopped")
+                    self.progress_bar.setValue(0)
+                    break
+
+            for future in pending:
+                future.result()
+        vidcap.release()
+        if count >= end_frame:
+            self.progress_bar.setValue(100)
 
-            count += 1
-            if count >= end_frame:
-                self.progress_bar.setValue(100)
-                break
-
-            QtWidgets.QApplication.processEvents()
-            if self.stop:
-                self.stop = False
-                self.progress_bar.setFormat("Extraction stopped")
-                self.progress_bar.setValue(0)
-                break
-            
                     # Show a notification if the model explorer is not the active window
         try:
             if not self.mute:
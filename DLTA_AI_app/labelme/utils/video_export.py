@@ -0,0 +1,237 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from . import helpers
+
+
+"""
+Video Export Pipeline:
+    The annotated video is rendered by three kinds of threads connected by a bounded queue:
+
+        decode (1 thread) -> render (a pool of threads) -> write (1 thread)
+
+    The decode thread reads the video sequentially, builds the shapes of each frame from the frame store
+    and updates the trajectories (they depend on the previous frames so they are updated in order).
+    The exporter builds its own trajectories from the frame store, the trajectories of the app are not touched.
+    Each frame is then rendered by the pool with a private snapshot of the trajectories it draws,
+    and the writer thread writes the rendered frames in order (the futures are queued in frame order).
+"""
+
+
+# the item the decode thread puts in the queue when it is done
+END = None
+
+
+class VideoExporter(object):
+
+    def __init__(self, video_path, output_path, json_file_name, nTotalFrames, flags, trajectories_length=30, alpha=0.7,
+                 fps=None, skip_empty_frames=True, workers=None, queue_size=16, fourcc="mp4v"):
+
+        """
+        Summary:
+            Create a video exporter.
+
+        Args:
+            video_path: the path of the input video
+            output_path: the path of the output video
+            json_file_name: the name of the json results file of the video (the frames are read from its frame store)
+            nTotalFrames: the total number of frames of the video
+            flags: a dictionary of drawing flags (bbox, id, class, conf, traj, mask)
+            trajectories_length: the length of the drawn trajectories (default: 30)
+            alpha: the opacity of the masks (default: 0.7)
+            fps: the fps of the output video (default: None -> the fps of the input video)
+            skip_empty_frames: do not write the frames without objects (default: True)
+            workers: the number of render threads (default: None -> the number of CPUs, up to 8)
+            queue_size: the maximum number of frames being rendered or waiting to be written (default: 16)
+            fourcc: the codec of the output video (default: mp4v)
+        """
+
+        self.video_path = video_path
+        self.output_path = output_path
+        self.json_file_name = json_file_name
+        self.nTotalFrames = nTotalFrames
+        self.flags = dict(flags)
+        self.trajectories = {'length': trajectories_length, 'alpha': alpha}
+        self.fps = fps
+        self.skip_empty_frames = skip_empty_frames
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.queue_size = queue_size
+        self.fourcc = fourcc
+
+        self.cancelled = False
+        self.error = None
+        self.nDecoded = 0
+        self.nWritten = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def progress(self):
+
+        """
+        Summary:
+            Get the progress of the export (can be polled from another thread).
+
+        Returns:
+            (nDecoded, nTotalFrames, nWritten)
+        """
+
+        return self.nDecoded, self.nTotalFrames, self.nWritten
+
+    def _put(self, q, item):
+        while not self.cancelled:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _render(self, frame_idx, image, shapes, trajectories):
+        return helpers.draw_bb_on_image(trajectories, frame_idx, self.flags, self.nTotalFrames,
+                                        image, shapes, image_qt_flag=False)
+
+    def _snapshot(self, frame_idx, shapes):
+
+        """
+        Summary:
+            Copy the part of the trajectories that is drawn on a frame (the render threads must not share them with the decode thread).
+
+        Args:
+            frame_idx: the frame index (starts from 1)
+            shapes: the shapes of the frame
+
+        Returns:
+            trajectories: a dictionary of trajectories
+        """
+
+        length = self.trajectories['length']
+        snapshot = {'length': length, 'alpha': self.trajectories['alpha']}
+        for shape in shapes:
+            id = str(shape["group_id"])
+            snapshot['id_' + id] = self.trajectories['id_' + id].window(frame_idx, length)
+            snapshot['id_color_' + id] = self.trajectories['id_color_' + id]
+        return snapshot
+
+    def _decode(self, executor, rendered):
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            for frame_idx, frame_objects in helpers.iter_frames(self.json_file_name, self.nTotalFrames,
+                                                                range(1, self.nTotalFrames + 1)):
+                if self.cancelled:
+                    break
+                shapes = helpers.frame_objects_to_shapes(frame_objects)
+                if len(shapes) == 0 and self.skip_empty_frames:
+                    # the frame is not needed, it is not decoded either
+                    success = cap.grab()
+                else:
+                    success, image = cap.read()
+                if not success:
+                    break
+                self.nDecoded = frame_idx
+                if len(shapes) == 0:
+                    if not self.skip_empty_frames:
+                        self._put(rendered, executor.submit(lambda image=image: image))
+                    continue
+                helpers.update_trajectories(self.trajectories, frame_idx, shapes)
+                future = executor.submit(self._render, frame_idx, image, shapes, self._snapshot(frame_idx, shapes))
+                if not self._put(rendered, future):
+                    break
+        finally:
+            cap.release()
+            self._put(rendered, END)
+
+    def _write(self, rendered, writer):
+        while True:
+            try:
+                future = rendered.get(timeout=0.1)
+            except queue.Empty:
+                if self.cancelled:
+                    return
+                continue
+            if future is END:
+                return
+            writer.write(future.result())
+            self.nWritten += 1
+
+    def run(self):
+
+        """
+        Summary:
+            Export the video (blocks until the export is done or cancelled).
+
+        Returns:
+            exported: True if the output video was written, False if it is empty or the export was cancelled or failed (the output is removed)
+        """
+
+        cap = cv2.VideoCapture(self.video_path)
+        fps = self.fps or cap.get(cv2.CAP_PROP_FPS)
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*self.fourcc), int(fps), size)
+
+        rendered = queue.Queue(self.queue_size)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def write():
+                try:
+                    self._write(rendered, writer)
+                except Exception as e:
+                    self.error = e
+                    self.cancel()
+            writer_thread = threading.Thread(target=write, daemon=True)
+            writer_thread.start()
+            try:
+                self._decode(executor, rendered)
+            except Exception as e:
+                self.error = e
+                self.cancel()
+            writer_thread.join()
+        writer.release()
+
+        if self.error is not None:
+            print(f"video export failed: {self.error}")
+        if self.cancelled or self.error is not None or self.nWritten == 0:
+            try:
+                os.remove(self.output_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+
+def export_video(video_path, output_path, json_file_name=None, flags=None, trajectories_length=30, alpha=0.7, **kwargs):
+
+    """
+    Summary:
+        Export a video with its tracking results drawn on it, without the GUI.
+
+    Args:
+        video_path: the path of the input video
+        output_path: the path of the output video
+        json_file_name: the name of the json results file (default: None -> <video>_tracking_results.json)
+        flags: a dictionary of drawing flags (default: None -> the default flags of the app)
+        trajectories_length: the length of the drawn trajectories (default: 30)
+        alpha: the opacity of the masks (default: 0.7)
+        **kwargs: passed to VideoExporter (fps, skip_empty_frames, workers, queue_size, fourcc)
+
+    Returns:
+        exported: True if the output video was written
+    """
+
+    if json_file_name is None:
+        json_file_name = os.path.splitext(video_path)[0] + "_tracking_results.json"
+    if flags is None:
+        flags = {"traj": False, "bbox": True, "id": True, "class": True, "mask": True, "polygons": True, "conf": True}
+    cap = cv2.VideoCapture(video_path)
+    nTotalFrames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    exporter = VideoExporter(video_path, output_path, json_file_name, nTotalFrames, flags, trajectories_length, alpha, **kwargs)
+    try:
+        return exporter.run()
+    finally:
+        helpers.close_frame_store(json_file_name)
@@ -6,6 +6,8 @@ from .canvas import Canvas
 
 from .color_dialog import ColorDialog
 
+from .file_list_model import FileListModel
+
 from .label_dialog import LabelDialog
 from .label_dialog import LabelQLineEdit
 
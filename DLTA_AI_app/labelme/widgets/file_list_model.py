@@ -0,0 +1,126 @@
+import os.path as osp
+import re
+
+from qtpy import QtCore
+from qtpy.QtCore import Qt
+
+
+class FileListModel(QtCore.QAbstractListModel):
+
+    """
+    Summary:
+        The model of the file list: the list view only asks for the rows it shows, so a directory of any size
+        is shown at once. The search filters the files in memory, on their paths relative to the opened directory
+        (a regular expression, e.g. ^train/ for a prefix, or plain text if it is not a valid one).
+    """
+
+    def __init__(self, parent=None):
+        super(FileListModel, self).__init__(parent)
+        self.root = None
+        self.files = []
+        self.relative = []
+        self.checked = []
+        self.nShapes = []
+        self.file_index = {}
+        self.rows = None
+        self.file_rows = {}
+        self.pattern = ""
+
+    def set_files(self, entries, root=None):
+
+        """
+        Summary:
+            Replace the files of the list.
+
+        Args:
+            entries: a list of (image path, has label file, number of shapes)
+            root: the opened directory, the search matches the paths relative to it (default: None -> the full paths)
+        """
+
+        self.beginResetModel()
+        self.root = root
+        self.files, self.checked, self.nShapes = [], [], []
+        self.relative = []
+        self.file_index = {}
+        self._append(entries)
+        self._filter()
+        self.endResetModel()
+
+    def add_files(self, entries):
+        self.beginResetModel()
+        self._append([entry for entry in entries if entry[0] not in self.file_index])
+        self._filter()
+        self.endResetModel()
+
+    def clear(self):
+        self.set_files([])
+
+    def _append(self, entries):
+        prefix = osp.join(self.root, "") if self.root else ""
+        for filename, checked, nShapes in entries:
+            self.file_index[filename] = len(self.files)
+            self.files.append(filename)
+            self.checked.append(checked)
+            self.nShapes.append(nShapes)
+            self.relative.append(filename[len(prefix):] if filename.startswith(prefix) else filename)
+
+    def set_filter(self, pattern):
+        self.beginResetModel()
+        self.pattern = pattern or ""
+        self._filter()
+        self.endResetModel()
+
+    def _filter(self):
+        # rows: the indices of the shown files in self.files (None -> all the files)
+        if not self.pattern:
+            self.rows = None
+            self.file_rows = self.file_index
+            return
+        try:
+            search = re.compile(self.pattern, re.IGNORECASE).search
+        except re.error:
+            pattern = self.pattern.lower()
+            search = lambda path: pattern in path.lower()
+        self.rows = [i for i, path in enumerate(self.relative) if search(path)]
+        self.file_rows = {self.files[i]: row for row, i in enumerate(self.rows)}
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.files) if self.rows is None else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i = index.row() if self.rows is None else self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return self.files[i]
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.checked[i] else Qt.Unchecked
+        if role == Qt.ToolTipRole and self.checked[i]:
+            return self.tr("%d shapes") % self.nShapes[i]
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def filenames(self):
+        # the shown files
+        return self.files if self.rows is None else [self.files[i] for i in self.rows]
+
+    def filename(self, row):
+        return self.files[row] if self.rows is None else self.files[self.rows[row]]
+
+    def row_of(self, filename):
+        # the row of a shown file, None if it is not shown
+        return self.file_rows.get(filename)
+
+    def set_checked(self, filename, checked, nShapes=0):
+        i = self.file_index.get(filename)
+        if i is None:
+            return
+        self.checked[i] = checked
+        self.nShapes[i] = nShapes
+        row = self.row_of(filename)
+        if row is not None:
+            self.dataChanged.emit(self.index(row), self.index(row))
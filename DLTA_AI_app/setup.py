@@ -153,6 +153,7 @@ def main():
                 "labelme_draw_label_png=labelme.cli.draw_label_png:main",
                 "labelme_json_to_dataset=labelme.cli.json_to_dataset:main",
                 "labelme_on_docker=labelme.cli.on_docker:main",
+                "labelme_export_video=labelme.cli.export_video:main",
             ],
         },
         data_files=[("share/man/man1", ["docs/man/labelme.1"])],